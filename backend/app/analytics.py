@@ -0,0 +1,233 @@
+"""Organization usage analytics over the hourly/daily usage rollups, cached per worker (see on_usage_event)."""
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from uuid import UUID
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+CACHE_SIZE = int(os.getenv("ANALYTICS_CACHE_SIZE", "1024"))
+CACHE_TTL_SEC = float(os.getenv("ANALYTICS_CACHE_TTL_SEC", "300"))
+MAX_BUCKETS = int(os.getenv("ANALYTICS_MAX_BUCKETS", "2000"))
+
+GRANULARITIES = ("hour", "day", "week")
+GROUP_BY = ("model", "user", "project")
+
+_STEP = {"hour": timedelta(hours=1), "day": timedelta(days=1), "week": timedelta(weeks=1)}
+
+
+class ResultCache:
+    """
+    LRU of query results keyed by (org, ...); every entry remembers its [start, end) for invalidation.
+    Usage is written by the jobs worker, out of this process, so the only invalidation signal is the
+    realtime listener: the cache serves and stores results only while set_live(True) is in effect.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: OrderedDict[tuple, tuple[float, datetime, datetime, object]] = OrderedDict()
+        # Bumped on every invalidation so a result computed across one is not stored (see put()).
+        self._epoch = 0
+        self._gen: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.live = False
+        self.hits = self.misses = self.invalidated = 0
+
+    def set_live(self, live: bool) -> None:
+        """Called by the listener; events missed while it was down make every entry suspect."""
+        with self._lock:
+            self.live = live
+            if not live:
+                self._epoch += 1
+                self.invalidated += len(self._data)
+                self._data.clear()
+
+    def generation(self, org: str) -> tuple[int, int]:
+        with self._lock:
+            return self._epoch, self._gen.get(org, 0)
+
+    def get(self, key: tuple):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key) if self.live else None
+            if entry is None or entry[0] <= now:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[3]
+
+    def put(self, key: tuple, start: datetime, end: datetime, value, gen: tuple[int, int]) -> None:
+        """Store unless key[0]'s org was invalidated after `gen` was taken: the result may predate that usage."""
+        with self._lock:
+            if not self.live or (self._epoch, self._gen.get(key[0], 0)) != gen:
+                return
+            self._data[key] = (time.monotonic() + self.ttl, start, end, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def invalidate(self, org: str | None, start: datetime | None, end: datetime | None) -> int:
+        """Drop entries of `org` (all orgs if None) overlapping [start, end]; a None bound is open."""
+        with self._lock:
+            if org is None:
+                self._epoch += 1
+            else:
+                self._gen[org] = self._gen.get(org, 0) + 1
+            stale = [
+                k
+                for k, (_, s, e, _) in self._data.items()
+                if (org is None or k[0] == org) and (end is None or s <= end) and (start is None or start < e)
+            ]
+            for k in stale:
+                del self._data[k]
+            self.invalidated += len(stale)
+            return len(stale)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "live": self.live,
+                "entries": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidated": self.invalidated,
+                "ttl_sec": self.ttl,
+            }
+
+
+cache = ResultCache(CACHE_SIZE, CACHE_TTL_SEC)
+
+
+def _parse_ts(value) -> datetime | None:
+    # -infinity / infinity from usage_rollup_rebuild() read as open bounds
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def on_usage_event(event: dict) -> None:
+    """NOTIFY payload of trg_usage_rollup / usage_rollup_rebuild (no org_id: every org)."""
+    cache.invalidate(event.get("org_id"), _parse_ts(event.get("from")), _parse_ts(event.get("to")))
+
+
+# ---------------- queries ----------------
+
+def _utc(t: datetime) -> datetime:
+    return t.replace(tzinfo=timezone.utc) if t.tzinfo is None else t.astimezone(timezone.utc)
+
+
+def _floor(t: datetime, granularity: str) -> datetime:
+    if granularity == "hour":
+        return t.replace(minute=0, second=0, microsecond=0)
+    t = t.replace(hour=0, minute=0, second=0, microsecond=0)
+    # Weeks start on Monday, as date_trunc('week', ...)
+    return t - timedelta(days=t.weekday()) if granularity == "week" else t
+
+
+def align(start: datetime, end: datetime, granularity: str) -> tuple[datetime, datetime]:
+    """Widen [start, end) to whole UTC buckets; naive datetimes are taken as UTC."""
+    if granularity not in _STEP:
+        raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+    start, end = _utc(start), _utc(end)
+    if end <= start:
+        raise ValueError("end must be after start")
+    lo, hi = _floor(start, granularity), _floor(end, granularity)
+    if hi < end:
+        hi += _STEP[granularity]
+    if (hi - lo) / _STEP[granularity] > MAX_BUCKETS:
+        raise ValueError(f"range spans more than {MAX_BUCKETS} {granularity} buckets")
+    return lo, hi
+
+
+_BUCKET = {
+    "hour": "r.bucket",
+    "day": "r.day::timestamp AT TIME ZONE 'UTC'",
+    "week": "date_trunc('week', r.day::timestamp) AT TIME ZONE 'UTC'",
+}
+_LABEL = {
+    "model": ("r.model_id", "x.name", "LEFT JOIN models x ON x.id = g.key_id"),
+    "user": ("r.user_id", "x.username::text", "LEFT JOIN users x ON x.id = g.key_id"),
+    "project": ("r.project_id", "x.name", "LEFT JOIN projects x ON x.id = g.key_id"),
+    None: ("NULL", "NULL", ""),
+}
+
+
+def _series_sql(granularity: str, group_by: str | None):
+    table, col = ("usage_rollup_hourly", "bucket") if granularity == "hour" else ("usage_rollup_daily", "day")
+    key, label, join = _LABEL[group_by]
+    return text(
+        f"""
+        WITH g AS (
+          SELECT {_BUCKET[granularity]} AS bucket, {key} AS key_id,
+                 SUM(r.calls)::bigint AS calls, SUM(r.tokens_in)::bigint AS tokens_in,
+                 SUM(r.tokens_out)::bigint AS tokens_out, SUM(r.cost) AS cost
+          FROM {table} r
+          WHERE r.organization_id = :org AND r.{col} >= :lo AND r.{col} < :hi
+          GROUP BY 1, 2
+        )
+        SELECT g.bucket, g.key_id::text AS key, {label} AS label, g.calls, g.tokens_in, g.tokens_out, g.cost
+        FROM g {join}
+        ORDER BY g.bucket, g.calls DESC
+        """
+    )
+
+
+# Built once: one statement per (granularity, group_by)
+_SERIES = {(g, b): _series_sql(g, b) for g in GRANULARITIES for b in (None, *GROUP_BY)}
+
+_MODEL_USAGE_SQL = text(
+    """
+    SELECT model_id, model_name, total_tokens_in, total_tokens_out, calls, total_cost
+    FROM fn_model_usage_report(:org, :lo, :hi)
+    """
+)
+
+_PROJECT_REPORT_SQL = text(
+    """
+    SELECT project_id, project_name, chat_count, message_count, active_member_count, last_activity
+    FROM fn_project_report(:org)
+    ORDER BY last_activity DESC NULLS LAST, project_name
+    """
+)
+
+
+def _cached(db: Session, key: tuple, lo: datetime, hi: datetime, stmt, params: dict) -> list[dict]:
+    rows = cache.get(key)
+    if rows is None:
+        gen = cache.generation(key[0])
+        rows = [dict(r) for r in db.execute(stmt, params).mappings()]
+        cache.put(key, lo, hi, rows, gen)
+    return rows
+
+
+def usage_series(
+    db: Session, org_id: UUID, start: datetime, end: datetime, granularity: str = "day", group_by: str | None = None
+) -> tuple[datetime, datetime, list[dict]]:
+    """Usage per bucket (and per model/user/project) over the aligned range; returns (start, end, rows)."""
+    if group_by not in _LABEL:
+        raise ValueError(f"group_by must be one of {', '.join(GROUP_BY)}")
+    lo, hi = align(start, end, granularity)
+    if granularity == "hour":
+        params = {"org": org_id, "lo": lo, "hi": hi}
+    else:
+        params = {"org": org_id, "lo": lo.date(), "hi": hi.date()}
+    key = (str(org_id), "series", granularity, group_by, lo, hi)
+    return lo, hi, _cached(db, key, lo, hi, _SERIES[granularity, group_by], params)
+
+
+def model_usage(db: Session, org_id: UUID, start: datetime, end: datetime) -> tuple[datetime, datetime, list[dict]]:
+    """fn_model_usage_report over whole UTC days covering [start, end)."""
+    lo, hi = align(start, end, "day")
+    key = (str(org_id), "models", lo, hi)
+    return lo, hi, _cached(db, key, lo, hi, _MODEL_USAGE_SQL, {"org": org_id, "lo": lo.date(), "hi": hi.date()})
+
+
+def project_report(db: Session, org_id: UUID) -> list[dict]:
+    """fn_project_report: project_stats counters, already maintained by triggers, so not cached."""
+    return [dict(r) for r in db.execute(_PROJECT_REPORT_SQL, {"org": org_id}).mappings()]
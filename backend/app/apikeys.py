@@ -0,0 +1,118 @@
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from dataclasses import dataclass
+from uuid import UUID
+
+from sqlalchemy import select, text
+from sqlalchemy.orm import Session
+
+from .coalesce import WriteCoalescer
+from .models import ApiKey
+from .timeutil import utcnow
+
+KEY_PREFIX = "cgpt_"
+API_KEY_PEPPER = (os.getenv("API_KEY_PEPPER") or os.getenv("JWT_SECRET", "change-me")).encode("utf-8")
+CACHE_TTL_SEC = float(os.getenv("API_KEY_CACHE_TTL_SEC", "60"))
+NEGATIVE_TTL_SEC = float(os.getenv("API_KEY_NEGATIVE_TTL_SEC", "30"))
+CACHE_MAX_ENTRIES = int(os.getenv("API_KEY_CACHE_MAX", "10000"))
+USAGE_FLUSH_SEC = float(os.getenv("API_KEY_USAGE_FLUSH_SEC", "30"))
+
+SCOPES = {"chat:read", "chat:write", "projects:read", "projects:write", "analytics:read", "admin"}
+DEFAULT_SCOPES = ["chat:read", "chat:write"]
+
+
+@dataclass(frozen=True)
+class VerifiedKey:
+    key_id: UUID
+    user_id: UUID
+    scopes: frozenset[str]
+
+
+def hash_key(plaintext: str) -> str:
+    # Keys carry 256 bits of randomness, so a keyed fast hash is enough; bcrypt would cost ~250ms/request.
+    return hmac.new(API_KEY_PEPPER, plaintext.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def generate_key() -> tuple[str, str, str]:
+    """Return (plaintext, key_prefix, key_hash). The plaintext is shown to the user once."""
+    prefix = secrets.token_hex(4)
+    plaintext = f"{KEY_PREFIX}{prefix}_{secrets.token_urlsafe(32)}"
+    return plaintext, prefix, hash_key(plaintext)
+
+
+def _parse_prefix(plaintext: str) -> str | None:
+    if not plaintext.startswith(KEY_PREFIX):
+        return None
+    prefix, sep, secret = plaintext[len(KEY_PREFIX):].partition("_")
+    if not sep or not secret or not 6 <= len(prefix) <= 16:
+        return None
+    return prefix
+
+
+def is_api_key(token: str) -> bool:
+    return token.startswith(KEY_PREFIX)
+
+
+_cache: dict[str, tuple[float, VerifiedKey | None]] = {}
+_cache_lock = threading.Lock()
+
+
+def _remember(key_hash: str, value: VerifiedKey | None, ttl: float) -> None:
+    with _cache_lock:
+        if len(_cache) >= CACHE_MAX_ENTRIES:
+            now = time.monotonic()
+            for k in [k for k, (exp, _) in _cache.items() if exp <= now]:
+                del _cache[k]
+            if len(_cache) >= CACHE_MAX_ENTRIES:
+                _cache.clear()
+        _cache[key_hash] = (time.monotonic() + ttl, value)
+
+
+def invalidate(key_hash: str) -> None:
+    with _cache_lock:
+        _cache.pop(key_hash, None)
+
+
+def _flush_usage(db: Session, items: dict) -> None:
+    db.execute(
+        text("UPDATE api_keys SET last_used_at = :ts, last_ip = CAST(:ip AS inet) WHERE id = :id"),
+        [{"id": str(key_id), "ts": ts, "ip": ip} for key_id, (ts, ip) in items.items()],
+    )
+
+
+usage = WriteCoalescer("api-key-usage", _flush_usage, USAGE_FLUSH_SEC)
+
+
+def verify(db: Session, plaintext: str, client_ip: str | None) -> VerifiedKey | None:
+    """
+    Resolve an API key. Verified and unknown keys are both cached by hash, so repeat requests
+    never touch api_keys; last_used_at/last_ip are coalesced and written in the background.
+    """
+    prefix = _parse_prefix(plaintext)
+    if prefix is None:
+        return None
+    key_hash = hash_key(plaintext)
+
+    hit = _cache.get(key_hash)
+    if hit and hit[0] > time.monotonic():
+        found = hit[1]
+    else:
+        found = None
+        rows = db.execute(
+            select(ApiKey.id, ApiKey.user_id, ApiKey.key_hash, ApiKey.scopes).where(
+                ApiKey.key_prefix == prefix, ApiKey.is_active == True
+            )
+        ).all()
+        for r in rows:
+            if hmac.compare_digest(r.key_hash, key_hash):
+                found = VerifiedKey(key_id=r.id, user_id=r.user_id, scopes=frozenset(r.scopes or ()))
+                break
+        _remember(key_hash, found, CACHE_TTL_SEC if found else NEGATIVE_TTL_SEC)
+
+    if found:
+        usage.put(found.key_id, (utcnow(), client_ip))
+    return found
@@ -0,0 +1,185 @@
+"""
+Monthly invoice generation, resumable from the last committed batch.
+
+Usage (from backend/):
+    DATABASE_URL=postgresql+psycopg://... python -m app.billing 2026-09 [--batch 500] [--restart]
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from datetime import date, datetime, time as dtime, timezone
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .db import SessionLocal
+
+BATCH = int(os.getenv("BILLING_BATCH", "500"))
+CURRENCY = "USD"
+# Flat monthly fee per plan, added to the metered usage cost.
+PLAN_MONTHLY_FEE = {"free": 0, "pro": 20, "enterprise": 500}
+
+logger = logging.getLogger("billing")
+
+_CLAIM_RUN_SQL = text(
+    """
+    INSERT INTO billing_runs (period_from, period_to)
+    VALUES (:pf, :pt)
+    ON CONFLICT (period_from, period_to) DO UPDATE SET updated_at = now()
+    RETURNING last_org_id, orgs_done, invoices_written, finished_at
+    """
+)
+
+_RESET_RUN_SQL = text(
+    """
+    UPDATE billing_runs
+    SET last_org_id = NULL, orgs_done = 0, invoices_written = 0, finished_at = NULL, started_at = now(), updated_at = now()
+    WHERE period_from = :pf AND period_to = :pt
+    """
+)
+
+_NEXT_ORGS_SQL = text(
+    """
+    SELECT id FROM organizations
+    WHERE (CAST(:after AS uuid) IS NULL OR id > CAST(:after AS uuid))
+    ORDER BY id
+    LIMIT :n
+    """
+)
+
+# One statement per batch: aggregate the period's events for these orgs, add the plan fee, upsert drafts.
+# Issued/paid/void invoices are never touched (the WHERE on DO UPDATE skips them).
+_UPSERT_INVOICES_SQL = text(
+    """
+    WITH agg AS (
+      SELECT ue.organization_id,
+             COUNT(*)::bigint       AS events,
+             SUM(ue.tokens_in)::bigint  AS tokens_in,
+             SUM(ue.tokens_out)::bigint AS tokens_out,
+             SUM(ue.cost)           AS usage_cost
+      FROM usage_events ue
+      WHERE ue.organization_id = ANY(CAST(:orgs AS uuid[]))
+        AND ue.happened_at >= :ts_from AND ue.happened_at < :ts_to
+      GROUP BY ue.organization_id
+    ),
+    totals AS (
+      SELECT o.id AS organization_id,
+             o.plan,
+             COALESCE((CAST(:fees AS jsonb) ->> o.plan)::numeric, 0) AS plan_fee,
+             COALESCE(u.usage_cost, 0) AS usage_cost,
+             COALESCE(u.events, 0) AS events,
+             COALESCE(u.tokens_in, 0) AS tokens_in,
+             COALESCE(u.tokens_out, 0) AS tokens_out
+      FROM organizations o
+      LEFT JOIN agg u ON u.organization_id = o.id
+      WHERE o.id = ANY(CAST(:orgs AS uuid[]))
+    )
+    INSERT INTO invoices (organization_id, status, period_from, period_to, currency, amount_total, meta, created_at)
+    SELECT t.organization_id, 'draft', :pf, :pt, :currency,
+           round(t.plan_fee + t.usage_cost, 2),
+           jsonb_build_object(
+             'plan', t.plan, 'plan_fee', t.plan_fee, 'usage_cost', t.usage_cost,
+             'events', t.events, 'tokens_in', t.tokens_in, 'tokens_out', t.tokens_out
+           ),
+           now()
+    FROM totals t
+    WHERE t.plan_fee > 0 OR t.events > 0
+    ON CONFLICT (organization_id, period_from, period_to) DO UPDATE
+      SET amount_total = EXCLUDED.amount_total, meta = EXCLUDED.meta, currency = EXCLUDED.currency
+      WHERE invoices.status = 'draft'
+    """
+)
+
+_CHECKPOINT_SQL = text(
+    """
+    UPDATE billing_runs
+    SET last_org_id = :last, orgs_done = orgs_done + :n, invoices_written = invoices_written + :written, updated_at = now()
+    WHERE period_from = :pf AND period_to = :pt
+    """
+)
+
+_FINISH_SQL = text("UPDATE billing_runs SET finished_at = now(), updated_at = now() WHERE period_from = :pf AND period_to = :pt")
+
+
+def month_bounds(month: str) -> tuple[date, date]:
+    """'2026-09' -> (2026-09-01, 2026-09-30), the inclusive invoice period."""
+    y, m = (int(x) for x in month.split("-"))
+    nxt = date(y + (m == 12), m % 12 + 1, 1)
+    return date(y, m, 1), date.fromordinal(nxt.toordinal() - 1)
+
+
+def run_period(db: Session, period_from: date, period_to: date, batch: int = BATCH, restart: bool = False) -> dict:
+    """Generate draft invoices for [period_from, period_to]. Returns counters for this invocation."""
+    params = {"pf": period_from, "pt": period_to}
+    if restart:
+        db.execute(_RESET_RUN_SQL, params)
+    run = db.execute(_CLAIM_RUN_SQL, params).one()
+    db.commit()
+
+    # Events are bucketed by UTC day regardless of the session time zone.
+    ts_from = datetime.combine(period_from, dtime.min, tzinfo=timezone.utc)
+    ts_to = datetime.combine(date.fromordinal(period_to.toordinal() + 1), dtime.min, tzinfo=timezone.utc)
+    fees = json.dumps(PLAN_MONTHLY_FEE)
+    after = run.last_org_id
+    orgs = written = 0
+    started = time.perf_counter()
+    while True:
+        ids = db.execute(_NEXT_ORGS_SQL, {"after": after, "n": batch}).scalars().all()
+        if not ids:
+            break
+        str_ids = [str(i) for i in ids]
+        n_written = db.execute(
+            _UPSERT_INVOICES_SQL,
+            {**params, "orgs": str_ids, "ts_from": ts_from, "ts_to": ts_to, "fees": fees, "currency": CURRENCY},
+        ).rowcount
+        after = ids[-1]
+        db.execute(_CHECKPOINT_SQL, {**params, "last": after, "n": len(ids), "written": n_written})
+        db.commit()
+        orgs += len(ids)
+        written += n_written
+        logger.info("billed %d orgs (%d invoices) through %s", orgs, written, after)
+        if len(ids) < batch:
+            break
+
+    db.execute(_FINISH_SQL, params)
+    db.commit()
+    elapsed = time.perf_counter() - started
+    return {
+        "orgs": orgs,
+        "invoices": written,
+        "seconds": elapsed,
+        "orgs_per_sec": orgs / elapsed if elapsed else 0.0,
+        "resumed": run.last_org_id is not None and not restart,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("month", help="billing month, YYYY-MM")
+    parser.add_argument("--batch", type=int, default=BATCH)
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and recompute all drafts")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [billing] %(levelname)s %(message)s")
+
+    period_from, period_to = month_bounds(args.month)
+    db = SessionLocal()
+    try:
+        stats = run_period(db, period_from, period_to, batch=args.batch, restart=args.restart)
+    finally:
+        db.close()
+    logger.info(
+        "period %s..%s: %d orgs, %d invoices in %.1fs (%.0f orgs/s)%s",
+        period_from,
+        period_to,
+        stats["orgs"],
+        stats["invoices"],
+        stats["seconds"],
+        stats["orgs_per_sec"],
+        " [resumed]" if stats["resumed"] else "",
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import logging
+import threading
+
+from .db import SessionLocal
+
+logger = logging.getLogger("coalesce")
+
+
+class WriteCoalescer:
+    """
+    Keep only the latest value per key and write them in one batch every `interval` seconds,
+    instead of one UPDATE per request. `flush_fn(db, items)` gets a dict of pending values.
+    """
+
+    def __init__(self, name: str, flush_fn, interval: float):
+        self.name = name
+        self.interval = interval
+        self._flush_fn = flush_fn
+        self._pending: dict = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._pending[key] = value
+
+    def flush(self) -> int:
+        with self._lock:
+            items, self._pending = self._pending, {}
+        if not items:
+            return 0
+        db = SessionLocal()
+        try:
+            self._flush_fn(db, items)
+            db.commit()
+        except Exception:
+            db.rollback()
+            logger.exception("%s: flush of %d items failed", self.name, len(items))
+            # Keep the values for the next round unless newer ones arrived meanwhile.
+            with self._lock:
+                for k, v in items.items():
+                    self._pending.setdefault(k, v)
+            return 0
+        finally:
+            db.close()
+        return len(items)
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name=f"coalesce-{self.name}", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self.flush()
@@ -0,0 +1,270 @@
+"""
+Move dead rows out of the hot tables.
+
+Usage (from backend/):
+    DATABASE_URL=postgresql+psycopg://... python -m app.compaction [--once] [--interval 300]
+
+Chats soft-deleted more than COMPACT_DELETED_AFTER_DAYS ago, chats archived and untouched for
+COMPACT_ARCHIVED_AFTER_DAYS, and soft-deleted messages of live chats are copied into the *_archive
+tables and deleted from chats/messages (members, tags and stats go with them; replies to a moved
+message are re-parented to its nearest surviving ancestor so branches stay connected). Every batch is its own
+short transaction with a lock_timeout and SKIP LOCKED, so the job never queues behind user traffic;
+per-row audit/aggregate/notify triggers are switched off for the move (clown_gpt.bulk_move) and the
+affected stats are recounted once per batch. restore_chat() brings an archived chat back.
+Expired idempotency keys are swept on the same schedule.
+"""
+import argparse
+import logging
+import os
+import time
+from datetime import timedelta
+from uuid import UUID
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from . import idempotency, jobs, tiering
+from .db import SessionLocal
+from .models import Chat, ChatMember, ChatTag, Message
+from .timeutil import utcnow
+
+DELETED_AFTER = timedelta(days=float(os.getenv("COMPACT_DELETED_AFTER_DAYS", "7")))
+ARCHIVED_AFTER = timedelta(days=float(os.getenv("COMPACT_ARCHIVED_AFTER_DAYS", "90")))
+CHAT_BATCH = int(os.getenv("COMPACT_CHAT_BATCH", "200"))
+MESSAGE_BATCH = int(os.getenv("COMPACT_MESSAGE_BATCH", "5000"))
+LOCK_TIMEOUT = os.getenv("COMPACT_LOCK_TIMEOUT", "2s")
+
+logger = logging.getLogger("compaction")
+
+
+def _cols(model, alias: str = "", overrides: dict | None = None) -> str:
+    # Column lists come from the models so the archive copy survives column reordering in the hot tables.
+    overrides = overrides or {}
+    return ", ".join(overrides.get(c.name, f"{alias}{c.name}") for c in model.__table__.columns)
+
+
+CHAT_COLS = _cols(Chat)
+MESSAGE_COLS = _cols(Message)
+MEMBER_COLS = _cols(ChatMember)
+TAG_COLS = _cols(ChatTag)
+
+
+def _begin_bulk(db: Session, lock_timeout: bool = True) -> None:
+    # The lock_timeout is for the job's own batch transactions only: restore_chat() runs inside a request
+    if lock_timeout:
+        db.execute(text("SELECT set_config('lock_timeout', :v, true)"), {"v": LOCK_TIMEOUT})
+    db.execute(text("SELECT set_config('clown_gpt.bulk_move', 'on', true)"))
+
+
+_PICK_CHATS_SQL = text(
+    """
+    SELECT id, project_id FROM chats
+    WHERE deleted_at < :deleted_cut OR (status = 'archived' AND updated_at < :archived_cut)
+    ORDER BY id
+    LIMIT :n
+    FOR UPDATE SKIP LOCKED
+    """
+)
+
+
+def archive_chats_batch(db: Session, batch: int = CHAT_BATCH) -> int:
+    """Move one batch of expired chats (with messages, members and tags) into the archive tables."""
+    now = utcnow()
+    _begin_bulk(db)
+    picked = db.execute(
+        _PICK_CHATS_SQL, {"deleted_cut": now - DELETED_AFTER, "archived_cut": now - ARCHIVED_AFTER, "n": batch}
+    ).all()
+    if not picked:
+        db.rollback()
+        return 0
+    ids = [str(r.id) for r in picked]
+    projects = sorted({str(r.project_id) for r in picked if r.project_id})
+    p = {"ids": ids}
+    # Chats in cold storage get their messages back first, so the archive copy is complete.
+    cold_keys = [tiering.rehydrate(db, chat_id) for chat_id in ids]
+
+    db.execute(text(f"INSERT INTO chats_archive ({CHAT_COLS}) SELECT {CHAT_COLS} FROM chats WHERE id = ANY(CAST(:ids AS uuid[]))"), p)
+    db.execute(
+        text(f"INSERT INTO messages_archive ({MESSAGE_COLS}) SELECT {MESSAGE_COLS} FROM messages WHERE chat_id = ANY(CAST(:ids AS uuid[]))"), p
+    )
+    db.execute(
+        text(f"INSERT INTO chat_members_archive ({MEMBER_COLS}) SELECT {MEMBER_COLS} FROM chat_members WHERE chat_id = ANY(CAST(:ids AS uuid[]))"), p
+    )
+    db.execute(
+        text(f"INSERT INTO chat_tags_archive ({TAG_COLS}) SELECT {TAG_COLS} FROM chat_tags WHERE chat_id = ANY(CAST(:ids AS uuid[]))"), p
+    )
+    # Cascades take messages, members, tags and chat_stats with the chats.
+    db.execute(text("DELETE FROM chats WHERE id = ANY(CAST(:ids AS uuid[]))"), p)
+    if projects:
+        db.execute(text("SELECT project_stats_recount(p) FROM unnest(CAST(:p AS uuid[])) p"), {"p": projects})
+    db.commit()
+    for key in cold_keys:
+        tiering.discard(key)
+    return len(ids)
+
+
+_PICK_MESSAGES_SQL = text(
+    """
+    SELECT id, parent_id, chat_id FROM messages
+    WHERE deleted_at < :cut
+    ORDER BY deleted_at
+    LIMIT :n
+    FOR UPDATE SKIP LOCKED
+    """
+)
+
+_REPARENT_SQL = text(
+    """
+    WITH v AS (
+      SELECT * FROM unnest(CAST(:ids AS bigint[]), CAST(:ancestors AS bigint[]), CAST(:chats AS uuid[])) AS v(id, ancestor, chat_id)
+    ), children AS (
+      UPDATE messages c SET parent_id = v.ancestor
+      FROM v WHERE c.parent_id = v.id AND c.id <> ALL(CAST(:ids AS bigint[]))
+    )
+    UPDATE chats ch SET active_leaf_id = v.ancestor
+    FROM v WHERE ch.id = v.chat_id AND ch.active_leaf_id = v.id
+    """
+)
+
+_MOVE_MESSAGES_SQL = text(
+    f"""
+    WITH moved AS (
+      DELETE FROM messages WHERE id = ANY(CAST(:ids AS bigint[]))
+      RETURNING {MESSAGE_COLS}
+    )
+    INSERT INTO messages_archive ({MESSAGE_COLS})
+    SELECT {MESSAGE_COLS} FROM moved
+    """
+)
+
+
+def archive_messages_batch(db: Session, batch: int = MESSAGE_BATCH) -> int:
+    """Move one batch of soft-deleted messages; they are already excluded from chat/project stats."""
+    _begin_bulk(db)
+    picked = db.execute(_PICK_MESSAGES_SQL, {"cut": utcnow() - DELETED_AFTER, "n": batch}).all()
+    if not picked:
+        db.commit()
+        return 0
+    parents = {r.id: r.parent_id for r in picked}
+    ancestors = []
+    for r in picked:
+        a = r.parent_id
+        while a in parents:
+            a = parents[a]
+        ancestors.append(a)
+    ids = [r.id for r in picked]
+    db.execute(_REPARENT_SQL, {"ids": ids, "ancestors": ancestors, "chats": [r.chat_id for r in picked]})
+    n = db.execute(_MOVE_MESSAGES_SQL, {"ids": ids}).rowcount
+    db.commit()
+    return n
+
+
+def archived_owner(db: Session, chat_id: UUID) -> UUID | None:
+    return db.execute(text("SELECT owner_user_id FROM chats_archive WHERE id = :id"), {"id": str(chat_id)}).scalar_one_or_none()
+
+
+def restore_chat(db: Session, chat_id: UUID) -> bool:
+    """
+    Copy an archived chat back into the hot tables and drop it from the archive. The caller commits.
+    A project or tag deleted in the meantime is dropped from the restored chat instead of failing.
+    """
+    p = {"id": str(chat_id)}
+    _begin_bulk(db, lock_timeout=False)
+    select_chat = _cols(
+        Chat,
+        "a.",
+        {
+            "project_id": "(SELECT pr.id FROM projects pr WHERE pr.id = a.project_id AND pr.deleted_at IS NULL)",
+            "organization_id": "(SELECT o.id FROM organizations o WHERE o.id = a.organization_id)",
+        },
+    )
+    n = db.execute(
+        text(f"INSERT INTO chats ({CHAT_COLS}) SELECT {select_chat} FROM chats_archive a WHERE a.id = :id ON CONFLICT (id) DO NOTHING"), p
+    ).rowcount
+    if not n:
+        db.execute(text("SELECT set_config('clown_gpt.bulk_move', 'off', true)"))
+        return False
+    db.execute(text(f"INSERT INTO messages ({MESSAGE_COLS}) SELECT {MESSAGE_COLS} FROM messages_archive WHERE chat_id = :id ORDER BY id"), p)
+    db.execute(
+        text(
+            f"""
+            INSERT INTO chat_members ({MEMBER_COLS})
+            SELECT {_cols(ChatMember, 'a.')} FROM chat_members_archive a
+            JOIN users u ON u.id = a.user_id
+            WHERE a.chat_id = :id
+            """
+        ),
+        p,
+    )
+    db.execute(
+        text(
+            f"""
+            INSERT INTO chat_tags ({TAG_COLS})
+            SELECT {_cols(ChatTag, 'a.')} FROM chat_tags_archive a
+            JOIN tags t ON t.id = a.tag_id
+            WHERE a.chat_id = :id
+            """
+        ),
+        p,
+    )
+    for table in ("chat_tags_archive", "chat_members_archive"):
+        db.execute(text(f"DELETE FROM {table} WHERE chat_id = :id"), p)
+    db.execute(text("DELETE FROM messages_archive WHERE chat_id = :id"), p)
+    db.execute(text("DELETE FROM chats_archive WHERE id = :id"), p)
+
+    db.execute(text("SELECT chat_stats_recount(:id)"), p)
+    # The project recount reads every chat of the project, so it runs in a job rather than in the request
+    jobs.enqueue(db, "chat_stats_reconcile", {"chat_id": str(chat_id)}, priority=jobs.PRIORITY_HIGH, dedupe_key=f"stats:{chat_id}")
+    db.execute(text("SELECT set_config('clown_gpt.bulk_move', 'off', true)"))
+    return True
+
+
+def run_once(db: Session) -> dict:
+    """Drain everything that is due, batch by batch. A batch that hits lock_timeout is retried next run."""
+    moved = {"chats": 0, "messages": 0}
+    for key, step in (("chats", archive_chats_batch), ("messages", archive_messages_batch)):
+        while True:
+            try:
+                n = step(db)
+            except OperationalError as e:
+                db.rollback()
+                logger.warning("%s batch skipped: %s", key, e.orig)
+                break
+            moved[key] += n
+            if not n:
+                break
+    # Expired idempotency keys are dead rows too
+    moved["idempotency_keys"] = idempotency.sweep_expired(db)
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--once", action="store_true", help="run a single pass and exit")
+    parser.add_argument("--interval", type=float, default=float(os.getenv("COMPACT_INTERVAL_SEC", "300")))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [compaction] %(levelname)s %(message)s")
+
+    while True:
+        db = SessionLocal()
+        try:
+            t0 = time.perf_counter()
+            moved = run_once(db)
+            if any(moved.values()):
+                logger.info(
+                    "archived %d chats, %d messages, dropped %d idempotency keys in %.1fs",
+                    moved["chats"],
+                    moved["messages"],
+                    moved["idempotency_keys"],
+                    time.perf_counter() - t0,
+                )
+        finally:
+            db.close()
+        if args.once:
+            return
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import select, text
+from sqlalchemy import Text, and_, bindparam, case, cast, delete, func, literal, or_, select, text, true, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import aliased
 from uuid import UUID
 
 from .models import (
@@ -8,28 +10,37 @@ from .models import (
     Organization,
     OrganizationMember,
     Chat,
+    ChatMember,
+    ChatStats,
+    ChatTag,
     Message,
+    Project,
+    ProjectMember,
+    ProjectStats,
+    Tag,
+    membership_role,
 )
 from .timeutil import utcnow
-from . import llm
+from . import jobs, llm
+
+# Visible messages of the branch sent to the LLM with a new prompt
+HISTORY_MESSAGES = 15
+
+# Statements run on (nearly) every request are built once at import, with bind parameters, instead of
+# per call: that skips building the expression and its cache key, and the SQL string stays identical,
+# so psycopg can prepare it server-side (see DB_PREPARE_THRESHOLD in db.py).
+_SET_ACTOR_SQL = text("SELECT set_config('clown_gpt.current_user_id', :v, true)")
 
 
 def set_actor(db: Session, user_id: UUID) -> None:
-    db.execute(
-        text("SELECT set_config('clown_gpt.current_user_id', :v, true)"),
-        {"v": str(user_id)},
-    )
+    db.execute(_SET_ACTOR_SQL, {"v": str(user_id)})
 
 
 def ensure_personal_org(db: Session, user: User) -> Organization:
-    org = (
-        db.execute(
-            select(Organization)
-            .join(OrganizationMember, OrganizationMember.organization_id == Organization.id)
-            .where(OrganizationMember.user_id == user.id)
-        )
-        .scalar_one_or_none()
-    )
+    # Membership in someone else's organization does not count: the personal org is one the user owns.
+    org = db.execute(
+        select(Organization).where(Organization.owner_user_id == user.id).order_by(Organization.created_at).limit(1)
+    ).scalar_one_or_none()
     if org:
         return org
 
@@ -64,6 +75,16 @@ def ensure_personal_org(db: Session, user: User) -> Organization:
     return org
 
 
+def get_org_role(db: Session, org_id, user_id) -> str | None:
+    return db.execute(
+        select(OrganizationMember.member_role).where(
+            OrganizationMember.organization_id == org_id,
+            OrganizationMember.user_id == user_id,
+            OrganizationMember.is_active == True,
+        )
+    ).scalar_one_or_none()
+
+
 def get_active_model_by_name(db: Session, model_name: str) -> LLMModel:
     m = db.execute(
         select(LLMModel).where(LLMModel.name == model_name, LLMModel.is_active == True)
@@ -73,80 +94,536 @@ def get_active_model_by_name(db: Session, model_name: str) -> LLMModel:
     return m
 
 
+_CHAT_OWNER_SQL = text(
+    """
+    INSERT INTO chat_members(chat_id, user_id, member_role, muted, joined_at)
+    VALUES (:c, :u, 'owner', false, now())
+    ON CONFLICT (chat_id, user_id) DO NOTHING
+    """
+)
+
+_PROJECT_OWNER_SQL = text(
+    """
+    INSERT INTO project_members(project_id, user_id, member_role, can_invite, is_favorite, joined_at)
+    VALUES (:p, :u, 'owner', true, true, now())
+    ON CONFLICT (project_id, user_id) DO NOTHING
+    """
+)
+
+
 def ensure_chat_member_owner(db: Session, chat_id, user_id) -> None:
-    db.execute(
-        text(
-            """
-            INSERT INTO chat_members(chat_id, user_id, member_role, muted, joined_at)
-            VALUES (:c, :u, 'owner', false, now())
-            ON CONFLICT (chat_id, user_id) DO NOTHING
-            """
-        ),
-        {"c": str(chat_id), "u": str(user_id)},
-    )
+    db.execute(_CHAT_OWNER_SQL, {"c": str(chat_id), "u": str(user_id)})
 
 
 def ensure_project_member_owner(db: Session, project_id, user_id) -> None:
+    db.execute(_PROJECT_OWNER_SQL, {"p": str(project_id), "u": str(user_id)})
+
+
+# Higher rank includes the rights of the lower ones.
+ROLE_RANK = {"viewer": 1, "editor": 2, "owner": 3}
+
+
+def role_at_least(role: str | None, min_role: str) -> bool:
+    return role is not None and ROLE_RANK[role] >= ROLE_RANK[min_role]
+
+
+def chat_role_expr():
+    # membership_role is declared owner < editor < viewer, so LEAST picks the strongest grant. A project role
+    # reaches the project's chats capped at editor: deleting and sharing a chat stay with its own owners.
+    project_role = case(
+        (ProjectMember.member_role == "owner", cast(literal("editor"), membership_role)), else_=ProjectMember.member_role
+    )
+    return func.least(ChatMember.member_role, project_role, type_=membership_role).label("role")
+
+
+def with_chat_access(stmt, user_id, include_deleted: bool = False):
+    """
+    Outer-join the caller's direct chat membership and membership of the chat's project (both PK lookups).
+    Soft-deleted chats are hidden unless include_deleted (only restore needs them).
+    """
+    stmt = stmt.outerjoin(
+        ChatMember, and_(ChatMember.chat_id == Chat.id, ChatMember.user_id == user_id)
+    ).outerjoin(
+        ProjectMember, and_(ProjectMember.project_id == Chat.project_id, ProjectMember.user_id == user_id)
+    )
+    return stmt if include_deleted else stmt.where(Chat.deleted_at.is_(None))
+
+
+_CHAT_WITH_ROLE = {
+    deleted: with_chat_access(select(Chat, chat_role_expr()), bindparam("user_id"), deleted).where(
+        Chat.id == bindparam("chat_id")
+    )
+    for deleted in (False, True)
+}
+
+_CHAT_ROLE = with_chat_access(select(chat_role_expr()).select_from(Chat), bindparam("user_id")).where(
+    Chat.id == bindparam("chat_id")
+)
+
+# A project membership wins; otherwise active members of the project's organization view non-private projects.
+_PROJECT_ROLE = text(
+    """
+    SELECT COALESCE(pm.member_role::text, CASE WHEN om.user_id IS NOT NULL AND p.visibility <> 'private' THEN 'viewer' END)
+    FROM projects p
+    LEFT JOIN project_members pm ON pm.project_id = p.id AND pm.user_id = :user_id
+    LEFT JOIN organization_members om ON om.organization_id = p.organization_id AND om.user_id = :user_id AND om.is_active
+    WHERE p.id = :project_id
+    """
+)
+
+
+def get_chat_with_role(db: Session, chat_id, user_id, include_deleted: bool = False) -> tuple[Chat | None, str | None]:
+    row = db.execute(_CHAT_WITH_ROLE[include_deleted], {"chat_id": chat_id, "user_id": user_id}).one_or_none()
+    if not row:
+        return None, None
+    return row[0], row.role
+
+
+def get_chat_role(db: Session, chat_id, user_id) -> str | None:
+    return db.execute(_CHAT_ROLE, {"chat_id": chat_id, "user_id": user_id}).scalar_one_or_none()
+
+
+def get_project_role(db: Session, project_id, user_id) -> str | None:
+    return db.execute(_PROJECT_ROLE, {"project_id": project_id, "user_id": user_id}).scalar_one_or_none()
+
+
+def upsert_member(db: Session, member_model, key_column: str, key, user_id, role: str) -> None:
+    """Grant or change a chat/project membership; member_model is ChatMember or ProjectMember."""
     db.execute(
-        text(
-            """
-            INSERT INTO project_members(project_id, user_id, member_role, can_invite, is_favorite, joined_at)
-            VALUES (:p, :u, 'owner', true, true, now())
-            ON CONFLICT (project_id, user_id) DO NOTHING
-            """
-        ),
-        {"p": str(project_id), "u": str(user_id)},
+        pg_insert(member_model)
+        .values({key_column: key, "user_id": user_id, "member_role": role, "joined_at": utcnow()})
+        .on_conflict_do_update(index_elements=[key_column, "user_id"], set_={"member_role": role})
+    )
+
+
+def list_members(db: Session, member_model, key_column: str, key) -> list[dict]:
+    rows = db.execute(
+        select(
+            member_model.user_id,
+            User.username,
+            member_model.member_role.label("role"),
+            member_model.joined_at,
+        )
+        .join(User, User.id == member_model.user_id)
+        .where(getattr(member_model, key_column) == key)
+        .order_by(member_model.joined_at)
+    ).mappings()
+    return [dict(r) for r in rows]
+
+
+def _editable_chats(chat_ids: list, user_id):
+    """Those of chat_ids the user may edit, by the same direct/project grants as get_chat_with_role()."""
+    return with_chat_access(select(Chat.id), user_id).where(
+        Chat.id.in_(chat_ids), chat_role_expr().in_(("owner", "editor"))
+    )
+
+
+def tag_chats(db: Session, tag_id: int, chat_ids: list, user_id) -> int:
+    """
+    Tag many chats in one set-based statement; only chats the user may edit are touched. A chat inside an
+    organization (its own or its project's) only takes that organization's tags.
+    """
+    chat_org = func.coalesce(Chat.organization_id, Project.organization_id)
+    tag_org = select(Tag.organization_id).where(Tag.id == tag_id).scalar_subquery()
+    editable = (
+        _editable_chats(chat_ids, user_id)
+        .outerjoin(Project, Project.id == Chat.project_id)
+        .where(or_(chat_org.is_(None), chat_org == tag_org))
+        .subquery()
+    )
+    return db.execute(
+        pg_insert(ChatTag)
+        .from_select(
+            ["chat_id", "tag_id", "added_by", "added_at"],
+            select(editable.c.id, literal(tag_id), literal(user_id, ChatTag.added_by.type), func.now()),
+        )
+        .on_conflict_do_nothing(index_elements=["chat_id", "tag_id"])
+    ).rowcount
+
+
+def untag_chats(db: Session, tag_id: int, chat_ids: list, user_id) -> int:
+    return db.execute(
+        delete(ChatTag).where(ChatTag.tag_id == tag_id, ChatTag.chat_id.in_(_editable_chats(chat_ids, user_id)))
+    ).rowcount
+
+
+def chats_tagged(tag_ids: list[int], match_all: bool):
+    """Subquery of chat ids carrying any (or all) of `tag_ids`; served by chat_tags(tag_id, chat_id)."""
+    q = select(ChatTag.chat_id).where(ChatTag.tag_id.in_(tag_ids))
+    if match_all:
+        q = q.group_by(ChatTag.chat_id).having(func.count() == len(set(tag_ids)))
+    return q
+
+
+def project_read_select(user_id, org_ids=()):
+    """
+    Columns needed by schemas.ProjectRead, without the settings JSONB, plus the trigger-maintained
+    project_stats counters and the caller's role: the project membership, else viewer of a non-private
+    project of one of `org_ids` (the caller's organizations, see app.orgs).
+    """
+    org_role = case((and_(Project.organization_id.in_(org_ids), Project.visibility != "private"), "viewer")) if org_ids else None
+    return (
+        select(
+            Project.id,
+            Project.name,
+            Project.description,
+            Project.visibility,
+            Project.owner_user_id,
+            Project.organization_id,
+            Project.created_at,
+            Project.updated_at,
+            func.coalesce(cast(ProjectMember.member_role, Text), org_role).label("role"),
+            func.coalesce(ProjectStats.chat_count, 0).label("chat_count"),
+            func.coalesce(ProjectStats.message_count, 0).label("message_count"),
+            func.coalesce(ProjectStats.active_member_count, 0).label("active_member_count"),
+            ProjectStats.last_activity_at,
+        )
+        .outerjoin(ProjectMember, and_(ProjectMember.project_id == Project.id, ProjectMember.user_id == user_id))
+        .outerjoin(ProjectStats, ProjectStats.project_id == Project.id)
+    )
+
+
+def visible_projects(user_id, org_ids):
+    """
+    Ids of the projects a user sees: their project memberships plus the non-private projects of `org_ids`.
+    A UNION of two index scans (project_members by user, projects by organization) rather than an OR
+    across the outer join, which would have to look at every project.
+    """
+    ids = select(ProjectMember.project_id).where(ProjectMember.user_id == user_id)
+    if org_ids:
+        ids = ids.union_all(
+            select(Project.id).where(
+                Project.organization_id.in_(org_ids), Project.visibility != "private", Project.deleted_at.is_(None)
+            )
+        )
+    return ids
+
+
+def visible_chats(user_id):
+    """
+    Ids of the chats a user can read: direct chat memberships plus the chats of their projects, the same
+    grants chat_role_expr() combines. A UNION of two index scans, like visible_projects().
+    """
+    return select(ChatMember.chat_id).where(ChatMember.user_id == user_id).union_all(
+        select(Chat.id).join(ProjectMember, ProjectMember.project_id == Chat.project_id).where(ProjectMember.user_id == user_id)
     )
 
 
-def add_message_with_assistant(db: Session, chat: Chat, user: User, content: str) -> list[Message]:
+def chat_audience(chat_id):
+    """User ids that can read `chat_id`: the visible_chats() grants seen from the chat's side."""
+    return select(ChatMember.user_id).where(ChatMember.chat_id == chat_id).union(
+        select(ProjectMember.user_id).join(Chat, Chat.project_id == ProjectMember.project_id).where(Chat.id == chat_id)
+    )
+
+
+def chat_read_select(user_id):
+    """
+    Columns needed by schemas.ChatRead: the model name is joined in SQL and the sidebar summary
+    (count, last activity, preview) comes from the trigger-maintained chat_stats row.
+    """
+    stmt = (
+        select(
+            Chat.id,
+            Chat.title,
+            Chat.status,
+            Chat.pinned,
+            Chat.model_id,
+            LLMModel.name.label("model_name"),
+            Chat.project_id,
+            Chat.created_at,
+            Chat.updated_at,
+            func.coalesce(ChatStats.message_count, 0).label("message_count"),
+            ChatStats.last_message_at,
+            ChatStats.last_message_preview,
+            Chat.active_leaf_id,
+            chat_role_expr(),
+        )
+        .join(LLMModel, LLMModel.id == Chat.model_id)
+        .outerjoin(ChatStats, ChatStats.chat_id == Chat.id)
+    )
+    return with_chat_access(stmt, user_id)
+
+
+_CHAT_READ = chat_read_select(bindparam("user_id")).where(Chat.id == bindparam("chat_id"))
+
+
+def get_chat_read(db: Session, chat_id, user_id):
+    """One schemas.ChatRead row (as a mapping) of a chat the caller can see, or None."""
+    return db.execute(_CHAT_READ, {"chat_id": chat_id, "user_id": user_id}).mappings().one_or_none()
+
+
+def message_read_select():
+    """Columns needed by schemas.MessageRead, without meta and token accounting."""
+    return select(
+        Message.id,
+        Message.chat_id,
+        Message.parent_id,
+        Message.sender_type,
+        Message.sender_user_id,
+        Message.content,
+        Message.created_at,
+    )
+
+
+# ---------------- admin user directory ----------------
+
+# sort -> (column, descending); each has a matching (column, id) index, username is unique on its own.
+DIRECTORY_SORTS = {
+    "created": (User.created_at, True),
+    "last_login": (User.last_login_at, True),
+    "username": (User.username, False),
+}
+
+
+def _like_escape(s: str) -> str:
+    return s.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def user_directory_select(
+    q: str | None = None,
+    match: str = "prefix",
+    role: str | None = None,
+    active: bool | None = None,
+    login_after=None,
+    login_before=None,
+    sort: str = "created",
+    after: tuple | None = None,
+    limit: int = 50,
+):
+    """
+    One page of users for the admin directory, with per-user totals from chat_stats. Search matches
+    lower(username) / lower(email): "prefix" through the text_pattern_ops indexes, "contains" through
+    the trigram ones. `after` is the (sort value, id) of the previous page's last row.
+    """
+    col, desc = DIRECTORY_SORTS[sort]
+    page = select(User.id, col.label("sort_key"))
+    if q:
+        needle = _like_escape(q.lower())
+        pattern = needle + "%" if match == "prefix" else "%" + needle + "%"
+        page = page.where(
+            or_(
+                func.lower(cast(User.username, Text)).like(pattern, escape="\\"),
+                func.lower(cast(User.email, Text)).like(pattern, escape="\\"),
+            )
+        )
+    if role is not None:
+        page = page.where(User.role == role)
+    if active is not None:
+        page = page.where(User.is_active == active)
+    if login_after is not None:
+        page = page.where(User.last_login_at >= login_after)
+    if login_before is not None:
+        page = page.where(User.last_login_at < login_before)
+    if sort == "last_login":
+        # Keyset paging needs a total order; users who never logged in are left out of this sort.
+        page = page.where(User.last_login_at.is_not(None))
+    if sort == "username":
+        if after is not None:
+            page = page.where(User.username > after[0])
+        page = page.order_by(User.username)
+    else:
+        if after is not None:
+            page = page.where(
+                tuple_(col, User.id)
+                < tuple_(bindparam("after_key", after[0], type_=col.type), bindparam("after_id", after[1], type_=User.id.type))
+            )
+        page = page.order_by(col.desc(), User.id.desc())
+    page = page.limit(limit).subquery("page")
+
+    # Totals are computed for the page only: the owner's chats (idx_chats_owner) and their stats rows.
+    chats = (
+        select(
+            func.count().label("chat_count"),
+            func.coalesce(func.sum(ChatStats.message_count), 0).label("message_count"),
+            func.max(ChatStats.last_message_at).label("last_message_at"),
+        )
+        .select_from(Chat)
+        .outerjoin(ChatStats, ChatStats.chat_id == Chat.id)
+        .where(Chat.owner_user_id == page.c.id, Chat.deleted_at.is_(None))
+        .lateral("chats")
+    )
+    projects = (
+        select(func.count().label("project_count"))
+        .where(Project.owner_user_id == page.c.id, Project.deleted_at.is_(None))
+        .lateral("projects")
+    )
+    stmt = (
+        select(
+            User.id,
+            User.username,
+            User.email,
+            User.role,
+            User.is_active,
+            User.created_at,
+            User.last_login_at,
+            chats.c.chat_count,
+            chats.c.message_count,
+            chats.c.last_message_at,
+            projects.c.project_count,
+            page.c.sort_key,
+        )
+        .select_from(page)
+        .join(User, User.id == page.c.id)
+        .join(chats, true())
+        .join(projects, true())
+    )
+    return stmt.order_by(page.c.sort_key.desc() if desc else page.c.sort_key, User.id.desc())
+
+
+# ---------------- branches ----------------
+
+def _visible(m):
+    return case((m.deleted_at.is_(None), 1), else_=0)
+
+
+def branch_cte(chat_id, leaf_id: int, n: int):
+    """
+    Ids on the path from leaf_id towards the root, stopping once n visible messages are collected.
+    Every step is a primary-key lookup, so the cost depends on n, not on how many branches the chat has.
+    """
+    branch = (
+        select(Message.id, Message.parent_id, _visible(Message).label("visible"))
+        .where(Message.id == leaf_id, Message.chat_id == chat_id)
+        .cte("branch", recursive=True)
+    )
+    parent = aliased(Message)
+    return branch.union_all(
+        select(parent.id, parent.parent_id, branch.c.visible + _visible(parent))
+        .join(branch, parent.id == branch.c.parent_id)
+        .where(parent.chat_id == chat_id, branch.c.visible < n)
+    )
+
+
+_BRANCH = branch_cte(bindparam("chat_id"), bindparam("leaf_id"), bindparam("n"))
+_BRANCH_MESSAGES = (
+    select(Message).join(_BRANCH, _BRANCH.c.id == Message.id).where(Message.deleted_at.is_(None)).order_by(Message.id)
+)
+
+
+def branch_messages(db: Session, chat_id, leaf_id: int, n: int = HISTORY_MESSAGES) -> list[Message]:
+    """The newest n visible messages of the branch ending at leaf_id, oldest first."""
+    return db.execute(_BRANCH_MESSAGES, {"chat_id": chat_id, "leaf_id": leaf_id, "n": n}).scalars().all()
+
+
+_LATEST_LEAF_SQL = text(
+    """
+    WITH RECURSIVE down AS (
+      SELECT CAST(:id AS bigint) AS id
+      UNION ALL
+      SELECT (SELECT c.id FROM messages c WHERE c.parent_id = d.id AND c.deleted_at IS NULL ORDER BY c.id DESC LIMIT 1)
+      FROM down d WHERE d.id IS NOT NULL
+    )
+    SELECT max(id) FROM down
+    """
+)
+
+
+def latest_leaf(db: Session, message_id: int) -> int:
+    """Follow the newest visible reply from message_id down to a leaf (ids grow along a branch)."""
+    return db.execute(_LATEST_LEAF_SQL, {"id": message_id}).scalar_one()
+
+
+# bulk_move keeps the per-row NOTIFY of every rewritten message off the realtime channel, but it also
+# silences audit_log_change(), so the audit rows it would have written are inserted here in one pass.
+_CHAIN_MESSAGES_SQL = text(
+    """
+    WITH chained AS (
+      UPDATE messages m SET parent_id = x.prev
+      FROM (SELECT id, lag(id) OVER (ORDER BY id) AS prev FROM messages WHERE chat_id = :c) x
+      WHERE m.id = x.id AND m.parent_id IS NULL AND x.prev IS NOT NULL
+      RETURNING m.*
+    )
+    INSERT INTO audit_log(table_name, operation, record_pk, old_data, new_data, changed_by, client_addr, application_name)
+    SELECT 'messages', 'UPDATE', to_jsonb(c) || '{"parent_id": null}', to_jsonb(c) || '{"parent_id": null}', to_jsonb(c),
+           NULLIF(current_setting('clown_gpt.current_user_id', true), '')::uuid,
+           inet_client_addr(), current_setting('application_name', true)
+    FROM chained c
+    """
+)
+
+
+def ensure_branching(db: Session, chat: Chat) -> None:
+    """
+    Chats written before branching existed (or by batch import) have no parent pointers: chain their
+    messages by id once, so the chat becomes a single branch ending at its newest message.
+    """
+    if chat.active_leaf_id is not None:
+        return
+    db.execute(text("SELECT set_config('clown_gpt.bulk_move', 'on', true)"))
+    db.execute(_CHAIN_MESSAGES_SQL, {"c": chat.id})
+    db.execute(text("SELECT set_config('clown_gpt.bulk_move', 'off', true)"))
+    chat.active_leaf_id = db.execute(select(func.max(Message.id)).where(Message.chat_id == chat.id)).scalar()
+
+
+def add_message_with_assistant(
+    db: Session, chat: Chat, user: User, content: str, edit_of: Message | None = None
+) -> list[Message]:
     """
     Persist a user message, call the LLM (OpenAI if configured) and persist the assistant reply.
+    The message continues the active branch; with edit_of it becomes a sibling of that message instead,
+    leaving the old branch as it was. The reply becomes the chat's active leaf.
     Falls back to an offline stub if the LLM is unavailable.
     """
     now = utcnow()
+    ensure_branching(db, chat)
+    if edit_of is not None and edit_of.parent_id is None:
+        # ensure_branching sets parent_id with a bulk UPDATE; an edit_of loaded before it would still read None
+        db.refresh(edit_of, ["parent_id"])
 
-    # Derive a title for fresh chats from the first user prompt
+    # Derive a title for fresh chats from the first user prompt; a background job may improve it later
     if chat.title.strip().lower().startswith("new chat"):
         trimmed = " ".join(content.strip().split())
         if trimmed:
             chat.title = (trimmed[:60] + ("…" if len(trimmed) > 60 else ""))
+            jobs.enqueue(
+                db,
+                "chat_title",
+                {"chat_id": str(chat.id), "derived_title": chat.title, "content": content},
+                dedupe_key=f"chat_title:{chat.id}",
+            )
 
     user_msg = Message(
         chat_id=chat.id,
+        parent_id=edit_of.parent_id if edit_of is not None else chat.active_leaf_id,
         sender_user_id=user.id,
         sender_type="user",
         content=content,
         token_input=0,
         token_output=0,
         cost_estimated=0,
-        meta={"source": "ui"},
+        meta={"source": "ui"} if edit_of is None else {"source": "ui", "edit_of": edit_of.id},
         created_at=now,
+        edited_at=now if edit_of is not None else None,
     )
     db.add(user_msg)
     db.flush()
 
-    recent = (
-        db.execute(
-            select(Message)
-            .where(Message.chat_id == chat.id, Message.deleted_at.is_(None))
-            .order_by(Message.id.desc())
-            .limit(15)
-        )
-        .scalars()
-        .all()
-    )
-    # reverse to chronological order for the prompt
-    history = list(reversed(recent))
+    return [user_msg, reply_to(db, chat, user_msg)]
+
+
+def reply_to(db: Session, chat: Chat, prompt: Message, fresh: bool = False) -> Message:
+    """
+    Persist an assistant reply to `prompt` (a user message), generated from the prompt's branch.
+    A prompt that already has replies gets one more (regeneration); the new reply becomes the active leaf.
+    """
+    ensure_branching(db, chat)
+    history = branch_messages(db, chat.id, prompt.id)
 
     model_name = (
         db.execute(select(LLMModel.name).where(LLMModel.id == chat.model_id)).scalar_one_or_none()
         or "gpt-3.5-turbo"
     )
-    assistant_text = llm.generate_reply(model_name=model_name, history=history, user_input=content)
+    assistant_text = llm.generate_reply(
+        model_name=model_name,
+        history=history,
+        user_input=prompt.content,
+        temperature=float(chat.temperature),
+        fresh=fresh,
+    )
 
     bot_msg = Message(
         chat_id=chat.id,
+        parent_id=prompt.id,
         sender_user_id=None,
         sender_type="assistant",
         content=assistant_text,
@@ -159,6 +636,7 @@ def add_message_with_assistant(db: Session, chat: Chat, user: User, content: str
     db.add(bot_msg)
     db.flush()
 
+    chat.active_leaf_id = bot_msg.id
     chat.updated_at = utcnow()
 
-    return [user_msg, bot_msg]
+    return bot_msg
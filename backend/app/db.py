@@ -1,21 +1,216 @@
+import hashlib
+import itertools
+import logging
 import os
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import threading
+import time
+
+from fastapi import Depends, Request
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import Session, sessionmaker
+
+try:
+    import redis
+except ImportError:  # optional dependency, only for READ_STICKY_REDIS_URL
+    redis = None
 
 DATABASE_URL = os.getenv("DATABASE_URL", "")
 DB_SCHEMA = os.getenv("DB_SCHEMA", "clown_gpt")
+# Comma-separated replica URLs; reads routed with get_read_db go there when they are healthy.
+DATABASE_READ_URLS = [u.strip() for u in os.getenv("DATABASE_READ_URLS", "").split(",") if u.strip()]
+REPLICA_MAX_LAG_SEC = float(os.getenv("REPLICA_MAX_LAG_SEC", "10"))
+REPLICA_CHECK_SEC = float(os.getenv("REPLICA_CHECK_SEC", "2"))
+# After a client's write request commits, its reads stay on the primary for this long.
+READ_STICKY_SEC = float(os.getenv("READ_STICKY_SEC", "5"))
+# Share stickiness between worker processes through Redis; per-process memory when unset.
+READ_STICKY_REDIS_URL = os.getenv("READ_STICKY_REDIS_URL", "")
+# Opt-in: psycopg prepares a statement server-side once a connection has run it this many times
+# (0 = at once, "off" = never, unset = psycopg's default of 5). Use "off" behind a transaction-pooling
+# pgbouncer, which cannot keep prepared statements.
+DB_PREPARE_THRESHOLD = os.getenv("DB_PREPARE_THRESHOLD", "")
+# Prepared statements kept per connection (LRU; unset = psycopg's default) and SQL strings kept in
+# SQLAlchemy's compiled cache.
+DB_PREPARED_MAX = os.getenv("DB_PREPARED_MAX", "")
+DB_QUERY_CACHE_SIZE = int(os.getenv("DB_QUERY_CACHE_SIZE", "1000"))
+# Per process (per server worker): the database sees workers x (DB_POOL_SIZE + DB_MAX_OVERFLOW) at most.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
 
-engine = create_engine(
-    DATABASE_URL,
-    pool_pre_ping=True,
-    connect_args={"options": f"-csearch_path={DB_SCHEMA},public"},
-)
+logger = logging.getLogger("db")
+
+_connect_args = {"options": f"-csearch_path={DB_SCHEMA},public"}
+if DB_PREPARE_THRESHOLD:
+    _connect_args["prepare_threshold"] = None if DB_PREPARE_THRESHOLD.lower() in ("off", "none") else int(DB_PREPARE_THRESHOLD)
+
+
+def _set_prepared_max(dbapi_conn, _record) -> None:
+    dbapi_conn.prepared_max = int(DB_PREPARED_MAX)
+
+
+def _engine(url: str, **connect_args):
+    e = create_engine(
+        url,
+        pool_pre_ping=True,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        query_cache_size=DB_QUERY_CACHE_SIZE,
+        connect_args={**_connect_args, **connect_args},
+    )
+    if DB_PREPARED_MAX:
+        event.listen(e, "connect", _set_prepared_max)
+    return e
+
+
+engine = _engine(DATABASE_URL)
+
+read_engines = [_engine(url, connect_timeout=3) for url in DATABASE_READ_URLS]
 
 SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+_read_sessions = [sessionmaker(bind=e, autocommit=False, autoflush=False) for e in read_engines]
+
+# ---------------- replica health ----------------
+
+# 0 on a primary or a replica that has replayed everything it received, else seconds since the last replayed commit.
+_LAG_SQL = text(
+    """
+    SELECT CASE
+      WHEN NOT pg_is_in_recovery() THEN 0
+      WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+      ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())::float8, 'Infinity'::float8)
+    END
+    """
+)
+
+
+class ReplicaMonitor:
+    """Polls replica lag in the background. A replica that lags too much or does not answer gets no reads."""
+
+    def __init__(self, engines, interval: float, max_lag: float):
+        self.engines = engines
+        self.interval = interval
+        self.max_lag = max_lag
+        # None means unknown or unreachable; replicas start out unused until the first check.
+        self.lag: list[float | None] = [None] * len(engines)
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def check(self) -> None:
+        for i, e in enumerate(self.engines):
+            try:
+                with e.connect() as conn:
+                    lag = float(conn.execute(_LAG_SQL).scalar_one())
+            except Exception as exc:
+                if self.lag[i] is not None:
+                    logger.warning("replica %d unreachable: %s", i, exc)
+                lag = None
+            was_ok = self.lag[i] is not None and self.lag[i] <= self.max_lag
+            self.lag[i] = lag
+            if was_ok and lag is not None and lag > self.max_lag:
+                logger.warning("replica %d lags %.1fs, reading from the primary", i, lag)
+
+    def healthy(self) -> list[int]:
+        return [i for i, lag in enumerate(self.lag) if lag is not None and lag <= self.max_lag]
+
+    def _loop(self) -> None:
+        while True:
+            self.check()
+            if self._stop.wait(self.interval):
+                return
+
+    def start(self) -> None:
+        if self.engines and self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="replica-monitor", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+replicas = ReplicaMonitor(read_engines, REPLICA_CHECK_SEC, REPLICA_MAX_LAG_SEC)
+_round_robin = itertools.count()
 
-def get_db():
+# ---------------- read-your-writes ----------------
+
+class _MemorySticky:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._until: dict[str, float] = {}
+
+    def mark(self, key: str, ttl: float) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if len(self._until) > 10_000:
+                self._until = {k: v for k, v in self._until.items() if v > now}
+            self._until[key] = now + ttl
+
+    def active(self, key: str) -> bool:
+        return self._until.get(key, 0.0) > time.monotonic()
+
+
+class _RedisSticky:
+    def __init__(self, url: str):
+        if redis is None:
+            raise RuntimeError("READ_STICKY_REDIS_URL is set but the redis package is not installed (pip install redis)")
+        self._r = redis.Redis.from_url(url)
+
+    def mark(self, key: str, ttl: float) -> None:
+        self._r.set(f"rr:sticky:{key}", 1, px=int(ttl * 1000))
+
+    def active(self, key: str) -> bool:
+        return bool(self._r.exists(f"rr:sticky:{key}"))
+
+
+sticky = _RedisSticky(READ_STICKY_REDIS_URL) if READ_STICKY_REDIS_URL and read_engines else _MemorySticky()
+
+_SAFE_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+
+
+def client_key(request: Request) -> str | None:
+    """Stickiness is per credential: a hash of the Authorization header."""
+    auth = request.headers.get("authorization")
+    return hashlib.sha256(auth.encode()).hexdigest()[:32] if auth else None
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _mark_sticky(session: Session) -> None:
+    key = session.info.get("sticky_key")
+    if key and read_engines:
+        sticky.mark(key, READ_STICKY_SEC)
+
+
+def _replica_for(key: str | None):
+    if not _read_sessions or (key and sticky.active(key)):
+        return None
+    healthy = replicas.healthy()
+    if not healthy:
+        return None
+    return _read_sessions[healthy[next(_round_robin) % len(healthy)]]
+
+
+def read_session(key: str | None = None) -> Session:
+    """A session on a healthy replica, or on the primary when there is none or `key` wrote recently."""
+    factory = _replica_for(key)
+    return factory() if factory else SessionLocal()
+
+# ---------------- dependencies ----------------
+
+def get_db(request: Request):
     db = SessionLocal()
+    if request.method not in _SAFE_METHODS:
+        db.info["sticky_key"] = client_key(request)
     try:
         yield db
     finally:
         db.close()
+
+def get_read_db(request: Request, db: Session = Depends(get_db)):
+    """For read-only endpoints. Falls back to the request's primary session instead of opening a second one."""
+    factory = _replica_for(client_key(request)) if request.method in _SAFE_METHODS else None
+    if factory is None:
+        yield db
+        return
+    rdb = factory()
+    try:
+        yield rdb
+    finally:
+        rdb.close()
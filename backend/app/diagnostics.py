@@ -0,0 +1,212 @@
+"""
+Trigger cost profiler: per-trigger time and WAL bytes of the API's write paths, rolled back afterwards.
+
+Usage (from backend/):
+    DATABASE_URL=postgresql+psycopg://... python -m app.diagnostics triggers [--rows 500]
+"""
+import argparse
+import json
+import sys
+import time
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .db import SessionLocal
+
+MAX_ROWS = 5000
+
+_FUNCTION_STATS_SQL = text(
+    """
+    SELECT funcname, calls, total_time, self_time
+    FROM pg_stat_xact_user_functions
+    WHERE schemaname = current_schema()
+    """
+)
+
+_TRIGGERS_SQL = text(
+    """
+    SELECT c.relname AS table_name, t.tgname, p.proname
+    FROM pg_trigger t
+    JOIN pg_class c ON c.oid = t.tgrelid
+    JOIN pg_proc p ON p.oid = t.tgfoid
+    WHERE NOT t.tgisinternal AND c.relnamespace = current_schema()::regnamespace
+      AND c.relname IN ('messages', 'chats', 'users', 'projects', 'usage_events')
+    ORDER BY c.relname, t.tgname
+    """
+)
+
+_SETUP_SQL = [
+    """
+    INSERT INTO users (username, email, password_hash, role)
+    VALUES ('diag_' || substr(md5(random()::text), 1, 12), 'diag_' || substr(md5(random()::text), 1, 12) || '@diag.local',
+            'x', 'member')
+    RETURNING id
+    """,
+    """
+    INSERT INTO organizations (slug, name, owner_user_id, billing_email)
+    VALUES ('diag-' || substr(md5(random()::text), 1, 12), 'Diagnostics', :user, 'diag@diag.local')
+    RETURNING id
+    """,
+    """
+    INSERT INTO projects (organization_id, owner_user_id, name) VALUES (:org, :user, 'Diagnostics') RETURNING id
+    """,
+    """
+    INSERT INTO chats (project_id, organization_id, owner_user_id, title, model_id)
+    VALUES (:project, :org, :user, 'Diagnostics', (SELECT min(id) FROM models))
+    RETURNING id
+    """,
+]
+
+# (phase, per-row statement). :i is the row number, :msg a live message id (see _NEEDS_MESSAGES).
+_PHASES = [
+    (
+        "messages_insert",
+        """
+        INSERT INTO messages (chat_id, sender_user_id, sender_type, content)
+        VALUES (:chat, :user, 'user', 'diagnostics message ' || :i)
+        """,
+    ),
+    ("messages_soft_delete", "UPDATE messages SET deleted_at = now() WHERE id = :msg"),
+    (
+        "chats_insert",
+        """
+        INSERT INTO chats (project_id, organization_id, owner_user_id, title, model_id)
+        VALUES (:project, :org, :user, 'Diagnostics ' || :i, (SELECT min(id) FROM models))
+        """,
+    ),
+    ("users_update", "UPDATE users SET updated_at = now() WHERE id = :user"),
+    ("projects_update", "UPDATE projects SET updated_at = now() WHERE id = :project"),
+    (
+        "usage_events_insert",
+        """
+        INSERT INTO usage_events (organization_id, user_id, event_type, chat_id, tokens_in, tokens_out)
+        VALUES (:org, :user, 'chat_completion', :chat, 10, 20)
+        """,
+    ),
+]
+_NEEDS_MESSAGES = {"messages_soft_delete"}
+
+
+def _function_stats(db: Session) -> dict[str, tuple[int, float, float]]:
+    return {r.funcname: (r.calls, r.total_time, r.self_time) for r in db.execute(_FUNCTION_STATS_SQL)}
+
+
+def _wal_lsn(db: Session) -> str:
+    return db.execute(text("SELECT pg_current_wal_insert_lsn()")).scalar_one()
+
+
+def _run_phase(db: Session, phase: str, sql: str, scratch: dict, rows: int, track: bool) -> dict:
+    """Run one phase in a savepoint that is rolled back; returns timings, WAL and function deltas."""
+    stmt = text(sql)
+    sp = db.begin_nested()
+    if phase in _NEEDS_MESSAGES:
+        # The soft-delete phase needs live messages; they are created untimed inside the same savepoint.
+        ids = db.execute(
+            text(
+                """
+                INSERT INTO messages (chat_id, sender_user_id, sender_type, content)
+                SELECT :chat, :user, 'user', 'diagnostics message ' || g FROM generate_series(1, :n) g
+                RETURNING id
+                """
+            ),
+            {**scratch, "n": rows},
+        ).scalars().all()
+    else:
+        ids = [None] * rows
+    before = _function_stats(db) if track else {}
+    lsn = _wal_lsn(db)
+    t0 = time.perf_counter()
+    for i, msg in enumerate(ids):
+        db.execute(stmt, {**scratch, "i": i, "msg": msg})
+    elapsed = time.perf_counter() - t0
+    wal = db.execute(text("SELECT pg_wal_lsn_diff(pg_current_wal_insert_lsn(), :lsn)"), {"lsn": lsn}).scalar_one()
+    after = _function_stats(db) if track else {}
+    sp.rollback()
+
+    functions = {}
+    for name, (calls, total, self_) in after.items():
+        c0, t0_, s0 = before.get(name, (0, 0.0, 0.0))
+        if calls - c0:
+            functions[name] = {
+                "calls": calls - c0,
+                "total_ms": round(total - t0_, 3),
+                "self_ms": round(self_ - s0, 3),
+                "total_us_per_row": round((total - t0_) * 1000 / rows, 2),
+            }
+    return {
+        "ms": round(elapsed * 1000, 2),
+        "us_per_row": round(elapsed * 1e6 / rows, 2),
+        "wal_bytes": int(wal),
+        "wal_bytes_per_row": round(float(wal) / rows, 1),
+        "functions": functions,
+    }
+
+
+def profile_triggers(db: Session, rows: int = 500) -> dict:
+    """Profile the write triggers on scratch rows; the session's transaction is rolled back at the end."""
+    rows = max(1, min(rows, MAX_ROWS))
+    db.rollback()
+    try:
+        superuser = db.execute(text("SELECT current_setting('is_superuser') = 'on'")).scalar_one()
+        if superuser:
+            db.execute(text("SET LOCAL track_functions = 'all'"))
+        track = db.execute(text("SELECT current_setting('track_functions')")).scalar_one() != "none"
+
+        triggers: dict[str, list[dict]] = {}
+        for r in db.execute(_TRIGGERS_SQL):
+            triggers.setdefault(r.table_name, []).append({"trigger": r.tgname, "function": r.proname})
+
+        scratch: dict = {}
+        scratch["user"] = db.execute(text(_SETUP_SQL[0])).scalar_one()
+        scratch["org"] = db.execute(text(_SETUP_SQL[1]), scratch).scalar_one()
+        scratch["project"] = db.execute(text(_SETUP_SQL[2]), scratch).scalar_one()
+        scratch["chat"] = db.execute(text(_SETUP_SQL[3]), scratch).scalar_one()
+
+        phases = {}
+        for name, sql in _PHASES:
+            _run_phase(db, name, sql, scratch, rows, False)  # warm-up
+            on = _run_phase(db, name, sql, scratch, rows, track)
+            off = None
+            if superuser:
+                db.execute(text("SET LOCAL session_replication_role = replica"))
+                off = _run_phase(db, name, sql, scratch, rows, False)
+                off.pop("functions")
+                db.execute(text("SET LOCAL session_replication_role = origin"))
+            phases[name] = {
+                "on": on,
+                "off": off,
+                "overhead_us_per_row": round(on["us_per_row"] - off["us_per_row"], 2) if off else None,
+                "overhead_pct": round((on["us_per_row"] / off["us_per_row"] - 1) * 100, 1) if off and off["us_per_row"] else None,
+                "wal_overhead_bytes_per_row": round(on["wal_bytes_per_row"] - off["wal_bytes_per_row"], 1) if off else None,
+            }
+        return {
+            "rows": rows,
+            "superuser": superuser,
+            "function_timings": track,
+            "server_version": db.execute(text("SHOW server_version")).scalar_one(),
+            "triggers": triggers,
+            "phases": phases,
+        }
+    finally:
+        db.rollback()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    t = sub.add_parser("triggers")
+    t.add_argument("--rows", type=int, default=500)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        report = profile_triggers(db, args.rows)
+    finally:
+        db.close()
+    json.dump(report, sys.stdout, indent=2, default=str)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
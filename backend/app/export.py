@@ -0,0 +1,153 @@
+"""
+Streaming export of everything a user owns: one NDJSON line per chat followed by its messages.
+
+Lines are ordered by (chat id, message id) and a chat line counts as message id 0, so a client that
+got cut off resumes with cursor="<chat_id>:<message_id>" of the last line it received.
+The rows come from a single server-side cursor (yield_per), so memory stays flat regardless of
+history size; chats in cold storage are streamed from their segment in place of the hot rows.
+"""
+import os
+import zipfile
+from typing import Iterator
+from uuid import UUID
+
+from sqlalchemy import text
+
+from . import tiering
+from .db import SessionLocal
+from .responses import dumps
+
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "2000"))
+ZERO_UUID = "00000000-0000-0000-0000-000000000000"
+
+_EXPORT_SQL = text(
+    """
+    SELECT c.id AS chat_id, c.title, c.status, c.project_id, md.name AS model_name, c.temperature,
+           c.system_prompt, c.active_leaf_id, c.created_at AS chat_created_at, c.updated_at AS chat_updated_at,
+           seg.chat_id IS NOT NULL AS cold,
+           m.id AS message_id, m.parent_id, m.sender_type, m.sender_user_id, m.content, m.token_input, m.token_output,
+           m.created_at, m.edited_at
+    FROM chats c
+    JOIN models md ON md.id = c.model_id
+    LEFT JOIN chat_cold_segments seg ON seg.chat_id = c.id
+    LEFT JOIN messages m ON m.chat_id = c.id AND m.deleted_at IS NULL
+    WHERE c.owner_user_id = :u
+      AND c.deleted_at IS NULL
+      AND c.id >= CAST(:after_chat AS uuid)
+      AND (c.id > CAST(:after_chat AS uuid) OR COALESCE(m.id, 0) > :after_msg OR seg.chat_id IS NOT NULL)
+    ORDER BY c.id, m.id NULLS FIRST
+    """
+)
+
+
+def parse_cursor(cursor: str | None) -> tuple[str, int]:
+    """'<chat_id>:<message_id>' -> (chat_id, message_id); raises ValueError on garbage."""
+    if not cursor:
+        return ZERO_UUID, -1
+    chat_id, _, msg = cursor.partition(":")
+    return str(UUID(chat_id)), int(msg or 0)
+
+
+def _chat_line(r) -> bytes:
+    return dumps(
+        {
+            "type": "chat",
+            "id": r["chat_id"],
+            "title": r["title"],
+            "status": r["status"],
+            "project_id": r["project_id"],
+            "model_name": r["model_name"],
+            "temperature": r["temperature"],
+            "system_prompt": r["system_prompt"],
+            "active_leaf_id": r["active_leaf_id"],
+            "created_at": r["chat_created_at"],
+            "updated_at": r["chat_updated_at"],
+        }
+    ) + b"\n"
+
+
+def _message_line(chat_id, message_id: int, m) -> bytes:
+    return dumps(
+        {
+            "type": "message",
+            "chat_id": chat_id,
+            "id": message_id,
+            "parent_id": m.get("parent_id"),
+            "sender_type": m["sender_type"],
+            "sender_user_id": m["sender_user_id"],
+            "content": m["content"],
+            "token_input": m["token_input"],
+            "token_output": m["token_output"],
+            "created_at": m["created_at"],
+            "edited_at": m["edited_at"],
+        }
+    ) + b"\n"
+
+
+def iter_ndjson(user_id, cursor: str | None = None, chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[bytes]:
+    """Yield NDJSON in chunks of about chunk_rows lines. Owns its session, like responses.stream_json_array."""
+    after_chat, after_msg = parse_cursor(cursor)
+    db = SessionLocal()
+    try:
+        result = db.execute(
+            _EXPORT_SQL.execution_options(yield_per=chunk_rows),
+            {"u": str(user_id), "after_chat": after_chat, "after_msg": after_msg},
+        ).mappings()
+        current = None
+        for part in result.partitions():
+            buf = bytearray()
+            for r in part:
+                chat_id = r["chat_id"]
+                if chat_id != current:
+                    current = chat_id
+                    resume_msg = after_msg if str(chat_id) == after_chat else -1
+                    if resume_msg < 0:
+                        buf += _chat_line(r)
+                    if r["cold"]:
+                        # Cold chats have no hot rows; their messages are streamed from the segment instead,
+                        # flushed every chunk_rows lines so a huge chat does not pile up in the buffer.
+                        n = 0
+                        for m in tiering.iter_segment(db, chat_id):
+                            if m["deleted_at"] is None and m["id"] > resume_msg:
+                                buf += _message_line(chat_id, m["id"], m)
+                                n += 1
+                                if n % chunk_rows == 0:
+                                    yield bytes(buf)
+                                    buf = bytearray()
+                if r["message_id"] is not None:
+                    buf += _message_line(chat_id, r["message_id"], r)
+            if buf:
+                yield bytes(buf)
+    finally:
+        db.close()
+
+
+class _Sink:
+    """Write-only, non-seekable target for ZipFile: it then streams entries with data descriptors."""
+
+    def __init__(self):
+        self._buf = bytearray()
+
+    def write(self, data) -> int:
+        self._buf += data
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        out, self._buf = bytes(self._buf), bytearray()
+        return out
+
+
+def iter_zip(chunks: Iterator[bytes], name: str = "export.ndjson") -> Iterator[bytes]:
+    """Deflate `chunks` into a single-entry ZIP on the fly."""
+    sink = _Sink()
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
+        with zf.open(name, mode="w", force_zip64=True) as entry:
+            for chunk in chunks:
+                entry.write(chunk)
+                out = sink.drain()
+                if out:
+                    yield out
+    yield sink.drain()
@@ -0,0 +1,85 @@
+import hashlib
+import os
+from datetime import timedelta
+from uuid import UUID
+
+import orjson
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .timeutil import utcnow
+
+# How long a key is remembered; retries after that are treated as new requests.
+TTL = timedelta(seconds=float(os.getenv("IDEMPOTENCY_TTL_SEC", "86400")))
+MAX_KEY_LENGTH = 200
+SWEEP_BATCH = int(os.getenv("IDEMPOTENCY_SWEEP_BATCH", "5000"))
+
+
+class KeyReused(Exception):
+    """The key was already used for a different request body."""
+
+
+def request_hash(*parts) -> str:
+    h = hashlib.sha256()
+    for p in parts:
+        h.update(str(p).encode("utf-8") + b"\x00")
+    return h.hexdigest()
+
+
+def claim(db: Session, user_id: UUID, key: str, req_hash: str) -> list | dict | None:
+    """
+    Reserve `key` for this request inside the caller's transaction, or return the stored response body.
+
+    A concurrent duplicate blocks on the unique index until the first transaction ends: it then either
+    sees the committed response (and replays it) or, if the first one rolled back, claims the key itself.
+    An expired key is taken over as if it were new.
+    """
+    claimed = db.execute(
+        text(
+            """
+            INSERT INTO idempotency_keys (user_id, idem_key, request_hash, created_at, expires_at)
+            VALUES (:u, :k, :h, now(), :exp)
+            ON CONFLICT (user_id, idem_key) DO UPDATE
+              SET request_hash = EXCLUDED.request_hash, response = NULL,
+                  created_at = EXCLUDED.created_at, expires_at = EXCLUDED.expires_at
+              WHERE idempotency_keys.expires_at < now()
+            RETURNING 1
+            """
+        ),
+        {"u": str(user_id), "k": key, "h": req_hash, "exp": utcnow() + TTL},
+    ).first()
+    if claimed:
+        return None
+    row = db.execute(
+        text("SELECT request_hash, response FROM idempotency_keys WHERE user_id = :u AND idem_key = :k"),
+        {"u": str(user_id), "k": key},
+    ).one()
+    if row.request_hash != req_hash:
+        raise KeyReused(key)
+    return row.response
+
+
+def store_response(db: Session, user_id: UUID, key: str, body) -> None:
+    """Save the response body with the claim; it becomes visible when the caller commits."""
+    db.execute(
+        text("UPDATE idempotency_keys SET response = CAST(:r AS jsonb) WHERE user_id = :u AND idem_key = :k"),
+        {"u": str(user_id), "k": key, "r": orjson.dumps(body).decode("utf-8")},
+    )
+
+
+def sweep_expired(db: Session) -> int:
+    total = 0
+    while True:
+        n = db.execute(
+            text(
+                """
+                DELETE FROM idempotency_keys
+                WHERE ctid IN (SELECT ctid FROM idempotency_keys WHERE expires_at < now() LIMIT :n)
+                """
+            ),
+            {"n": SWEEP_BATCH},
+        ).rowcount
+        db.commit()
+        total += n
+        if n < SWEEP_BATCH:
+            return total
@@ -0,0 +1,368 @@
+"""
+Durable background jobs on Postgres.
+
+Usage (from backend/):
+    DATABASE_URL=postgresql+psycopg://... python -m app.jobs worker [--threads 4] [--batch 50] [--kinds chat_title,...] [--drain]
+    DATABASE_URL=postgresql+psycopg://... python -m app.jobs enqueue chat_stats_reconcile '{"chat_id": "..."}'
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import signal
+import socket
+import threading
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Callable
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from . import llm
+from .db import SessionLocal
+
+CLAIM_BATCH = int(os.getenv("JOBS_BATCH", "50"))
+IDLE_SLEEP_SEC = float(os.getenv("JOBS_IDLE_SLEEP_SEC", "1"))
+LOCK_TIMEOUT = timedelta(seconds=float(os.getenv("JOBS_LOCK_TIMEOUT_SEC", "300")))
+BACKOFF_BASE_SEC = float(os.getenv("JOBS_BACKOFF_BASE_SEC", "5"))
+BACKOFF_MAX_SEC = float(os.getenv("JOBS_BACKOFF_MAX_SEC", "3600"))
+
+# Lower value runs first.
+PRIORITY_HIGH = 10
+PRIORITY_NORMAL = 100
+PRIORITY_LOW = 1000
+
+logger = logging.getLogger("jobs")
+
+
+@dataclass(frozen=True)
+class Job:
+    id: int
+    kind: str
+    payload: dict
+    attempts: int
+    max_attempts: int
+
+
+@dataclass(frozen=True)
+class Handler:
+    fn: Callable
+    batch: bool
+
+
+HANDLERS: dict[str, Handler] = {}
+
+
+def handler(kind: str, batch: bool = False):
+    """Register fn(db, payload) or, with batch=True, fn(db, [payloads]) for a job kind."""
+
+    def deco(fn):
+        HANDLERS[kind] = Handler(fn, batch)
+        return fn
+
+    return deco
+
+
+def enqueue(
+    db: Session,
+    kind: str,
+    payload: dict,
+    priority: int = PRIORITY_NORMAL,
+    delay: float = 0,
+    dedupe_key: str | None = None,
+    max_attempts: int = 5,
+) -> None:
+    """
+    Queue a job in the caller's transaction, so it exists exactly when the work that produced it commits.
+    A queued job with the same dedupe_key makes this a no-op.
+    """
+    db.execute(
+        text(
+            """
+            INSERT INTO jobs (kind, payload, priority, run_at, max_attempts, dedupe_key)
+            VALUES (:kind, CAST(:payload AS jsonb), :priority, now() + make_interval(secs => :delay), :max_attempts, :dedupe)
+            ON CONFLICT (dedupe_key) WHERE status = 'queued' DO NOTHING
+            """
+        ),
+        {
+            "kind": kind,
+            "payload": json.dumps(payload, default=str),
+            "priority": priority,
+            "delay": delay,
+            "max_attempts": max_attempts,
+            "dedupe": dedupe_key,
+        },
+    )
+
+
+# Due jobs in priority order (lower first), skipping rows other workers hold; a claimed job frees its
+# dedupe_key so the same work can be queued again while it runs.
+_CLAIM_SQL = text(
+    """
+    UPDATE jobs SET status = 'running', locked_by = :worker, locked_at = now(), attempts = attempts + 1, dedupe_key = NULL
+    WHERE id IN (
+      SELECT id FROM jobs
+      WHERE status = 'queued' AND run_at <= now()
+        AND (CAST(:kinds AS text[]) IS NULL OR kind = ANY(CAST(:kinds AS text[])))
+      ORDER BY priority, run_at, id
+      LIMIT :n
+      FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, kind, payload, attempts, max_attempts
+    """
+)
+
+# Exponential backoff until max_attempts, after which the job stays in the table as 'dead'.
+_RETRY_SQL = text(
+    """
+    UPDATE jobs
+    SET status = CASE WHEN attempts >= max_attempts THEN 'dead' ELSE 'queued' END,
+        run_at = now() + make_interval(secs => :delay),
+        locked_by = NULL, locked_at = NULL, last_error = :err
+    WHERE id = ANY(CAST(:ids AS bigint[]))
+    """
+)
+
+# Jobs whose worker died are requeued after LOCK_TIMEOUT.
+_REQUEUE_STALE_SQL = text(
+    """
+    UPDATE jobs
+    SET status = CASE WHEN attempts >= max_attempts THEN 'dead' ELSE 'queued' END,
+        locked_by = NULL, locked_at = NULL, last_error = 'worker lost'
+    WHERE status = 'running' AND locked_at < now() - make_interval(secs => :secs)
+    """
+)
+
+
+def claim(db: Session, worker_id: str, n: int = CLAIM_BATCH, kinds: list[str] | None = None) -> list[Job]:
+    rows = db.execute(_CLAIM_SQL, {"worker": worker_id, "n": n, "kinds": kinds}).all()
+    db.commit()
+    return [Job(r.id, r.kind, r.payload, r.attempts, r.max_attempts) for r in rows]
+
+
+def _backoff(attempts: int) -> float:
+    delay = min(BACKOFF_MAX_SEC, BACKOFF_BASE_SEC * 2 ** (attempts - 1))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def _fail(db: Session, jobs: list[Job], err: Exception) -> None:
+    db.rollback()
+    logger.warning("%s x%d failed (attempt %d): %r", jobs[0].kind, len(jobs), jobs[0].attempts, err)
+    db.execute(
+        _RETRY_SQL, {"ids": [j.id for j in jobs], "delay": _backoff(max(j.attempts for j in jobs)), "err": repr(err)[:2000]}
+    )
+    db.commit()
+
+
+def _run_unit(db: Session, h: Handler, unit: list[Job]) -> None:
+    if h.batch:
+        h.fn(db, [j.payload for j in unit])
+    else:
+        h.fn(db, unit[0].payload)
+    db.execute(text("DELETE FROM jobs WHERE id = ANY(CAST(:ids AS bigint[]))"), {"ids": [j.id for j in unit]})
+    db.commit()
+
+
+def _run_group(db: Session, kind: str, group: list[Job]) -> int:
+    """Run one kind's jobs (a batch handler gets them in one call) and delete each unit that succeeds."""
+    h = HANDLERS.get(kind)
+    if h is None:
+        _fail(db, group, LookupError(f"no handler for job kind {kind!r}"))
+        return 0
+    units = [group] if h.batch else [[j] for j in group]
+    done = 0
+    for unit in units:
+        try:
+            _run_unit(db, h, unit)
+            done += len(unit)
+        except Exception as e:
+            if len(unit) == 1:
+                _fail(db, unit, e)
+                continue
+            # One bad payload must not fail the rest of the batch: find it by running the jobs one at a time
+            db.rollback()
+            logger.warning("%s x%d failed as a batch, retrying one by one: %r", kind, len(unit), e)
+            for j in unit:
+                try:
+                    _run_unit(db, h, [j])
+                    done += 1
+                except Exception as e1:
+                    _fail(db, [j], e1)
+    return done
+
+
+def run_batch(db: Session, worker_id: str, n: int = CLAIM_BATCH, kinds: list[str] | None = None) -> int:
+    """Claim up to n due jobs and run them. Returns how many were claimed (0 means the queue is idle)."""
+    jobs = claim(db, worker_id, n, kinds)
+    groups: dict[str, list[Job]] = {}
+    for j in jobs:
+        groups.setdefault(j.kind, []).append(j)
+    for kind, group in groups.items():
+        _run_group(db, kind, group)
+    return len(jobs)
+
+
+def requeue_stale(db: Session) -> int:
+    n = db.execute(_REQUEUE_STALE_SQL, {"secs": LOCK_TIMEOUT.total_seconds()}).rowcount
+    db.commit()
+    return n
+
+
+def work(worker_id: str, stop: threading.Event, batch: int, kinds: list[str] | None, drain: bool) -> int:
+    processed = 0
+    last_reap = 0.0
+    db = SessionLocal()
+    try:
+        while not stop.is_set():
+            if time.monotonic() - last_reap > 60:
+                last_reap = time.monotonic()
+                if requeue_stale(db):
+                    logger.info("requeued stale jobs")
+            try:
+                n = run_batch(db, worker_id, batch, kinds)
+            except Exception:
+                db.rollback()
+                logger.exception("job loop failed")
+                n = 0
+            processed += n
+            if not n:
+                if drain:
+                    return processed
+                stop.wait(IDLE_SLEEP_SEC)
+    finally:
+        db.close()
+    return processed
+
+
+# ---------------- handlers ----------------
+
+@handler("noop", batch=True)
+def _noop(db: Session, payloads: list[dict]) -> None:
+    pass
+
+
+@handler("chat_title")
+def _chat_title(db: Session, payload: dict) -> None:
+    """Replace the title derived from the first prompt with an LLM-written one, unless the user renamed it."""
+    row = db.execute(
+        text("SELECT c.title, m.name AS model_name FROM chats c JOIN models m ON m.id = c.model_id WHERE c.id = :c"),
+        {"c": payload["chat_id"]},
+    ).one_or_none()
+    if row is None or row.title != payload["derived_title"]:
+        return
+    title = llm.generate_title(row.model_name, payload["content"])
+    if title:
+        db.execute(
+            text("UPDATE chats SET title = :t WHERE id = :c AND title = :derived"),
+            {"t": title, "c": payload["chat_id"], "derived": payload["derived_title"]},
+        )
+
+
+@handler("usage_record", batch=True)
+def _usage_record(db: Session, payloads: list[dict]) -> None:
+    """Write usage_events for a batch of LLM calls; cost comes from the model's per-1k prices."""
+    # Each insert upserts its usage rollup rows; a stable order keeps concurrent batches from deadlocking on them.
+    orphans = [p for p in payloads if not p.get("org")]
+    if orphans:
+        # usage_events needs an organization; users without one are not billed, but say so
+        logger.warning(
+            "usage of %d calls not recorded, no organization: users %s",
+            len(orphans),
+            sorted({p.get("user_id") for p in orphans}),
+        )
+    rows = sorted(
+        (p for p in payloads if p.get("org")),
+        key=lambda p: (p["org"], p.get("model_id") or 0, p.get("user_id") or "", p.get("chat_id") or ""),
+    )
+    if not rows:
+        return
+    db.execute(
+        text(
+            """
+            INSERT INTO usage_events (organization_id, user_id, event_type, model_id, chat_id, message_id,
+                                      tokens_in, tokens_out, cost, happened_at, meta)
+            SELECT CAST(:org AS uuid), CAST(:user_id AS uuid), 'chat_completion', m.id, CAST(:chat_id AS uuid), :message_id,
+                   :tokens_in, :tokens_out,
+                   (:tokens_in * m.price_input_1k + :tokens_out * m.price_output_1k) / 1000.0,
+                   CAST(:happened_at AS timestamptz), '{"estimated": true}'::jsonb
+            FROM models m WHERE m.id = :model_id
+            """
+        ),
+        rows,
+    )
+
+
+@handler("chat_stats_reconcile", batch=True)
+def _chat_stats_reconcile(db: Session, payloads: list[dict]) -> None:
+    """Recount chat (and project) stats from the rows; duplicates within a batch are recounted once."""
+    chat_ids = sorted({p["chat_id"] for p in payloads})
+    db.execute(text("SELECT chat_stats_recount(c) FROM unnest(CAST(:ids AS uuid[])) c"), {"ids": chat_ids})
+    db.execute(
+        text(
+            """
+            SELECT project_stats_recount(p)
+            FROM (SELECT DISTINCT project_id AS p FROM chats WHERE id = ANY(CAST(:ids AS uuid[])) AND project_id IS NOT NULL) x
+            """
+        ),
+        {"ids": chat_ids},
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    w = sub.add_parser("worker")
+    w.add_argument("--threads", type=int, default=int(os.getenv("JOBS_THREADS", "4")))
+    w.add_argument("--batch", type=int, default=CLAIM_BATCH)
+    w.add_argument("--kinds", help="comma-separated job kinds to run (default: all)")
+    w.add_argument("--drain", action="store_true", help="exit once the queue is empty")
+    e = sub.add_parser("enqueue")
+    e.add_argument("kind")
+    e.add_argument("payload", nargs="?", default="{}")
+    e.add_argument("--priority", type=int, default=PRIORITY_NORMAL)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [jobs] %(levelname)s %(message)s")
+
+    if args.cmd == "enqueue":
+        db = SessionLocal()
+        try:
+            enqueue(db, args.kind, json.loads(args.payload), priority=args.priority)
+            db.commit()
+        finally:
+            db.close()
+        return
+
+    kinds = args.kinds.split(",") if args.kinds else None
+    stop = threading.Event()
+    base = f"{socket.gethostname()}:{os.getpid()}"
+    counts: list[int] = []
+    threads = [
+        threading.Thread(
+            target=lambda i=i: counts.append(work(f"{base}:{i}", stop, args.batch, kinds, args.drain)),
+            name=f"jobs-{i}",
+            daemon=True,
+        )
+        for i in range(args.threads)
+    ]
+    # Stop like on Ctrl-C when a supervisor (docker, systemd) terminates the worker: running jobs finish first
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    try:
+        for t in threads:
+            while t.is_alive():
+                t.join(1)
+    except KeyboardInterrupt:
+        stop.set()
+        for t in threads:
+            t.join()
+    elapsed = time.perf_counter() - t0
+    logger.info("processed %d jobs in %.1fs (%.0f jobs/s)", sum(counts), elapsed, sum(counts) / elapsed if elapsed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,89 @@
+import hashlib
+import logging
 import os
+import threading
+from collections import OrderedDict
 from typing import Iterable
 
+from . import providers
 from .models import Message
 from .timeutil import utcnow
 
-# Map stored model names to OpenAI model IDs.
-MODEL_ALIASES = {
-    "clown 1.2": "gpt-3.5-turbo",
-    "clown 1.3": "gpt-3.5-turbo",
-    "clown 1.4": "gpt-4o-mini",
-}
+logger = logging.getLogger("llm")
 
+# Opt-in: identical prompts at low temperature are answered from memory instead of the provider.
+# The cache is per process and keyed only by model, temperature and transcript: identical transcripts
+# from different users and organizations share an entry, and with several server workers each has its
+# own cache, so the hit/miss counters in stats() describe the worker that served the request.
+REPLY_CACHE_ENABLED = os.getenv("LLM_REPLY_CACHE", "0") == "1"
+REPLY_CACHE_SIZE = int(os.getenv("LLM_REPLY_CACHE_SIZE", "1024"))
+REPLY_CACHE_MAX_TEMPERATURE = float(os.getenv("LLM_REPLY_CACHE_MAX_TEMPERATURE", "0.2"))
 
-def generate_reply(model_name: str, history: Iterable[Message], user_input: str) -> str:
-    """
-    Try to get an assistant reply from OpenAI. If anything goes wrong (no API key, import
-    error, request failure), return a deterministic stub so the UI keeps working offline.
-    """
-    api_key = os.getenv("OPENAI_API_KEY")
-    target_model = MODEL_ALIASES.get(model_name, os.getenv("OPENAI_MODEL", "gpt-3.5-turbo"))
 
-    if not api_key:
-        return _stub_reply(model_name, user_input)
+class ReplyCache:
+    """LRU of provider replies keyed by (model, temperature, normalized transcript)."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._data: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    @staticmethod
+    def key(model: str, temperature: float, messages: list[dict]) -> str:
+        h = hashlib.sha256(f"{model}\x00{temperature:.2f}".encode("utf-8"))
+        for m in messages:
+            # Whitespace differences don't change the answer we'd want back
+            h.update(b"\x00" + m["role"].encode("utf-8") + b"\x01" + " ".join(m["content"].split()).encode("utf-8"))
+        return h.hexdigest()
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            reply = self._data.get(key)
+            if reply is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return reply
+
+    def put(self, key: str, reply: str) -> None:
+        with self._lock:
+            self._data[key] = reply
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": REPLY_CACHE_ENABLED,
+                "entries": len(self._data),
+                "max_entries": self.max_entries,
+                "max_temperature": REPLY_CACHE_MAX_TEMPERATURE,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
 
-    try:
-        from openai import OpenAI  # type: ignore
-    except Exception:
-        return _stub_reply(model_name, user_input)
 
-    client = OpenAI(api_key=api_key)
+reply_cache = ReplyCache(REPLY_CACHE_SIZE)
+
+
+def generate_reply(
+    model_name: str, history: Iterable[Message], user_input: str, temperature: float = 0.7, fresh: bool = False
+) -> str:
+    """
+    Get an assistant reply through the model's backends (see providers). With no backend configured
+    or all of them failing, return a deterministic stub so the UI keeps working offline.
+    fresh=True (regeneration) skips the reply cache lookup; the new answer replaces the cached one.
+    """
+    route = providers.routes.get(model_name)
+    if route is None:
+        return _stub_reply(model_name, user_input)
 
     # Build a short transcript from history
     messages = []
@@ -39,17 +94,39 @@ def generate_reply(model_name: str, history: Iterable[Message], user_input: str)
     if not messages or messages[-1]["role"] != "user":
         messages.append({"role": "user", "content": user_input})
 
+    cache_key = None
+    if REPLY_CACHE_ENABLED and temperature <= REPLY_CACHE_MAX_TEMPERATURE:
+        cache_key = reply_cache.key(model_name, temperature, messages)
+        cached = None if fresh else reply_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
     try:
-        resp = client.chat.completions.create(
-            model=target_model,
-            messages=messages,
-            temperature=0.7,
-            max_tokens=512,
-        )
-        choice = resp.choices[0].message.content or ""
-        return choice.strip() or _stub_reply(model_name, user_input)
-    except Exception:
+        choice = providers.complete(route, messages, temperature, 512).text
+    except providers.AllBackendsFailed as e:
+        logger.warning("%s: every backend failed, answering with a stub: %s", model_name, e)
         return _stub_reply(model_name, user_input)
+    # Only real provider answers are cached; stubs are per-call and carry a timestamp
+    if cache_key is not None:
+        reply_cache.put(cache_key, choice)
+    return choice
+
+
+def generate_title(model_name: str, first_message: str) -> str | None:
+    """
+    A short chat title from the first prompt, or None when no backend is configured.
+    Backend errors propagate so a background caller can retry.
+    """
+    route = providers.routes.get(model_name)
+    if route is None:
+        return None
+    messages = [
+        {"role": "system", "content": "Reply with a title of at most six words for this conversation. No quotes."},
+        {"role": "user", "content": first_message[:2000]},
+    ]
+    reply = providers.complete(route, messages, 0.2, 24).text
+    title = " ".join(reply.strip('"').split())
+    return title[:200] or None
 
 
 def _stub_reply(model_name: str, user_input: str) -> str:
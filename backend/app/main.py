@@ -1,14 +1,33 @@
+import asyncio
+import base64
 import os
+from datetime import datetime, timedelta
+from typing import Literal, Optional
 from uuid import UUID
 
-from fastapi import FastAPI, Depends, HTTPException
+import orjson
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import select, text
+from sqlalchemy import and_, delete, select, text, tuple_, update
 from sqlalchemy.exc import IntegrityError
 
-from .db import get_db
-from .models import User, UserProfile, LLMModel, Project, Chat, Message, Organization
+from .db import SessionLocal, get_db, get_read_db, read_session, replicas
+from .models import (
+    User,
+    UserProfile,
+    LLMModel,
+    Project,
+    ProjectMember,
+    Chat,
+    ChatMember,
+    Message,
+    Organization,
+    OrganizationMember,
+    ApiKey,
+    Tag,
+)
 from .schemas import (
     TokenResponse,
     RegisterRequest,
@@ -19,10 +38,25 @@ from .schemas import (
     ProjectRead,
     ChatCreate,
     ChatRead,
+    ArchivedChatRead,
     ChatUpdate,
     MessageRead,
+    ActiveLeafUpdate,
+    ActiveLeafRead,
     MessageCreate,
+    MemberRead,
+    MemberUpsert,
+    TagCreate,
+    TagUpdate,
+    TagRead,
+    ChatIdsIn,
+    BulkResult,
     UserListItem,
+    AdminUserItem,
+    AdminUserPage,
+    ApiKeyCreate,
+    ApiKeyRead,
+    ApiKeyCreated,
     PlanResponse,
     PlanUpdate,
     BatchImportRequest,
@@ -30,16 +64,23 @@ from .schemas import (
     UserActivityReport,
     ProjectSummaryReport,
     DailyModelUsage,
+    OrgUsageSeries,
+    OrgModelUsage,
+    OrgProjectReport,
 )
 from .security import (
     hash_password,
     verify_password,
-    create_access_token,
+    issue_token,
     get_current_user,
+    get_stream_user_id,
     require_admin,
+    require_interactive,
+    require_scope,
 )
+from .responses import FastJSONResponse, rows_response, stream_json_array
 from .timeutil import utcnow
-from . import crud, seed
+from . import analytics, apikeys, compaction, crud, diagnostics, export, idempotency, jobs, llm, orgs, providers, ratelimit, realtime, serve, sessions, tiering
 
 app = FastAPI(title="ClownGPT API")
 
@@ -51,19 +92,52 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(serve.ColdStartLogger)
 
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
+# Seeding is a separate command (python -m app.seed); startup only warms this worker up.
+@app.on_event("startup")
+def _warmup():
+    serve.warmup()
+
+@app.on_event("shutdown")
+def _stop_llm_hedges():
+    providers.shutdown()
+
 @app.on_event("startup")
-def _run_seed():
-    seed.run_seed_if_enabled()
+async def _start_realtime():
+    if realtime.REALTIME_ENABLED:
+        realtime.hub.start()
+
+@app.on_event("shutdown")
+async def _stop_realtime():
+    await realtime.hub.stop()
+
+@app.on_event("startup")
+def _start_replica_monitor():
+    replicas.start()
+
+@app.on_event("shutdown")
+def _stop_replica_monitor():
+    replicas.stop()
+
+@app.on_event("startup")
+def _start_write_coalescers():
+    apikeys.usage.start()
+    sessions.start()
+
+@app.on_event("shutdown")
+def _flush_write_coalescers():
+    apikeys.usage.stop()
+    sessions.stop()
 
 # ---------------- AUTH ----------------
 
 @app.post("/api/auth/register", response_model=TokenResponse)
-def register(payload: RegisterRequest, db: Session = Depends(get_db)):
+def register(payload: RegisterRequest, request: Request, db: Session = Depends(get_db)):
     username = payload.username.strip()
     email = payload.email.strip().lower()
 
@@ -108,17 +182,17 @@ def register(payload: RegisterRequest, db: Session = Depends(get_db)):
     )
 
     crud.ensure_personal_org(db, u)
+    token = issue_token(db, u, request)
     try:
         db.commit()
     except IntegrityError:
         db.rollback()
         raise HTTPException(409, "User or email already exists")
 
-    token = create_access_token(str(u.id))
     return TokenResponse(access_token=token)
 
 @app.post("/api/auth/login", response_model=TokenResponse)
-def login(payload: LoginRequest, db: Session = Depends(get_db)):
+def login(payload: LoginRequest, request: Request, db: Session = Depends(get_db)):
     u = db.execute(select(User).where(User.username == payload.username)).scalar_one_or_none()
     if not u or not u.is_active:
         raise HTTPException(401, "Invalid credentials")
@@ -130,19 +204,96 @@ def login(payload: LoginRequest, db: Session = Depends(get_db)):
     u.updated_at = utcnow()
 
     crud.ensure_personal_org(db, u)
+    token = issue_token(db, u, request)
     db.commit()
+    orgs.invalidate(u.id)
 
-    token = create_access_token(str(u.id))
     return TokenResponse(access_token=token)
 
+@app.post("/api/auth/logout", status_code=204)
+def logout(request: Request, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+    """Revoke the calling session. Stateless tokens (AUTH_SESSIONS off) simply expire."""
+    if request.state.session_id:
+        sessions.revoke(db, request.state.session_id)
+        db.commit()
+
+@app.post("/api/auth/logout-all", status_code=204)
+def logout_all(db: Session = Depends(get_db), user: User = Depends(require_interactive)):
+    sessions.revoke_all(db, user.id)
+    db.commit()
+
 @app.get("/api/auth/me", response_model=UserMe)
 def me(user: User = Depends(get_current_user)):
     return UserMe(id=user.id, username=user.username, email=user.email, role=user.role)
 
+# ---------------- API KEYS ----------------
+
+API_KEY_COLUMNS = (
+    ApiKey.id,
+    ApiKey.name,
+    ApiKey.key_prefix,
+    ApiKey.scopes,
+    ApiKey.is_active,
+    ApiKey.created_at,
+    ApiKey.last_used_at,
+)
+
+
+@app.get("/api/keys", response_model=list[ApiKeyRead], tags=["auth"])
+def list_api_keys(db: Session = Depends(get_db), user: User = Depends(require_interactive)):
+    rows = db.execute(
+        select(*API_KEY_COLUMNS).where(ApiKey.user_id == user.id).order_by(ApiKey.created_at.desc())
+    ).mappings()
+    return [ApiKeyRead(**r) for r in rows]
+
+
+@app.post("/api/keys", response_model=ApiKeyCreated, tags=["auth"])
+def create_api_key(payload: ApiKeyCreate, db: Session = Depends(get_db), user: User = Depends(require_interactive)):
+    scopes = sorted(set(payload.scopes))
+    unknown = set(scopes) - apikeys.SCOPES
+    if unknown:
+        raise HTTPException(400, f"Unknown scopes: {', '.join(sorted(unknown))}")
+    if "admin" in scopes and user.role != "admin":
+        raise HTTPException(403, "Admin scope requires an admin account")
+
+    plaintext, prefix, key_hash = apikeys.generate_key()
+    k = ApiKey(
+        user_id=user.id,
+        name=payload.name.strip(),
+        key_prefix=prefix,
+        key_hash=key_hash,
+        scopes=scopes,
+        is_active=True,
+        created_at=utcnow(),
+    )
+    db.add(k)
+    db.commit()
+    return ApiKeyCreated(
+        id=k.id,
+        name=k.name,
+        key_prefix=k.key_prefix,
+        scopes=k.scopes,
+        is_active=k.is_active,
+        created_at=k.created_at,
+        last_used_at=None,
+        api_key=plaintext,
+    )
+
+
+@app.delete("/api/keys/{key_id}", status_code=204, tags=["auth"])
+def revoke_api_key(key_id: UUID, db: Session = Depends(get_db), user: User = Depends(require_interactive)):
+    k = db.execute(select(ApiKey).where(ApiKey.id == key_id, ApiKey.user_id == user.id)).scalar_one_or_none()
+    if not k:
+        raise HTTPException(404, "API key not found")
+    k.is_active = False
+    db.commit()
+    # Other workers drop it when their cache entry expires (API_KEY_CACHE_TTL_SEC)
+    apikeys.invalidate(k.key_hash)
+
 # ---------------- MODELS ----------------
 
 @app.get("/api/models", response_model=list[ModelRead])
-def list_models(db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+def list_models(db: Session = Depends(get_read_db), user: User = Depends(get_current_user)):
     rows = db.execute(select(LLMModel).where(LLMModel.is_active == True).order_by(LLMModel.id)).scalars().all()
     return [ModelRead(id=m.id, name=m.name, is_active=m.is_active, context_window=m.context_window) for m in rows]
 
@@ -151,34 +302,27 @@ def list_models(db: Session = Depends(get_db), user: User = Depends(get_current_
 ALLOWED_PLANS = {"free", "pro", "enterprise"}
 
 
-def _get_primary_org(db: Session, user: User) -> Organization:
-    org = (
-        db.execute(select(Organization).where(Organization.owner_user_id == user.id).order_by(Organization.created_at))
-        .scalar_one_or_none()
-    )
-    if not org:
-        org = crud.ensure_personal_org(db, user)
-        db.commit()
-        db.refresh(org)
-    return org
-
-
 @app.get("/api/org/plan", response_model=PlanResponse)
-def get_plan(db: Session = Depends(get_db), user: User = Depends(get_current_user)):
-    org = _get_primary_org(db, user)
-    return PlanResponse(plan=org.plan)
+def get_plan(
+    db: Session = Depends(get_db), user: User = Depends(get_current_user), org: orgs.OrgContext = Depends(orgs.org_context)
+):
+    return PlanResponse(plan=orgs.ensure_primary(db, user, org).plan)
 
 
 @app.post("/api/org/plan", response_model=PlanResponse)
-def update_plan(payload: PlanUpdate, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+def update_plan(
+    payload: PlanUpdate,
+    db: Session = Depends(get_db),
+    user: User = Depends(require_interactive),
+    org: orgs.OrgContext = Depends(orgs.org_context),
+):
     if payload.plan not in ALLOWED_PLANS:
         raise HTTPException(400, "Plan not allowed")
-    org = _get_primary_org(db, user)
-    org.plan = payload.plan
-    org.updated_at = utcnow()
+    org_id = orgs.ensure_primary(db, user, org).org_id
+    db.execute(update(Organization).where(Organization.id == org_id).values(plan=payload.plan, updated_at=utcnow()))
     db.commit()
-    db.refresh(org)
-    return PlanResponse(plan=org.plan)
+    orgs.invalidate(user.id)
+    return PlanResponse(plan=payload.plan)
 
 # ---------------- BATCH IMPORT (service token protected) ----------------
 
@@ -283,51 +427,130 @@ def batch_import(payload: BatchImportRequest, dry_run: bool = False, db: Session
 
 # ---------------- REPORTS (service token protected) ----------------
 
+USER_ACTIVITY_SQL = text(
+    """
+    SELECT user_id, username, role, owned_chats, user_messages, assistant_messages
+    FROM view_user_activity
+    ORDER BY user_messages DESC NULLS LAST
+    """
+)
+
+PROJECT_SUMMARY_SQL = text(
+    """
+    SELECT project_id, name, visibility, chat_count, message_count, last_activity_at
+    FROM view_project_summary
+    ORDER BY last_activity_at DESC NULLS LAST, chat_count DESC
+    """
+)
+
+MODEL_USAGE_SQL = text(
+    """
+    SELECT day, model_name, calls, tokens_in, tokens_out, cost
+    FROM view_daily_model_usage
+    ORDER BY day DESC, model_name
+    """
+)
+
+
 @app.get("/api/reports/user-activity", response_model=list[UserActivityReport], tags=["reports"])
-def report_user_activity(db: Session = Depends(get_db)):
-    rows = db.execute(
-        text(
-            """
-            SELECT user_id, username, role, owned_chats, user_messages, assistant_messages
-            FROM view_user_activity
-            ORDER BY user_messages DESC NULLS LAST
-            """
-        )
-    ).all()
-    return [UserActivityReport(**dict(r._mapping)) for r in rows]
+def report_user_activity(stream: bool = False, db: Session = Depends(get_read_db)):
+    if stream:
+        return stream_json_array(USER_ACTIVITY_SQL, UserActivityReport, session_factory=read_session)
+    return rows_response(db.execute(USER_ACTIVITY_SQL).mappings(), UserActivityReport)
 
 
 @app.get("/api/reports/project-summary", response_model=list[ProjectSummaryReport], tags=["reports"])
-def report_project_summary(db: Session = Depends(get_db)):
-    rows = db.execute(
-        text(
-            """
-            SELECT project_id, name, visibility, chat_count, message_count, last_activity_at
-            FROM view_project_summary
-            ORDER BY last_activity_at DESC NULLS LAST, chat_count DESC
-            """
-        )
-    ).all()
-    return [ProjectSummaryReport(**dict(r._mapping)) for r in rows]
+def report_project_summary(stream: bool = False, db: Session = Depends(get_read_db)):
+    if stream:
+        return stream_json_array(PROJECT_SUMMARY_SQL, ProjectSummaryReport, session_factory=read_session)
+    return rows_response(db.execute(PROJECT_SUMMARY_SQL).mappings(), ProjectSummaryReport)
 
 
 @app.get("/api/reports/model-usage", response_model=list[DailyModelUsage], tags=["reports"])
-def report_model_usage(db: Session = Depends(get_db)):
-    rows = db.execute(
-        text(
-            """
-            SELECT day, model_name, calls, tokens_in, tokens_out, cost
-            FROM view_daily_model_usage
-            ORDER BY day DESC, model_name
-            """
-        )
-    ).all()
-    return [DailyModelUsage(**dict(r._mapping)) for r in rows]
+def report_model_usage(stream: bool = False, db: Session = Depends(get_read_db)):
+    if stream:
+        return stream_json_array(MODEL_USAGE_SQL, DailyModelUsage, session_factory=read_session)
+    return rows_response(db.execute(MODEL_USAGE_SQL).mappings(), DailyModelUsage)
+
+# ---------------- ORGANIZATION ANALYTICS ----------------
+
+ANALYTICS_DEFAULT_RANGE = timedelta(days=30)
+
+
+def _analytics_range(start: Optional[datetime], end: Optional[datetime]) -> tuple[datetime, datetime]:
+    end = end or utcnow()
+    return start or end - ANALYTICS_DEFAULT_RANGE, end
+
+
+@app.get("/api/orgs/{org_id}/analytics/usage", response_model=OrgUsageSeries, tags=["analytics"])
+def org_usage_series(
+    org_id: UUID,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    granularity: Literal["hour", "day", "week"] = "day",
+    group_by: Optional[Literal["model", "user", "project"]] = None,
+    db: Session = Depends(get_read_db),
+    user: User = Depends(require_scope("analytics:read")),
+):
+    """Calls, tokens and cost per UTC bucket over [start, end) (default: the last 30 days), from the usage rollups."""
+    _require_role(crud.get_org_role(db, org_id, user.id), "viewer", "Organization not found")
+    try:
+        lo, hi, rows = analytics.usage_series(db, org_id, *_analytics_range(start, end), granularity, group_by)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    return OrgUsageSeries(organization_id=org_id, granularity=granularity, group_by=group_by, start=lo, end=hi, points=rows)
+
+
+@app.get("/api/orgs/{org_id}/analytics/models", response_model=list[OrgModelUsage], tags=["analytics"])
+def org_model_usage(
+    org_id: UUID,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    db: Session = Depends(get_read_db),
+    user: User = Depends(require_scope("analytics:read")),
+):
+    """fn_model_usage_report over the whole UTC days covering [start, end)."""
+    _require_role(crud.get_org_role(db, org_id, user.id), "viewer", "Organization not found")
+    try:
+        _, _, rows = analytics.model_usage(db, org_id, *_analytics_range(start, end))
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    return rows_response(rows, OrgModelUsage)
+
+
+@app.get("/api/orgs/{org_id}/analytics/projects", response_model=list[OrgProjectReport], tags=["analytics"])
+def org_project_report(
+    org_id: UUID, db: Session = Depends(get_read_db), user: User = Depends(require_scope("analytics:read"))
+):
+    _require_role(crud.get_org_role(db, org_id, user.id), "viewer", "Organization not found")
+    return rows_response(analytics.project_report(db, org_id), OrgProjectReport)
+
+@app.get("/api/admin/analytics/cache", tags=["admin"])
+def analytics_cache_stats(admin: User = Depends(require_admin)):
+    return analytics.cache.stats()
+
+@app.get("/api/admin/llm/reply-cache", tags=["admin"])
+def reply_cache_stats(admin: User = Depends(require_admin)):
+    return llm.reply_cache.stats()
+
+@app.get("/api/admin/llm/backends", tags=["admin"])
+def llm_backend_stats(admin: User = Depends(require_admin)):
+    """Latency, error rate and breaker state of every backend that has served a call in this process."""
+    return providers.stats()
+
+@app.post("/api/admin/diagnostics/triggers", tags=["admin"])
+def profile_triggers(rows: int = 200, admin: User = Depends(require_admin)):
+    """Per-trigger cost of a rolled-back write workload (see app.diagnostics). Takes a few seconds."""
+    db = SessionLocal()
+    try:
+        return diagnostics.profile_triggers(db, rows)
+    finally:
+        db.close()
 
 # ---------------- USERS (sidebar list) ----------------
 
 @app.get("/api/users", response_model=list[UserListItem])
-def list_users(db: Session = Depends(get_db), admin: User = Depends(require_admin)):
+def list_users(db: Session = Depends(get_read_db), admin: User = Depends(require_admin)):
     rows = (
         db.execute(select(User).where(User.is_active == True).order_by(User.created_at.desc()).limit(20))
         .scalars()
@@ -335,24 +558,94 @@ def list_users(db: Session = Depends(get_db), admin: User = Depends(require_admi
     )
     return [UserListItem(id=u.id, username=u.username, role=u.role) for u in rows]
 
+def _encode_cursor(sort_key, user_id) -> str:
+    value = sort_key.isoformat() if isinstance(sort_key, datetime) else sort_key
+    return base64.urlsafe_b64encode(orjson.dumps([value, str(user_id)])).decode().rstrip("=")
+
+def _decode_cursor(cursor: str, sort: str) -> tuple:
+    try:
+        value, user_id = orjson.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if sort != "username":
+            value = datetime.fromisoformat(value)
+        return value, UUID(user_id)
+    except (ValueError, TypeError):
+        raise HTTPException(400, "Invalid cursor")
+
+@app.get("/api/admin/users", response_model=AdminUserPage, tags=["admin"])
+def admin_user_directory(
+    q: Optional[str] = Query(None, max_length=254),
+    match: Literal["prefix", "contains"] = "prefix",
+    role: Optional[Literal["admin", "member", "moderator"]] = None,
+    active: Optional[bool] = None,
+    last_login_after: Optional[datetime] = None,
+    last_login_before: Optional[datetime] = None,
+    sort: Literal["created", "last_login", "username"] = "created",
+    cursor: Optional[str] = None,
+    limit: int = 50,
+    db: Session = Depends(get_read_db),
+    admin: User = Depends(require_admin),
+):
+    """
+    Every user, newest first by default. q searches username and email (prefix, or substring with
+    match=contains, which needs 3+ characters for the trigram index). Pass next_cursor back for the
+    next page; sort=last_login lists only users who have logged in.
+    """
+    q = (q or "").strip() or None
+    if q and match == "contains" and len(q) < 3:
+        raise HTTPException(400, "Substring search needs at least 3 characters")
+    limit = min(max(limit, 1), 200)
+    stmt = crud.user_directory_select(
+        q=q,
+        match=match,
+        role=role,
+        active=active,
+        login_after=last_login_after,
+        login_before=last_login_before,
+        sort=sort,
+        after=_decode_cursor(cursor, sort) if cursor else None,
+        limit=limit,
+    )
+    rows = db.execute(stmt).mappings().all()
+    next_cursor = _encode_cursor(rows[-1]["sort_key"], rows[-1]["id"]) if len(rows) == limit else None
+    return AdminUserPage(items=[AdminUserItem(**r) for r in rows], next_cursor=next_cursor)
+
 # ---------------- PROJECTS ----------------
 
 @app.get("/api/projects", response_model=list[ProjectRead])
-def list_projects(db: Session = Depends(get_db), user: User = Depends(get_current_user)):
-    rows = (
-        db.execute(select(Project).where(Project.owner_user_id == user.id).order_by(Project.updated_at.desc()))
-        .scalars()
-        .all()
+def list_projects(
+    org_id: Optional[UUID] = None,
+    db: Session = Depends(get_read_db),
+    user: User = Depends(require_scope("projects:read")),
+    org: orgs.OrgContext = Depends(orgs.org_context),
+):
+    """
+    Projects the caller sees: owned and shared ones through project_members (owners have a row too), plus
+    the non-private projects of their organizations. org_id narrows the list to one organization.
+    """
+    org_ids = list(org.roles) if org_id is None else [o for o in (org_id,) if o in org.roles]
+    stmt = crud.project_read_select(user.id, org_ids).where(
+        Project.id.in_(crud.visible_projects(user.id, org_ids)), Project.deleted_at.is_(None)
     )
-    return rows
+    if org_id is not None:
+        stmt = stmt.where(Project.organization_id == org_id)
+    rows = db.execute(stmt.order_by(Project.updated_at.desc())).mappings()
+    return rows_response(rows, ProjectRead)
 
 @app.post("/api/projects", response_model=ProjectRead)
-def create_project(payload: ProjectCreate, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+def create_project(
+    payload: ProjectCreate,
+    db: Session = Depends(get_db),
+    user: User = Depends(require_scope("projects:write")),
+    org: orgs.OrgContext = Depends(orgs.org_context),
+):
+    org_id = payload.organization_id or orgs.ensure_primary(db, user, org).org_id
+    # The cached context only picks the default; the write is authorized against the live membership
+    _require_role(crud.get_org_role(db, org_id, user.id), "editor", "Organization not found")
     crud.set_actor(db, user.id)
 
     now = utcnow()
     p = Project(
-        organization_id=None,
+        organization_id=org_id,
         owner_user_id=user.id,
         name=payload.name.strip(),
         description=payload.description or "",
@@ -368,33 +661,37 @@ def create_project(payload: ProjectCreate, db: Session = Depends(get_db), user:
 
     crud.ensure_project_member_owner(db, p.id, user.id)
     db.commit()
-    db.refresh(p)
-    return p
+
+    row = db.execute(crud.project_read_select(user.id, list(org.roles)).where(Project.id == p.id)).mappings().one()
+    return ProjectRead(**row)
 
 # ---------------- CHATS ----------------
 
 @app.get("/api/chats", response_model=list[ChatRead])
-def list_chats(db: Session = Depends(get_db), user: User = Depends(get_current_user)):
-    chats = db.execute(select(Chat).where(Chat.owner_user_id == user.id).order_by(Chat.updated_at.desc())).scalars().all()
-    models = {m.id: m.name for m in db.execute(select(LLMModel)).scalars().all()}
-
-    return [
-        ChatRead(
-            id=c.id,
-            title=c.title,
-            status=c.status,
-            pinned=c.pinned,
-            model_id=c.model_id,
-            model_name=models.get(c.model_id, "unknown"),
-            project_id=c.project_id,
-            created_at=c.created_at,
-            updated_at=c.updated_at,
-        )
-        for c in chats
-    ]
+def list_chats(
+    db: Session = Depends(get_read_db),
+    user: User = Depends(require_scope("chat:read")),
+    tag: Optional[list[int]] = Query(None),
+    tag_mode: Literal["any", "all"] = "any",
+    limit: Optional[int] = None,
+    before_updated_at: Optional[datetime] = None,
+    before_id: Optional[UUID] = None,
+):
+    # Direct and project memberships alike, the grants get_chat_with_role() checks. Deleted chats are filtered
+    # by chat_read_select; archived ones are listed by /api/chats/trash, not here.
+    q = crud.chat_read_select(user.id).where(Chat.id.in_(crud.visible_chats(user.id)), Chat.status == "active")
+    if tag:
+        q = q.where(Chat.id.in_(crud.chats_tagged(tag, match_all=tag_mode == "all")))
+    # Keyset paging: pass the last row's updated_at/id to get the next page
+    if before_updated_at is not None and before_id is not None:
+        q = q.where(tuple_(Chat.updated_at, Chat.id) < tuple_(before_updated_at, before_id))
+    q = q.order_by(Chat.updated_at.desc(), Chat.id.desc())
+    if limit is not None:
+        q = q.limit(min(max(limit, 1), 500))
+    return rows_response(db.execute(q).mappings(), ChatRead)
 
 @app.post("/api/chats", response_model=ChatRead)
-def create_chat(payload: ChatCreate, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+def create_chat(payload: ChatCreate, db: Session = Depends(get_db), user: User = Depends(require_scope("chat:write"))):
     crud.set_actor(db, user.id)
 
     try:
@@ -403,9 +700,8 @@ def create_chat(payload: ChatCreate, db: Session = Depends(get_db), user: User =
         raise HTTPException(400, "Model not found")
 
     if payload.project_id:
-        p = db.execute(select(Project).where(Project.id == payload.project_id, Project.owner_user_id == user.id)).scalar_one_or_none()
-        if not p:
-            raise HTTPException(403, "Project not found or not yours")
+        if not crud.role_at_least(crud.get_project_role(db, payload.project_id, user.id), "editor"):
+            raise HTTPException(403, "Project not found or not writable")
 
     now = utcnow()
     c = Chat(
@@ -440,15 +736,17 @@ def create_chat(payload: ChatCreate, db: Session = Depends(get_db), user: User =
         project_id=c.project_id,
         created_at=c.created_at,
         updated_at=c.updated_at,
+        role="owner",
     )
 
 @app.patch("/api/chats/{chat_id}", response_model=ChatRead)
-def update_chat(chat_id: UUID, payload: ChatUpdate, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+def update_chat(chat_id: UUID, payload: ChatUpdate, db: Session = Depends(get_db), user: User = Depends(require_scope("chat:write"))):
     crud.set_actor(db, user.id)
 
-    c = db.execute(select(Chat).where(Chat.id == chat_id, Chat.owner_user_id == user.id)).scalar_one_or_none()
-    if not c:
-        raise HTTPException(404, "Chat not found")
+    c, role = crud.get_chat_with_role(db, chat_id, user.id)
+    _require_role(role, "editor", "Chat not found")
+    if payload.status is not None:
+        _require_role(role, "owner", "Chat not found")
 
     if payload.title is not None:
         c.title = payload.title.strip()
@@ -466,18 +764,241 @@ def update_chat(chat_id: UUID, payload: ChatUpdate, db: Session = Depends(get_db
     c.updated_at = utcnow()
     db.commit()
 
-    model_name = db.execute(select(LLMModel.name).where(LLMModel.id == c.model_id)).scalar_one()
-    return ChatRead(
-        id=c.id,
-        title=c.title,
-        status=c.status,
-        pinned=c.pinned,
-        model_id=c.model_id,
-        model_name=model_name,
-        project_id=c.project_id,
-        created_at=c.created_at,
-        updated_at=c.updated_at,
+    row = crud.get_chat_read(db, chat_id, user.id)
+    return ChatRead(**row)
+
+
+@app.get("/api/chats/trash", response_model=list[ArchivedChatRead])
+def list_trashed_chats(db: Session = Depends(get_read_db), user: User = Depends(require_scope("chat:read"))):
+    """Own deleted and archived chats, including those already moved to the cold archive."""
+    rows = db.execute(
+        text(
+            """
+            SELECT id, title, status, project_id, updated_at, deleted_at, NULL::timestamptz AS archived_at
+            FROM chats
+            WHERE owner_user_id = :u AND status <> 'active'
+            UNION ALL
+            SELECT id, title, status, project_id, updated_at, deleted_at, archived_at
+            FROM chats_archive
+            WHERE owner_user_id = :u
+            ORDER BY updated_at DESC
+            """
+        ),
+        {"u": str(user.id)},
+    ).mappings()
+    return [ArchivedChatRead(**r) for r in rows]
+
+
+@app.delete("/api/chats/{chat_id}", status_code=204)
+def delete_chat(chat_id: UUID, db: Session = Depends(get_db), user: User = Depends(require_scope("chat:write"))):
+    crud.set_actor(db, user.id)
+    c, role = crud.get_chat_with_role(db, chat_id, user.id)
+    _require_role(role, "owner", "Chat not found")
+    c.status = "deleted"
+    c.deleted_at = c.updated_at = utcnow()
+    db.commit()
+
+
+@app.post("/api/chats/{chat_id}/archive", response_model=ChatRead)
+def archive_chat(chat_id: UUID, db: Session = Depends(get_db), user: User = Depends(require_scope("chat:write"))):
+    crud.set_actor(db, user.id)
+    c, role = crud.get_chat_with_role(db, chat_id, user.id)
+    _require_role(role, "owner", "Chat not found")
+    c.status = "archived"
+    c.updated_at = utcnow()
+    db.commit()
+    row = crud.get_chat_read(db, chat_id, user.id)
+    return ChatRead(**row)
+
+
+@app.post("/api/chats/{chat_id}/restore", response_model=ChatRead)
+def restore_chat(chat_id: UUID, db: Session = Depends(get_db), user: User = Depends(require_scope("chat:write"))):
+    crud.set_actor(db, user.id)
+    c, role = crud.get_chat_with_role(db, chat_id, user.id, include_deleted=True)
+    if c is None:
+        # Not in the hot table: bring it back from the cold archive (owner only)
+        if compaction.archived_owner(db, chat_id) != user.id or not compaction.restore_chat(db, chat_id):
+            raise HTTPException(404, "Chat not found")
+        c, role = crud.get_chat_with_role(db, chat_id, user.id, include_deleted=True)
+    _require_role(role, "owner", "Chat not found")
+
+    c.status = "active"
+    c.deleted_at = None
+    c.updated_at = utcnow()
+    db.commit()
+    row = crud.get_chat_read(db, chat_id, user.id)
+    return ChatRead(**row)
+
+# ---------------- TAGS ----------------
+
+TAG_COLUMNS = (Tag.id, Tag.organization_id, Tag.name, Tag.color, Tag.created_at)
+MAX_BULK_CHATS = 10_000
+
+
+def _tag_for_edit(db: Session, tag_id: int, user: User) -> Tag:
+    t = db.get(Tag, tag_id)
+    if not t or t.organization_id is None:
+        raise HTTPException(404, "Tag not found")
+    _require_role(crud.get_org_role(db, t.organization_id, user.id), "editor", "Tag not found")
+    return t
+
+
+@app.get("/api/tags", response_model=list[TagRead], tags=["tags"])
+def list_tags(db: Session = Depends(get_read_db), user: User = Depends(require_scope("chat:read"))):
+    rows = db.execute(
+        select(*TAG_COLUMNS)
+        .join(
+            OrganizationMember,
+            and_(OrganizationMember.organization_id == Tag.organization_id, OrganizationMember.user_id == user.id),
+        )
+        .where(OrganizationMember.is_active == True)
+        .order_by(Tag.name)
+    ).mappings()
+    return [TagRead(**r) for r in rows]
+
+
+@app.post("/api/tags", response_model=TagRead, tags=["tags"])
+def create_tag(
+    payload: TagCreate,
+    db: Session = Depends(get_db),
+    user: User = Depends(require_scope("chat:write")),
+    org: orgs.OrgContext = Depends(orgs.org_context),
+):
+    org_id = payload.organization_id or org.org_id
+    if not org_id:
+        raise HTTPException(400, "No organization")
+    _require_role(crud.get_org_role(db, org_id, user.id), "editor", "Organization not found")
+
+    t = Tag(
+        organization_id=org_id,
+        name=payload.name.strip(),
+        color=payload.color,
+        created_by=user.id,
+        created_at=utcnow(),
     )
+    db.add(t)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(409, "Tag already exists")
+    return TagRead(id=t.id, organization_id=t.organization_id, name=t.name, color=t.color, created_at=t.created_at)
+
+
+@app.patch("/api/tags/{tag_id}", response_model=TagRead, tags=["tags"])
+def update_tag(tag_id: int, payload: TagUpdate, db: Session = Depends(get_db), user: User = Depends(require_scope("chat:write"))):
+    t = _tag_for_edit(db, tag_id, user)
+    if payload.name is not None:
+        t.name = payload.name.strip()
+    if payload.color is not None:
+        t.color = payload.color
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(409, "Tag already exists")
+    return TagRead(id=t.id, organization_id=t.organization_id, name=t.name, color=t.color, created_at=t.created_at)
+
+
+@app.delete("/api/tags/{tag_id}", status_code=204, tags=["tags"])
+def delete_tag(tag_id: int, db: Session = Depends(get_db), user: User = Depends(require_scope("chat:write"))):
+    db.delete(_tag_for_edit(db, tag_id, user))
+    db.commit()
+
+
+@app.post("/api/tags/{tag_id}/chats", response_model=BulkResult, tags=["tags"])
+def tag_chats(tag_id: int, payload: ChatIdsIn, db: Session = Depends(get_db), user: User = Depends(require_scope("chat:write"))):
+    if len(payload.chat_ids) > MAX_BULK_CHATS:
+        raise HTTPException(400, f"At most {MAX_BULK_CHATS} chats per request")
+    _tag_for_edit(db, tag_id, user)
+    affected = crud.tag_chats(db, tag_id, payload.chat_ids, user.id)
+    db.commit()
+    return BulkResult(affected=affected)
+
+
+@app.delete("/api/tags/{tag_id}/chats", response_model=BulkResult, tags=["tags"])
+def untag_chats(tag_id: int, payload: ChatIdsIn, db: Session = Depends(get_db), user: User = Depends(require_scope("chat:write"))):
+    if len(payload.chat_ids) > MAX_BULK_CHATS:
+        raise HTTPException(400, f"At most {MAX_BULK_CHATS} chats per request")
+    _tag_for_edit(db, tag_id, user)
+    affected = crud.untag_chats(db, tag_id, payload.chat_ids, user.id)
+    db.commit()
+    return BulkResult(affected=affected)
+
+# ---------------- SHARING ----------------
+
+def _require_role(role: str | None, min_role: str, not_found: str) -> None:
+    """No role at all reads as 404 so ids of foreign chats/projects are not disclosed."""
+    if role is None:
+        raise HTTPException(404, not_found)
+    if not crud.role_at_least(role, min_role):
+        raise HTTPException(403, f"Requires {min_role} role")
+
+
+def _member_user_id(db: Session, username: str) -> UUID:
+    uid = db.execute(select(User.id).where(User.username == username, User.is_active == True)).scalar_one_or_none()
+    if not uid:
+        raise HTTPException(404, "User not found")
+    return uid
+
+
+@app.get("/api/chats/{chat_id}/members", response_model=list[MemberRead], tags=["sharing"])
+def list_chat_members(chat_id: UUID, db: Session = Depends(get_read_db), user: User = Depends(require_scope("chat:read"))):
+    _require_role(crud.get_chat_role(db, chat_id, user.id), "viewer", "Chat not found")
+    return [MemberRead(**m) for m in crud.list_members(db, ChatMember, "chat_id", chat_id)]
+
+
+@app.put("/api/chats/{chat_id}/members", response_model=list[MemberRead], tags=["sharing"])
+def share_chat(chat_id: UUID, payload: MemberUpsert, db: Session = Depends(get_db), user: User = Depends(require_scope("chat:write"))):
+    crud.set_actor(db, user.id)
+    _require_role(crud.get_chat_role(db, chat_id, user.id), "owner", "Chat not found")
+    member_id = _member_user_id(db, payload.username)
+    if member_id == user.id:
+        raise HTTPException(400, "Cannot change your own role")
+    crud.upsert_member(db, ChatMember, "chat_id", chat_id, member_id, payload.role)
+    db.commit()
+    return [MemberRead(**m) for m in crud.list_members(db, ChatMember, "chat_id", chat_id)]
+
+
+@app.delete("/api/chats/{chat_id}/members/{member_id}", status_code=204, tags=["sharing"])
+def unshare_chat(chat_id: UUID, member_id: UUID, db: Session = Depends(get_db), user: User = Depends(require_scope("chat:write"))):
+    crud.set_actor(db, user.id)
+    c, role = crud.get_chat_with_role(db, chat_id, user.id)
+    # Members may leave on their own; removing others is for owners
+    _require_role(role, "viewer" if member_id == user.id else "owner", "Chat not found")
+    if member_id == c.owner_user_id:
+        raise HTTPException(400, "Cannot remove the chat owner")
+    db.execute(delete(ChatMember).where(ChatMember.chat_id == chat_id, ChatMember.user_id == member_id))
+    db.commit()
+
+
+@app.get("/api/projects/{project_id}/members", response_model=list[MemberRead], tags=["sharing"])
+def list_project_members(project_id: UUID, db: Session = Depends(get_read_db), user: User = Depends(require_scope("projects:read"))):
+    _require_role(crud.get_project_role(db, project_id, user.id), "viewer", "Project not found")
+    return [MemberRead(**m) for m in crud.list_members(db, ProjectMember, "project_id", project_id)]
+
+
+@app.put("/api/projects/{project_id}/members", response_model=list[MemberRead], tags=["sharing"])
+def share_project(project_id: UUID, payload: MemberUpsert, db: Session = Depends(get_db), user: User = Depends(require_scope("projects:write"))):
+    crud.set_actor(db, user.id)
+    _require_role(crud.get_project_role(db, project_id, user.id), "owner", "Project not found")
+    member_id = _member_user_id(db, payload.username)
+    if member_id == user.id:
+        raise HTTPException(400, "Cannot change your own role")
+    crud.upsert_member(db, ProjectMember, "project_id", project_id, member_id, payload.role)
+    db.commit()
+    return [MemberRead(**m) for m in crud.list_members(db, ProjectMember, "project_id", project_id)]
+
+
+@app.delete("/api/projects/{project_id}/members/{member_id}", status_code=204, tags=["sharing"])
+def unshare_project(project_id: UUID, member_id: UUID, db: Session = Depends(get_db), user: User = Depends(require_scope("projects:write"))):
+    crud.set_actor(db, user.id)
+    _require_role(crud.get_project_role(db, project_id, user.id), "viewer" if member_id == user.id else "owner", "Project not found")
+    owner_id = db.execute(select(Project.owner_user_id).where(Project.id == project_id)).scalar_one()
+    if member_id == owner_id:
+        raise HTTPException(400, "Cannot remove the project owner")
+    db.execute(delete(ProjectMember).where(ProjectMember.project_id == project_id, ProjectMember.user_id == member_id))
+    db.commit()
 
 # ---------------- MESSAGES ----------------
 
@@ -485,28 +1006,41 @@ def update_chat(chat_id: UUID, payload: ChatUpdate, db: Session = Depends(get_db
 def list_messages(
     chat_id: UUID,
     db: Session = Depends(get_db),
-    user: User = Depends(get_current_user),
+    rdb: Session = Depends(get_read_db),
+    user: User = Depends(require_scope("chat:read")),
     limit: int = 50,
+    branch: bool = False,
 ):
-    c = db.execute(select(Chat).where(Chat.id == chat_id, Chat.owner_user_id == user.id)).scalar_one_or_none()
-    if not c:
-        raise HTTPException(404, "Chat not found")
-
-    msgs = (
-        db.execute(
-            select(Message)
-            .where(Message.chat_id == chat_id, Message.deleted_at.is_(None))
-            .order_by(Message.id.asc())
-            .limit(min(max(limit, 1), 200))
-        )
-        .scalars()
-        .all()
-    )
-
+    """All messages in id order, or with branch=true the newest `limit` of the active branch."""
+    _require_role(crud.get_chat_role(rdb, chat_id, user.id), "viewer", "Chat not found")
+    limit = min(max(limit, 1), 200)
+    leaf = rdb.execute(select(Chat.active_leaf_id).where(Chat.id == chat_id)).scalar_one_or_none() if branch else None
+
+    # The cold/hot decision is made on the primary: a lagging replica may still point at a segment
+    # that was rehydrated and deleted.
+    if leaf is not None:
+        cold = tiering.load_branch(db, chat_id, leaf)
+        if cold is not None:
+            return rows_response(cold[-limit:], MessageRead)
+    else:
+        cold = tiering.load_messages(db, chat_id)
+        if cold is not None:
+            return rows_response(cold[:limit], MessageRead)
+
+    q = crud.message_read_select().where(Message.chat_id == chat_id, Message.deleted_at.is_(None))
+    if leaf is not None:
+        path = crud.branch_cte(chat_id, leaf, limit)
+        q = q.join(path, path.c.id == Message.id)
+    rows = rdb.execute(q.order_by(Message.id.asc()).limit(limit)).mappings()
+    return rows_response(rows, MessageRead)
+
+
+def _message_reads(msgs: list[Message]) -> list[MessageRead]:
     return [
         MessageRead(
             id=m.id,
             chat_id=m.chat_id,
+            parent_id=m.parent_id,
             sender_type=m.sender_type,
             sender_user_id=m.sender_user_id,
             content=m.content,
@@ -515,29 +1049,238 @@ def list_messages(
         for m in msgs
     ]
 
+
+def _enqueue_usage(db: Session, plan: ratelimit.PlanContext, user: User, chat: Chat, prompt: str, bot_msg: Message) -> int:
+    """Queue the usage_events row for one LLM call; returns the estimated tokens for the rate limiter."""
+    tokens_in, tokens_out = ratelimit.estimate_tokens(prompt), ratelimit.estimate_tokens(bot_msg.content)
+    jobs.enqueue(
+        db,
+        "usage_record",
+        {
+            "org": str(plan.org_id) if plan.org_id else None,
+            "user_id": str(user.id),
+            "model_id": chat.model_id,
+            "chat_id": str(chat.id),
+            "message_id": bot_msg.id,
+            "tokens_in": tokens_in,
+            "tokens_out": tokens_out,
+            "happened_at": bot_msg.created_at.isoformat(),
+        },
+        priority=jobs.PRIORITY_LOW,
+    )
+    return tokens_in + tokens_out
+
 @app.post("/api/chats/{chat_id}/messages", response_model=list[MessageRead])
-def create_message(chat_id: UUID, payload: MessageCreate, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+def create_message(
+    chat_id: UUID,
+    payload: MessageCreate,
+    db: Session = Depends(get_db),
+    user: User = Depends(require_scope("chat:write")),
+    plan: ratelimit.PlanContext = Depends(ratelimit.message_plan),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
     crud.set_actor(db, user.id)
 
-    c = db.execute(select(Chat).where(Chat.id == chat_id, Chat.owner_user_id == user.id)).scalar_one_or_none()
-    if not c:
-        raise HTTPException(404, "Chat not found")
+    c, role = crud.get_chat_with_role(db, chat_id, user.id)
+    _require_role(role, "editor", "Chat not found")
 
     content = payload.content.strip()
     if not content:
         raise HTTPException(400, "Empty message")
 
+    # A retried request with the same key gets the stored reply instead of a second message + LLM call
+    if idempotency_key is not None:
+        if not 0 < len(idempotency_key) <= idempotency.MAX_KEY_LENGTH:
+            raise HTTPException(400, "Invalid Idempotency-Key")
+        try:
+            replay = idempotency.claim(db, user.id, idempotency_key, idempotency.request_hash(chat_id, content))
+        except idempotency.KeyReused:
+            raise HTTPException(422, "Idempotency-Key was already used for a different request")
+        if replay is not None:
+            db.rollback()
+            return FastJSONResponse(replay, headers={"Idempotent-Replayed": "true"})
+
+    # Limits apply to new work only: a replay above has already been charged when it first ran
+    ratelimit.enforce(plan)
+    cold_key = tiering.ensure_hot(db, chat_id)
     created = crud.add_message_with_assistant(db, c, user, content)
+    result = _message_reads(created)
+    if idempotency_key is not None:
+        idempotency.store_response(db, user.id, idempotency_key, [r.model_dump(mode="json") for r in result])
+    user_msg, bot_msg = created
+    tokens = _enqueue_usage(db, plan, user, c, user_msg.content, bot_msg)
     db.commit()
+    tiering.discard(cold_key)
+    ratelimit.record_tokens(plan, tokens)
+    return result
+
+def _live_message(db: Session, chat_id: UUID, message_id: int) -> Message:
+    m = db.execute(
+        select(Message).where(Message.id == message_id, Message.chat_id == chat_id, Message.deleted_at.is_(None))
+    ).scalar_one_or_none()
+    if not m:
+        raise HTTPException(404, "Message not found")
+    return m
+
+@app.post("/api/chats/{chat_id}/messages/{message_id}/edit", response_model=list[MessageRead])
+def edit_message(
+    chat_id: UUID,
+    message_id: int,
+    payload: MessageCreate,
+    db: Session = Depends(get_db),
+    user: User = Depends(require_scope("chat:write")),
+    plan: ratelimit.PlanContext = Depends(ratelimit.message_limits),
+):
+    """Post an edited copy of a user message as its sibling and answer it; the old branch stays as it was."""
+    crud.set_actor(db, user.id)
+    c, role = crud.get_chat_with_role(db, chat_id, user.id)
+    _require_role(role, "editor", "Chat not found")
+    content = payload.content.strip()
+    if not content:
+        raise HTTPException(400, "Empty message")
 
-    return [
-        MessageRead(
-            id=m.id,
-            chat_id=m.chat_id,
-            sender_type=m.sender_type,
-            sender_user_id=m.sender_user_id,
-            content=m.content,
-            created_at=m.created_at,
+    cold_key = tiering.ensure_hot(db, chat_id)
+    # Legacy chats get their parent pointers first, so the edit becomes a sibling rather than a new root
+    crud.ensure_branching(db, c)
+    original = _live_message(db, chat_id, message_id)
+    if original.sender_type != "user":
+        raise HTTPException(400, "Only user messages can be edited")
+    # Same rule as deletion: editors may edit their own messages; anything else is for the owner
+    if original.sender_user_id != user.id:
+        _require_role(role, "owner", "Chat not found")
+
+    created = crud.add_message_with_assistant(db, c, user, content, edit_of=original)
+    result = _message_reads(created)
+    tokens = _enqueue_usage(db, plan, user, c, created[0].content, created[1])
+    db.commit()
+    tiering.discard(cold_key)
+    ratelimit.record_tokens(plan, tokens)
+    return result
+
+@app.post("/api/chats/{chat_id}/messages/{message_id}/regenerate", response_model=list[MessageRead])
+def regenerate_message(
+    chat_id: UUID,
+    message_id: int,
+    db: Session = Depends(get_db),
+    user: User = Depends(require_scope("chat:write")),
+    plan: ratelimit.PlanContext = Depends(ratelimit.message_limits),
+):
+    """
+    Answer a prompt again. message_id is either the assistant reply to replace or the user prompt itself;
+    the new reply is added as a sibling and becomes the active leaf.
+    """
+    crud.set_actor(db, user.id)
+    c, role = crud.get_chat_with_role(db, chat_id, user.id)
+    _require_role(role, "editor", "Chat not found")
+
+    cold_key = tiering.ensure_hot(db, chat_id)
+    m = _live_message(db, chat_id, message_id)
+    if m.sender_type != "user":
+        crud.ensure_branching(db, c)
+        db.refresh(m, ["parent_id"])
+        prompt = _live_message(db, chat_id, m.parent_id) if m.parent_id is not None else None
+        if prompt is None or prompt.sender_type != "user":
+            raise HTTPException(400, "Message does not answer a user prompt")
+    else:
+        prompt = m
+
+    bot_msg = crud.reply_to(db, c, prompt, fresh=True)
+    result = _message_reads([bot_msg])
+    tokens = _enqueue_usage(db, plan, user, c, prompt.content, bot_msg)
+    db.commit()
+    tiering.discard(cold_key)
+    ratelimit.record_tokens(plan, tokens)
+    return result
+
+@app.put("/api/chats/{chat_id}/active-leaf", response_model=ActiveLeafRead)
+def set_active_leaf(
+    chat_id: UUID,
+    payload: ActiveLeafUpdate,
+    db: Session = Depends(get_db),
+    user: User = Depends(require_scope("chat:write")),
+):
+    """Switch branches: the active leaf becomes the newest leaf under the given message."""
+    crud.set_actor(db, user.id)
+    c, role = crud.get_chat_with_role(db, chat_id, user.id)
+    _require_role(role, "editor", "Chat not found")
+    cold_key = tiering.ensure_hot(db, chat_id)
+    crud.ensure_branching(db, c)
+    _live_message(db, chat_id, payload.message_id)
+    c.active_leaf_id = crud.latest_leaf(db, payload.message_id)
+    db.commit()
+    tiering.discard(cold_key)
+    return ActiveLeafRead(active_leaf_id=c.active_leaf_id)
+
+@app.delete("/api/chats/{chat_id}/messages/{message_id}", status_code=204)
+def delete_message(chat_id: UUID, message_id: int, db: Session = Depends(get_db), user: User = Depends(require_scope("chat:write"))):
+    crud.set_actor(db, user.id)
+    role = crud.get_chat_role(db, chat_id, user.id)
+    _require_role(role, "editor", "Chat not found")
+    cold_key = tiering.ensure_hot(db, chat_id)
+    m = db.execute(
+        select(Message).where(Message.id == message_id, Message.chat_id == chat_id, Message.deleted_at.is_(None))
+    ).scalar_one_or_none()
+    if not m:
+        raise HTTPException(404, "Message not found")
+    # Editors may delete their own messages; anything else is for the owner
+    if m.sender_user_id != user.id:
+        _require_role(role, "owner", "Chat not found")
+    m.deleted_at = utcnow()
+    db.commit()
+    tiering.discard(cold_key)
+
+# ---------------- EXPORT ----------------
+
+@app.get("/api/export", tags=["export"])
+def export_history(
+    format: Literal["ndjson", "zip"] = "ndjson",
+    cursor: Optional[str] = None,
+    user: User = Depends(require_scope("chat:read")),
+):
+    """
+    Every chat the caller owns followed by its messages, streamed as NDJSON (optionally zipped).
+    Pass cursor=<chat_id>:<message_id> of the last line received to resume (0 for a chat line).
+    """
+    try:
+        export.parse_cursor(cursor)
+    except ValueError:
+        raise HTTPException(400, "Invalid cursor")
+
+    body = export.iter_ndjson(user.id, cursor)
+    if format == "zip":
+        return StreamingResponse(
+            export.iter_zip(body),
+            media_type="application/zip",
+            headers={"Content-Disposition": 'attachment; filename="clown-gpt-export.zip"'},
         )
-        for m in created
-    ]
+    return StreamingResponse(
+        body,
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="clown-gpt-export.ndjson"'},
+    )
+
+# ---------------- REALTIME ----------------
+
+@app.get("/api/events", tags=["realtime"])
+async def events(user_id: UUID = Depends(get_stream_user_id)):
+    """Server-sent events for the caller's chats, fanned out from Postgres NOTIFY."""
+    sub = realtime.hub.subscribe(user_id)
+
+    async def _gen():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    data = await asyncio.wait_for(sub.queue.get(), realtime.HEARTBEAT_SEC)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                yield f"data: {data}\n\n"
+        finally:
+            realtime.hub.unsubscribe(sub)
+
+    return StreamingResponse(
+        _gen(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -13,7 +13,7 @@ from sqlalchemy import (
     Text,
     JSON,
 )
-from sqlalchemy.dialects.postgresql import UUID, INET, CITEXT
+from sqlalchemy.dialects.postgresql import ARRAY, UUID, INET, CITEXT
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 
@@ -106,7 +106,7 @@ class ApiKey(Base):
     name: Mapped[str] = mapped_column(Text, nullable=False)
     key_prefix: Mapped[str] = mapped_column(Text, nullable=False)
     key_hash: Mapped[str] = mapped_column(Text, nullable=False, unique=True)
-    scopes: Mapped[list[str]] = mapped_column(JSON, nullable=False, default=list)
+    scopes: Mapped[list[str]] = mapped_column(ARRAY(Text), nullable=False, default=list)
     is_active: Mapped[bool] = mapped_column(Boolean, nullable=False, default=True)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
     last_used_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True))
@@ -152,6 +152,7 @@ class LLMModel(Base):
     price_input_1k: Mapped[float] = mapped_column(Numeric(10, 4), nullable=False, default=0)
     price_output_1k: Mapped[float] = mapped_column(Numeric(10, 4), nullable=False, default=0)
     capabilities: Mapped[dict] = mapped_column(JSON, nullable=False, default=dict)
+    routing: Mapped[dict] = mapped_column(JSON, nullable=False, default=dict)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
 
 
@@ -197,6 +198,7 @@ class Chat(Base):
     max_output_tokens: Mapped[int] = mapped_column(Integer, nullable=False, default=1024)
     system_prompt: Mapped[str] = mapped_column(Text, nullable=False, default="")
     chat_metadata: Mapped[dict] = mapped_column("metadata", JSON, nullable=False, default=dict)
+    active_leaf_id: Mapped[int | None] = mapped_column(BigInteger)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
     updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
     deleted_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True))
@@ -218,6 +220,7 @@ class Message(Base):
 
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
     chat_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("chats.id", ondelete="CASCADE", onupdate="CASCADE"), nullable=False)
+    parent_id: Mapped[int | None] = mapped_column(BigInteger)
     sender_user_id: Mapped[uuid.UUID | None] = mapped_column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="SET NULL", onupdate="CASCADE"))
     sender_type: Mapped[str] = mapped_column(message_sender_type, nullable=False)
     content: Mapped[str] = mapped_column(Text, nullable=False)
@@ -292,6 +295,7 @@ class ChatStats(Base):
     assistant_message_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
     system_message_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
     last_message_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True))
+    last_message_preview: Mapped[str | None] = mapped_column(Text)
     updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
 
 
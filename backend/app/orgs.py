@@ -0,0 +1,100 @@
+"""Organization context of a user (primary organization, its plan, roles everywhere), cached per worker."""
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from uuid import UUID
+
+from fastapi import Depends
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from . import crud
+from .db import get_db
+from .models import User
+from .security import get_current_user
+
+# Read paths may see a plan or role change this late on other workers; writes re-check roles in SQL.
+ORG_CONTEXT_TTL_SEC = float(os.getenv("ORG_CONTEXT_TTL_SEC", os.getenv("PLAN_CACHE_TTL_SEC", "60")))
+ORG_CONTEXT_CACHE_SIZE = int(os.getenv("ORG_CONTEXT_CACHE_SIZE", "10000"))
+
+
+@dataclass(frozen=True)
+class OrgContext:
+    user_id: UUID
+    org_id: UUID | None
+    plan: str
+    roles: dict[UUID, str] = field(default_factory=dict)
+
+    def role(self, org_id: UUID | None) -> str | None:
+        return self.roles.get(org_id)
+
+
+# Owned organizations first (oldest = primary), then active memberships; each branch is an index lookup.
+_CONTEXT_SQL = text(
+    """
+    SELECT o.id, o.plan, true AS owned, 'owner' AS role, o.created_at
+    FROM organizations o
+    WHERE o.owner_user_id = :u
+    UNION ALL
+    SELECT o.id, o.plan, false, om.member_role::text, o.created_at
+    FROM organization_members om
+    JOIN organizations o ON o.id = om.organization_id
+    WHERE om.user_id = :u AND om.is_active AND o.owner_user_id <> :u
+    ORDER BY owned DESC, created_at
+    """
+)
+
+# LRU of user id -> (expires_at, context)
+_cache: OrderedDict[UUID, tuple[float, OrgContext]] = OrderedDict()
+_lock = threading.Lock()
+
+
+def load(db: Session, user_id: UUID) -> OrgContext:
+    rows = db.execute(_CONTEXT_SQL, {"u": user_id}).all()
+    primary = rows[0] if rows and rows[0].owned else None
+    roles: dict[UUID, str] = {}
+    for r in rows:
+        roles.setdefault(r.id, r.role)
+    return OrgContext(
+        user_id=user_id,
+        org_id=primary.id if primary else None,
+        plan=primary.plan if primary else "free",
+        roles=roles,
+    )
+
+
+def resolve(db: Session, user_id: UUID) -> OrgContext:
+    now = time.monotonic()
+    with _lock:
+        hit = _cache.get(user_id)
+        if hit and hit[0] > now:
+            _cache.move_to_end(user_id)
+            return hit[1]
+    ctx = load(db, user_id)
+    with _lock:
+        _cache[user_id] = (now + ORG_CONTEXT_TTL_SEC, ctx)
+        _cache.move_to_end(user_id)
+        while len(_cache) > ORG_CONTEXT_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return ctx
+
+
+def invalidate(user_id: UUID) -> None:
+    with _lock:
+        _cache.pop(user_id, None)
+
+
+def ensure_primary(db: Session, user: User, ctx: OrgContext) -> OrgContext:
+    """Context with a primary organization, creating the personal one (and committing) if the user owns none."""
+    if ctx.org_id is not None:
+        return ctx
+    crud.ensure_personal_org(db, user)
+    db.commit()
+    invalidate(user.id)
+    return resolve(db, user.id)
+
+
+def org_context(db: Session = Depends(get_db), user: User = Depends(get_current_user)) -> OrgContext:
+    return resolve(db, user.id)
@@ -0,0 +1,304 @@
+"""
+Routing of chat completions across OpenAI-compatible backends.
+
+Each row of `models` may carry a `routing` object:
+
+    {"strategy": "fastest", "hedge": true,
+     "backends": [{"name": "openai", "model": "gpt-4o-mini", "api_key_env": "OPENAI_API_KEY"},
+                  {"name": "local", "base_url": "http://localhost:8080/v1", "model": "llama-3-8b", "timeout": 60}]}
+
+Backends are tried in turn until one answers. With strategy "fastest" healthy backends are ranked by
+EWMA latency penalised by their EWMA error rate (plus a little exploration); with "ordered" they keep
+the configured order. A backend that failed LLM_FAIL_THRESHOLD times in a row sits out
+LLM_COOLDOWN_SEC and is only tried last.
+With hedge on, a second backend is asked once the first has been slower than its own p95 and the
+first answer wins. Models without backends use OPENAI_API_KEY and MODEL_ALIASES, as before.
+"""
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+
+from sqlalchemy import text
+
+from .db import SessionLocal
+
+ROUTES_TTL_SEC = float(os.getenv("LLM_ROUTES_TTL_SEC", "30"))
+EWMA_ALPHA = float(os.getenv("LLM_EWMA_ALPHA", "0.2"))
+FAIL_THRESHOLD = int(os.getenv("LLM_FAIL_THRESHOLD", "3"))
+COOLDOWN_SEC = float(os.getenv("LLM_COOLDOWN_SEC", "30"))
+LATENCY_WINDOW = int(os.getenv("LLM_LATENCY_WINDOW", "200"))
+# Hedge delay while a backend has too few samples for a p95, and the lower bound afterwards.
+HEDGE_DEFAULT_SEC = float(os.getenv("LLM_HEDGE_DEFAULT_SEC", "2"))
+HEDGE_MIN_SEC = float(os.getenv("LLM_HEDGE_MIN_SEC", "0.2"))
+HEDGE_POOL = int(os.getenv("LLM_HEDGE_POOL", "32"))
+DEFAULT_TIMEOUT_SEC = float(os.getenv("LLM_TIMEOUT_SEC", "30"))
+# Share of "fastest" calls that lead with a random healthy backend, so a slower-ranked one keeps being measured.
+EXPLORE_RATE = float(os.getenv("LLM_EXPLORE_RATE", "0.05"))
+
+# Map stored model names to OpenAI model IDs for models without configured backends.
+MODEL_ALIASES = {
+    "clown 1.2": "gpt-3.5-turbo",
+    "clown 1.3": "gpt-3.5-turbo",
+    "clown 1.4": "gpt-4o-mini",
+}
+
+logger = logging.getLogger("providers")
+
+
+class AllBackendsFailed(RuntimeError):
+    pass
+
+
+@dataclass(frozen=True)
+class Backend:
+    name: str
+    model: str
+    base_url: str | None = None
+    api_key_env: str | None = None
+    timeout: float = DEFAULT_TIMEOUT_SEC
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}|{self.base_url or ''}|{self.model}"
+
+
+@dataclass(frozen=True)
+class Route:
+    backends: tuple[Backend, ...]
+    strategy: str = "fastest"
+    hedge: bool = False
+
+
+@dataclass(frozen=True)
+class Completion:
+    text: str
+    backend: str
+    hedged: bool
+
+
+class BackendStats:
+    """EWMA latency and error rate, a window of recent latencies for p95, and a consecutive-failure breaker."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency: float | None = None
+        self.error_rate = 0.0
+        self.calls = self.failures = 0
+        self._streak = 0
+        self._down_until = 0.0
+        self._window: deque[float] = deque(maxlen=LATENCY_WINDOW)
+
+    def record(self, ok: bool, elapsed: float) -> None:
+        with self._lock:
+            self.calls += 1
+            self.error_rate += EWMA_ALPHA * ((0.0 if ok else 1.0) - self.error_rate)
+            if ok:
+                self._streak = 0
+                self._window.append(elapsed)
+                self.latency = elapsed if self.latency is None else self.latency + EWMA_ALPHA * (elapsed - self.latency)
+                return
+            self.failures += 1
+            self._streak += 1
+            if self._streak >= FAIL_THRESHOLD:
+                self._streak = 0
+                self._down_until = time.monotonic() + COOLDOWN_SEC
+
+    def healthy(self) -> bool:
+        return time.monotonic() >= self._down_until
+
+    def score(self) -> float:
+        # Unmeasured backends rank first so they get a sample.
+        return 0.0 if self.latency is None else self.latency * (1 + 4 * self.error_rate)
+
+    def p95(self) -> float | None:
+        with self._lock:
+            if len(self._window) < 20:
+                return None
+            ordered = sorted(self._window)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    def hedge_after(self) -> float:
+        p = self.p95()
+        return HEDGE_DEFAULT_SEC if p is None else max(HEDGE_MIN_SEC, p)
+
+    def snapshot(self) -> dict:
+        return {
+            "healthy": self.healthy(),
+            "calls": self.calls,
+            "failures": self.failures,
+            "ewma_latency": self.latency,
+            "ewma_error_rate": self.error_rate,
+            "p95": self.p95(),
+        }
+
+
+_stats: dict[str, BackendStats] = {}
+_clients: dict[tuple, object] = {}
+_registry_lock = threading.Lock()
+_pool = ThreadPoolExecutor(max_workers=HEDGE_POOL, thread_name_prefix="llm-hedge")
+
+
+def stats_for(b: Backend) -> BackendStats:
+    # Keyed by backend, not by model, so a backend shared by several models has one health record.
+    with _registry_lock:
+        s = _stats.get(b.key)
+        if s is None:
+            s = _stats[b.key] = BackendStats()
+        return s
+
+
+def _client(b: Backend):
+    from openai import OpenAI  # type: ignore
+
+    api_key = (os.getenv(b.api_key_env) if b.api_key_env else None) or "none"
+    ck = (b.base_url, api_key)
+    with _registry_lock:
+        c = _clients.get(ck)
+        if c is None:
+            # Retries are ours to make, across backends.
+            c = _clients[ck] = OpenAI(base_url=b.base_url, api_key=api_key, max_retries=0)
+        return c
+
+
+def call_backend(b: Backend, messages: list[dict], temperature: float, max_tokens: int) -> str:
+    s = stats_for(b)
+    t0 = time.perf_counter()
+    try:
+        resp = _client(b).chat.completions.create(
+            model=b.model, messages=messages, temperature=temperature, max_tokens=max_tokens, timeout=b.timeout
+        )
+        reply = (resp.choices[0].message.content or "").strip()
+        if not reply:
+            raise ValueError("empty completion")
+    except Exception:
+        s.record(False, time.perf_counter() - t0)
+        raise
+    s.record(True, time.perf_counter() - t0)
+    return reply
+
+
+def rank(route: Route) -> list[Backend]:
+    healthy = [b for b in route.backends if stats_for(b).healthy()]
+    if route.strategy == "fastest":
+        healthy.sort(key=lambda b: stats_for(b).score())
+        if len(healthy) > 1 and random.random() < EXPLORE_RATE:
+            healthy.insert(0, healthy.pop(random.randrange(1, len(healthy))))
+    return healthy + [b for b in route.backends if b not in healthy]
+
+
+def complete(route: Route, messages: list[dict], temperature: float, max_tokens: int) -> Completion:
+    """First successful completion along the ranked backends; raises AllBackendsFailed with every error."""
+    pending = rank(route)
+    errors: list[str] = []
+    while pending:
+        first = pending.pop(0)
+        if not (route.hedge and pending):
+            try:
+                return Completion(call_backend(first, messages, temperature, max_tokens), first.name, False)
+            except Exception as e:
+                errors.append(f"{first.name}: {e!r}")
+                continue
+
+        running = {_pool.submit(call_backend, first, messages, temperature, max_tokens): first}
+        done, _ = wait(running, timeout=stats_for(first).hedge_after())
+        if not done:
+            second = pending.pop(0)
+            running[_pool.submit(call_backend, second, messages, temperature, max_tokens)] = second
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                b = running.pop(fut)
+                try:
+                    # The loser keeps running in the pool; its outcome still feeds the stats.
+                    return Completion(fut.result(), b.name, b is not first)
+                except Exception as e:
+                    errors.append(f"{b.name}: {e!r}")
+    raise AllBackendsFailed("; ".join(errors) or "no backends")
+
+
+# ---------------- routes from the models table ----------------
+
+def parse_route(model_name: str, routing: dict | None) -> Route | None:
+    """Route for a model row; without configured backends, OpenAI via OPENAI_API_KEY if it is set."""
+    routing = routing or {}
+    backends = tuple(
+        Backend(
+            name=b.get("name") or b["model"],
+            model=b["model"],
+            base_url=b.get("base_url"),
+            api_key_env=b.get("api_key_env"),
+            timeout=float(b.get("timeout", DEFAULT_TIMEOUT_SEC)),
+        )
+        for b in routing.get("backends") or ()
+    )
+    if not backends:
+        if not os.getenv("OPENAI_API_KEY"):
+            return None
+        backends = (
+            Backend(
+                name="openai",
+                model=MODEL_ALIASES.get(model_name, os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")),
+                base_url=os.getenv("OPENAI_BASE_URL") or None,
+                api_key_env="OPENAI_API_KEY",
+            ),
+        )
+    return Route(backends, routing.get("strategy", "fastest"), bool(routing.get("hedge", False)))
+
+
+class RouteTable:
+    """Routes of every model, re-read from `models` at most every ROUTES_TTL_SEC."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._routes: dict[str, Route | None] = {}
+        self._loaded_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def reload(self) -> None:
+        db = SessionLocal()
+        try:
+            rows = db.execute(text("SELECT name, routing FROM models")).all()
+        finally:
+            db.close()
+        routes = {}
+        for r in rows:
+            try:
+                routes[r.name] = parse_route(r.name, r.routing)
+            except (KeyError, TypeError, ValueError) as e:
+                logger.error("model %r has invalid routing, using defaults: %r", r.name, e)
+                routes[r.name] = parse_route(r.name, None)
+        self._routes = routes
+        self._loaded_at = time.monotonic()
+
+    def get(self, model_name: str) -> Route | None:
+        if time.monotonic() - self._loaded_at > self.ttl:
+            with self._lock:
+                if time.monotonic() - self._loaded_at > self.ttl:
+                    try:
+                        self.reload()
+                    except Exception:
+                        # Keep serving the previous table; retry after another TTL.
+                        logger.exception("could not load model routes")
+                        self._loaded_at = time.monotonic()
+        if model_name in self._routes:
+            return self._routes[model_name]
+        return parse_route(model_name, None)
+
+
+routes = RouteTable(ROUTES_TTL_SEC)
+
+
+def shutdown() -> None:
+    """Drop queued hedge calls on server shutdown; calls already running finish in their threads."""
+    _pool.shutdown(wait=False, cancel_futures=True)
+
+
+def stats() -> dict:
+    with _registry_lock:
+        keys = list(_stats.items())
+    return {k: s.snapshot() for k, s in keys}
@@ -0,0 +1,223 @@
+import math
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from uuid import UUID
+
+from fastapi import Depends, HTTPException
+
+try:
+    import redis
+except ImportError:  # optional dependency, only for RATE_LIMIT_BACKEND=redis
+    redis = None
+
+from . import orgs
+from .timeutil import utcnow
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# The organisation bucket allows this many users' worth of requests.
+ORG_RATE_MULTIPLIER = int(os.getenv("ORG_RATE_MULTIPLIER", "5"))
+
+
+@dataclass(frozen=True)
+class PlanLimits:
+    messages_per_minute: int
+    burst: int
+    daily_tokens: int
+
+
+PLAN_LIMITS = {
+    "free": PlanLimits(messages_per_minute=10, burst=5, daily_tokens=50_000),
+    "pro": PlanLimits(messages_per_minute=60, burst=20, daily_tokens=1_000_000),
+    "enterprise": PlanLimits(messages_per_minute=300, burst=60, daily_tokens=20_000_000),
+}
+
+
+class MemoryStore:
+    """Per-process token buckets and usage counters. Exact within one worker only."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> [tokens, updated_at, full_at]; a bucket past full_at is the same as a missing one
+        self._buckets: dict[str, list[float]] = {}
+        self._usage: dict[str, list] = {}
+
+    def take_all(self, buckets: list[tuple[str, float, int]], cost: float = 1.0) -> tuple[int, float]:
+        """
+        Take `cost` tokens from every (key, rate, burst) bucket or from none. Returns (-1, 0) when allowed,
+        else the index of the first bucket that is short and the seconds until it refills enough.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if len(self._buckets) > 10_000:
+                self._buckets = {k: v for k, v in self._buckets.items() if v[2] > now}
+            left = []
+            for i, (key, rate, burst) in enumerate(buckets):
+                b = self._buckets.get(key)
+                tokens = float(burst) if b is None else min(float(burst), b[0] + (now - b[1]) * rate)
+                if tokens < cost:
+                    return i, (cost - tokens) / rate
+                left.append(tokens - cost)
+            for (key, rate, burst), tokens in zip(buckets, left):
+                self._buckets[key] = [tokens, now, now + (burst - tokens) / rate]
+            return -1, 0.0
+
+    def take(self, key: str, rate: float, burst: int, cost: float = 1.0) -> float:
+        """Take `cost` tokens; return 0 when allowed, else the seconds until enough tokens refill."""
+        return self.take_all([(key, rate, burst)], cost)[1]
+
+    def get_usage(self, key: str) -> int:
+        entry = self._usage.get(key)
+        if entry is None or entry[1] <= time.monotonic():
+            return 0
+        return entry[0]
+
+    def add_usage(self, key: str, amount: int, ttl: float) -> int:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._usage.get(key)
+            if entry is None or entry[1] <= now:
+                if len(self._usage) > 10_000:
+                    self._usage = {k: v for k, v in self._usage.items() if v[1] > now}
+                entry = self._usage[key] = [0, now + ttl]
+            entry[0] += amount
+            return entry[0]
+
+
+# KEYS=buckets; ARGV: cost, now (sec), then rate/sec and burst per key. All buckets are debited or none:
+# returns {0, "0"} when allowed, else {1-based index of the first short bucket, seconds to wait as string}.
+_REDIS_TAKE = """
+local cost, now = tonumber(ARGV[1]), tonumber(ARGV[2])
+local left = {}
+for i, key in ipairs(KEYS) do
+  local rate, burst = tonumber(ARGV[1 + 2 * i]), tonumber(ARGV[2 + 2 * i])
+  local b = redis.call('HMGET', key, 't', 'ts')
+  local tokens = tonumber(b[1]) or burst
+  local ts = tonumber(b[2]) or now
+  tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+  if tokens < cost then return {i, tostring((cost - tokens) / rate)} end
+  left[i] = tokens - cost
+end
+for i, key in ipairs(KEYS) do
+  local rate, burst = tonumber(ARGV[1 + 2 * i]), tonumber(ARGV[2 + 2 * i])
+  redis.call('HSET', key, 't', left[i], 'ts', now)
+  redis.call('EXPIRE', key, math.ceil(burst / rate) + 1)
+end
+return {0, "0"}
+"""
+
+
+class RedisStore:
+    """Shared buckets for multi-worker deployments. Needs the optional `redis` package."""
+
+    def __init__(self, url: str):
+        if redis is None:
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis needs the redis package (pip install redis)")
+        self._r = redis.Redis.from_url(url)
+        self._take = self._r.register_script(_REDIS_TAKE)
+
+    def take_all(self, buckets: list[tuple[str, float, int]], cost: float = 1.0) -> tuple[int, float]:
+        args = [cost, time.time()]
+        for _, rate, burst in buckets:
+            args += [rate, burst]
+        index, wait = self._take(keys=[key for key, _, _ in buckets], args=args)
+        return int(index) - 1, float(wait)
+
+    def take(self, key: str, rate: float, burst: int, cost: float = 1.0) -> float:
+        return self.take_all([(key, rate, burst)], cost)[1]
+
+    def get_usage(self, key: str) -> int:
+        return int(self._r.get(key) or 0)
+
+    def add_usage(self, key: str, amount: int, ttl: float) -> int:
+        pipe = self._r.pipeline()
+        pipe.incrby(key, amount)
+        pipe.expire(key, math.ceil(ttl), nx=True)
+        return int(pipe.execute()[0])
+
+
+def _make_store():
+    if RATE_LIMIT_BACKEND == "redis":
+        return RedisStore(REDIS_URL)
+    return MemoryStore()
+
+
+store = _make_store()
+
+
+@dataclass(frozen=True)
+class PlanContext:
+    user_id: UUID
+    org_id: UUID | None
+    plan: str
+
+    @property
+    def limits(self) -> PlanLimits:
+        return PLAN_LIMITS.get(self.plan, PLAN_LIMITS["free"])
+
+
+def plan_context(ctx: orgs.OrgContext) -> PlanContext:
+    """Plan of the user's primary organisation; the org context is cached per worker (app.orgs)."""
+    return PlanContext(user_id=ctx.user_id, org_id=ctx.org_id, plan=ctx.plan)
+
+
+def _seconds_until_utc_midnight() -> int:
+    now = utcnow()
+    tomorrow = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return max(1, math.ceil((tomorrow - now).total_seconds()))
+
+
+def _token_key(ctx: PlanContext) -> str:
+    return f"rl:tokens:{ctx.org_id or ctx.user_id}:{utcnow().date().isoformat()}"
+
+
+def _too_many(detail: str, retry_after: float) -> HTTPException:
+    return HTTPException(429, detail, headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+
+def check_message_limits(ctx: PlanContext) -> None:
+    limits = ctx.limits
+    rate = limits.messages_per_minute / 60.0
+
+    # Every check runs before any bucket is debited, so a rejected request costs no per-minute tokens
+    if store.get_usage(_token_key(ctx)) >= limits.daily_tokens:
+        raise _too_many("Daily token quota exhausted", _seconds_until_utc_midnight())
+
+    buckets = [(f"rl:user:{ctx.user_id}", rate, limits.burst)]
+    if ctx.org_id:
+        buckets.append((f"rl:org:{ctx.org_id}", rate * ORG_RATE_MULTIPLIER, limits.burst * ORG_RATE_MULTIPLIER))
+    short, wait = store.take_all(buckets)
+    if short == 0:
+        raise _too_many("Rate limit exceeded", wait)
+    if short == 1:
+        raise _too_many("Organization rate limit exceeded", wait)
+
+
+def record_tokens(ctx: PlanContext, tokens: int) -> None:
+    if RATE_LIMIT_ENABLED and tokens > 0:
+        store.add_usage(_token_key(ctx), tokens, ttl=_seconds_until_utc_midnight() + 60)
+
+
+def estimate_tokens(*texts: str) -> int:
+    # The LLM layer does not return usage, so approximate with ~4 characters per token.
+    return sum(len(t) for t in texts) // 4 + 1
+
+
+def message_plan(org: orgs.OrgContext = Depends(orgs.org_context)) -> PlanContext:
+    """Dependency for endpoints that enforce the limits themselves, after an early exit (see enforce())."""
+    return plan_context(org)
+
+
+def enforce(ctx: PlanContext) -> None:
+    if RATE_LIMIT_ENABLED:
+        check_message_limits(ctx)
+
+
+def message_limits(ctx: PlanContext = Depends(message_plan)) -> PlanContext:
+    """Dependency for LLM-backed endpoints: enforce plan limits before any chat work or LLM call."""
+    enforce(ctx)
+    return ctx
@@ -0,0 +1,138 @@
+import asyncio
+import json
+import logging
+import os
+from collections import defaultdict
+from uuid import UUID
+
+import psycopg
+from sqlalchemy import bindparam
+
+from . import analytics, crud
+from .db import DB_SCHEMA, engine
+
+CHANNEL = "clown_gpt_events"
+REALTIME_ENABLED = os.getenv("REALTIME_ENABLED", "1") == "1"
+QUEUE_SIZE = int(os.getenv("REALTIME_QUEUE_SIZE", "64"))
+HEARTBEAT_SEC = float(os.getenv("REALTIME_HEARTBEAT_SEC", "20"))
+RECONNECT_MAX_SEC = 30.0
+
+logger = logging.getLogger("realtime")
+
+# Recipients of a chat's events go through the grant rule list_chats uses, so push and list access agree
+_AUDIENCE_SQL = str(crud.chat_audience(bindparam("chat_id")).compile(dialect=engine.dialect))
+
+# Sent instead of the backlog when a consumer falls behind: the client refetches what it shows.
+RESYNC = '{"type":"resync"}'
+
+
+class Subscription:
+    __slots__ = ("user_id", "queue", "dropped")
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.queue: asyncio.Queue[str] = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.dropped = 0
+
+    def offer(self, data: str) -> None:
+        try:
+            self.queue.put_nowait(data)
+        except asyncio.QueueFull:
+            # Bounded per-connection memory: a slow socket loses its backlog, never the worker.
+            self.dropped += 1
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+
+class EventHub:
+    """
+    Per-worker fan-out of Postgres NOTIFY events to the SSE connections of this process.
+    One LISTEN connection per worker, plus one connection to resolve chat members.
+    "usage" events go to the analytics cache instead of to clients.
+    """
+
+    def __init__(self):
+        self._subs: dict[str, set[Subscription]] = defaultdict(set)
+        self._task: asyncio.Task | None = None
+
+    @property
+    def connection_count(self) -> int:
+        return sum(len(s) for s in self._subs.values())
+
+    def subscribe(self, user_id: UUID | str) -> Subscription:
+        sub = Subscription(str(user_id))
+        self._subs[sub.user_id].add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        subs = self._subs.get(sub.user_id)
+        if subs is None:
+            return
+        subs.discard(sub)
+        if not subs:
+            del self._subs[sub.user_id]
+
+    def publish(self, user_ids, data: str) -> None:
+        for uid in user_ids:
+            for sub in self._subs.get(str(uid), ()):
+                sub.offer(data)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        delay = 1.0
+        while True:
+            try:
+                await self._listen()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("LISTEN connection lost, retrying in %.0fs", delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_SEC)
+
+    async def _listen(self) -> None:
+        dsn = engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+        options = f"-csearch_path={DB_SCHEMA},public"
+        async with await psycopg.AsyncConnection.connect(dsn, autocommit=True, options=options) as listen_conn, \
+                await psycopg.AsyncConnection.connect(dsn, autocommit=True, options=options) as query_conn:
+            await listen_conn.execute(f"LISTEN {CHANNEL}")
+            # Analytics results are cached only while usage events can reach this worker
+            analytics.cache.set_live(True)
+            try:
+                async for note in listen_conn.notifies():
+                    if not self._subs and '"usage"' not in note.payload:
+                        continue
+                    try:
+                        event = json.loads(note.payload)
+                    except ValueError:
+                        continue
+                    if event.get("type") == "usage":
+                        # Not for clients: new usage invalidates this worker's analytics cache.
+                        analytics.on_usage_event(event)
+                        continue
+                    await self._dispatch(query_conn, event, note.payload)
+            finally:
+                analytics.cache.set_live(False)
+
+    async def _dispatch(self, conn, event: dict, data: str) -> None:
+        chat_id = event.get("chat_id")
+        if not chat_id:
+            return
+        cur = await conn.execute(_AUDIENCE_SQL, {"chat_id": chat_id})
+        self.publish((r[0] for r in await cur.fetchall()), data)
+
+
+hub = EventHub()
@@ -32,6 +32,7 @@ class ProjectCreate(BaseModel):
     name: str
     description: str = ""
     visibility: str = "private"
+    organization_id: Optional[UUID] = None  # default: the caller's primary organization
 
 class ProjectRead(BaseModel):
     id: UUID
@@ -42,6 +43,11 @@ class ProjectRead(BaseModel):
     organization_id: Optional[UUID]
     created_at: datetime
     updated_at: datetime
+    role: Optional[str] = None
+    chat_count: int = 0
+    message_count: int = 0
+    active_member_count: int = 0
+    last_activity_at: Optional[datetime] = None
 
 class ChatCreate(BaseModel):
     title: str
@@ -58,16 +64,33 @@ class ChatRead(BaseModel):
     project_id: Optional[UUID]
     created_at: datetime
     updated_at: datetime
+    message_count: int = 0
+    last_message_at: Optional[datetime] = None
+    last_message_preview: Optional[str] = None
+    active_leaf_id: Optional[int] = None
+    role: Optional[str] = None
 
 class ChatUpdate(BaseModel):
     title: Optional[str] = None
     pinned: Optional[bool] = None
-    status: Optional[str] = None
+    # Deletion goes through DELETE /api/chats/{id} so deleted_at is always set with it
+    status: Optional[Literal["active", "archived"]] = None
     model_name: Optional[str] = None
 
+class ArchivedChatRead(BaseModel):
+    id: UUID
+    title: str
+    status: str
+    project_id: Optional[UUID]
+    updated_at: datetime
+    deleted_at: Optional[datetime]
+    # Set once the compaction job has moved the chat to the cold archive
+    archived_at: Optional[datetime] = None
+
 class MessageRead(BaseModel):
     id: int
     chat_id: UUID
+    parent_id: Optional[int] = None
     sender_type: str
     sender_user_id: Optional[UUID]
     content: str
@@ -76,11 +99,82 @@ class MessageRead(BaseModel):
 class MessageCreate(BaseModel):
     content: str
 
+class ActiveLeafUpdate(BaseModel):
+    message_id: int
+
+class ActiveLeafRead(BaseModel):
+    active_leaf_id: int
+
+class TagCreate(BaseModel):
+    name: str
+    color: str = "gray"
+    organization_id: Optional[UUID] = None
+
+class TagUpdate(BaseModel):
+    name: Optional[str] = None
+    color: Optional[str] = None
+
+class TagRead(BaseModel):
+    id: int
+    organization_id: Optional[UUID]
+    name: str
+    color: str
+    created_at: datetime
+
+class ChatIdsIn(BaseModel):
+    chat_ids: List[UUID]
+
+class BulkResult(BaseModel):
+    affected: int
+
+class MemberRead(BaseModel):
+    user_id: UUID
+    username: str
+    role: str
+    joined_at: datetime
+
+class MemberUpsert(BaseModel):
+    username: str
+    role: Literal["editor", "viewer"] = "viewer"
+
+class ApiKeyCreate(BaseModel):
+    name: str
+    scopes: List[str] = ["chat:read", "chat:write"]
+
+class ApiKeyRead(BaseModel):
+    id: UUID
+    name: str
+    key_prefix: str
+    scopes: List[str]
+    is_active: bool
+    created_at: datetime
+    last_used_at: Optional[datetime]
+
+class ApiKeyCreated(ApiKeyRead):
+    api_key: str
+
 class UserListItem(BaseModel):
     id: UUID
     username: str
     role: str
 
+class AdminUserItem(BaseModel):
+    id: UUID
+    username: str
+    email: str
+    role: str
+    is_active: bool
+    created_at: datetime
+    last_login_at: Optional[datetime] = None
+    chat_count: int = 0
+    message_count: int = 0
+    last_message_at: Optional[datetime] = None
+    project_count: int = 0
+
+class AdminUserPage(BaseModel):
+    items: list[AdminUserItem]
+    next_cursor: Optional[str] = None
+
 class PlanResponse(BaseModel):
     plan: str
 
@@ -145,3 +239,37 @@ class DailyModelUsage(BaseModel):
     tokens_in: int
     tokens_out: int
     cost: float
+
+# Organization analytics
+class UsagePoint(BaseModel):
+    bucket: datetime
+    key: Optional[str] = None  # model / user / project id; null for totals or unattributed usage
+    label: Optional[str] = None
+    calls: int
+    tokens_in: int
+    tokens_out: int
+    cost: float
+
+class OrgUsageSeries(BaseModel):
+    organization_id: UUID
+    granularity: str
+    group_by: Optional[str] = None
+    start: datetime
+    end: datetime
+    points: list[UsagePoint]
+
+class OrgModelUsage(BaseModel):
+    model_id: Optional[int]
+    model_name: Optional[str]
+    total_tokens_in: int
+    total_tokens_out: int
+    calls: int
+    total_cost: float
+
+class OrgProjectReport(BaseModel):
+    project_id: UUID
+    project_name: str
+    chat_count: int
+    message_count: int
+    active_member_count: int
+    last_activity: Optional[datetime]
@@ -6,9 +6,10 @@ from fastapi import Depends, HTTPException, status, Request, Body, Query
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
-from sqlalchemy import select
+from sqlalchemy import bindparam, select
 
-from .db import get_db
+from .db import SessionLocal, get_db
+from . import apikeys, sessions
 from .models import User
 from .timeutil import utcnow
 
@@ -32,12 +33,41 @@ def verify_password(password: str, password_hash: str) -> bool:
     except Exception:
         return False
 
-def create_access_token(sub: str) -> str:
-    exp = utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MIN)
+def create_access_token(sub: str, sid: str | None = None, expires_at=None) -> str:
+    exp = expires_at or utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MIN)
     payload = {"sub": sub, "exp": exp}
+    if sid:
+        payload["sid"] = sid
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALG)
 
+def issue_token(db: Session, user: User, request: Request) -> str:
+    """Access token for a fresh login; backed by an auth_sessions row when AUTH_SESSIONS is on."""
+    if not sessions.AUTH_SESSIONS:
+        return create_access_token(str(user.id))
+    expires_at = utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MIN)
+    s = sessions.create_session(
+        db,
+        user.id,
+        expires_at,
+        user_agent=request.headers.get("user-agent", ""),
+        client_ip=request.client.host if request.client else None,
+    )
+    return create_access_token(str(user.id), sid=str(s.id), expires_at=expires_at)
+
+def decode_access_token(token: str) -> dict:
+    try:
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if not payload.get("sub"):
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return payload
+
+# Built once; see the note on prepared statements in crud.py
+_USER_BY_ID = select(User).where(User.id == bindparam("id"))
+
 def get_current_user(
+    request: Request,
     creds: HTTPAuthorizationCredentials = Depends(bearer),
     db: Session = Depends(get_db),
 ) -> User:
@@ -45,20 +75,77 @@ def get_current_user(
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
 
     token = creds.credentials
-    try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
-        sub = payload.get("sub")
-        if not sub:
-            raise HTTPException(status_code=401, detail="Invalid token")
-    except JWTError:
-        raise HTTPException(status_code=401, detail="Invalid token")
+    # None means an interactive (JWT) principal with every scope
+    request.state.api_key = None
+    request.state.session_id = None
+    if apikeys.is_api_key(token):
+        key = apikeys.verify(db, token, request.client.host if request.client else None)
+        if not key:
+            raise HTTPException(status_code=401, detail="Invalid API key")
+        request.state.api_key = key
+        sub = key.user_id
+    else:
+        claims = decode_access_token(token)
+        sub = claims["sub"]
+        sid = claims.get("sid")
+        if sid and sessions.AUTH_SESSIONS:
+            # Hot path: revocation and user come from memory, last_seen_at is written in batches.
+            if sessions.registry.is_revoked(sid):
+                raise HTTPException(status_code=401, detail="Session revoked")
+            request.state.session_id = sid
+            user = sessions.cached_user(db, sub)
+            if not user or not user.is_active:
+                raise HTTPException(status_code=401, detail="User not found or inactive")
+            sessions.touch(sid)
+            return user
 
-    user = db.execute(select(User).where(User.id == sub)).scalar_one_or_none()
+    user = db.execute(_USER_BY_ID, {"id": sub}).scalar_one_or_none()
     if not user or not user.is_active:
         raise HTTPException(status_code=401, detail="User not found or inactive")
     return user
 
-def require_admin(user: User = Depends(get_current_user)) -> User:
+def require_scope(scope: str):
+    """Dependency factory: API-key principals need `scope`; JWT sessions carry every scope."""
+
+    def _dep(request: Request, user: User = Depends(get_current_user)) -> User:
+        key = request.state.api_key
+        if key is not None and scope not in key.scopes:
+            raise HTTPException(status_code=403, detail=f"API key lacks scope {scope}")
+        return user
+
+    return _dep
+
+def require_interactive(request: Request, user: User = Depends(get_current_user)) -> User:
+    if request.state.api_key is not None:
+        raise HTTPException(status_code=403, detail="Not available with an API key")
+    return user
+
+def get_stream_user_id(
+    token: str | None = Query(None),
+    creds: HTTPAuthorizationCredentials = Depends(bearer),
+):
+    """
+    Authenticate a long-lived stream (SSE). EventSource cannot send headers, so the token may come
+    as ?token=. Uses its own short session so no pooled connection is held for the stream's lifetime.
+    """
+    raw = token or (creds.credentials if creds else None)
+    if not raw:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+
+    claims = decode_access_token(raw)
+    if claims.get("sid") and sessions.AUTH_SESSIONS and sessions.registry.is_revoked(claims["sid"]):
+        raise HTTPException(status_code=401, detail="Session revoked")
+    sub = claims["sub"]
+    db = SessionLocal()
+    try:
+        row = db.execute(select(User.id, User.is_active).where(User.id == sub)).one_or_none()
+    finally:
+        db.close()
+    if not row or not row.is_active:
+        raise HTTPException(status_code=401, detail="User not found or inactive")
+    return row.id
+
+def require_admin(user: User = Depends(require_scope("admin"))) -> User:
     if user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin only")
     return user
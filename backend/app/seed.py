@@ -1,6 +1,17 @@
+"""
+Demo data, loaded through the public API of a running server.
+
+Usage (from backend/):
+    python -m app.seed [--base-url http://localhost:8000] [--wait 60]
+
+Opt-in and run once: logs in as SEED_ADMIN_USER, registers SEED_USERS users and posts their projects,
+chats and messages in one /api/batch-import call. The server does not seed on startup.
+"""
+import argparse
 import os
 import random
-import threading
+import sys
+import time
 from datetime import datetime, timedelta
 
 import requests
@@ -200,6 +211,32 @@ def _seed():
         return
 
 
-def run_seed_if_enabled():
-    """Start seeding in background thread on startup."""
-    threading.Thread(target=_seed, daemon=True).start()
+def _wait_ready(timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if requests.get(f"{BASE_URL}/health", timeout=2).ok:
+                return True
+        except requests.RequestException:
+            pass
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(1)
+
+
+def main():
+    global BASE_URL
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--wait", type=float, default=60, help="seconds to wait for the server to come up")
+    args = parser.parse_args()
+    BASE_URL = args.base_url.rstrip("/")
+
+    if not _wait_ready(args.wait):
+        logger.error("server at %s is not answering", BASE_URL)
+        sys.exit(1)
+    _seed()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Production launcher: uvicorn with warmed-up workers and graceful shutdown.
+
+Usage (from backend/):
+    DATABASE_URL=postgresql+psycopg://... python -m app.serve [--workers N] [--host 0.0.0.0] [--port 8000] [--reload]
+"""
+import argparse
+import copy
+import logging
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from . import providers
+from .db import DB_POOL_SIZE, engine, read_engines
+
+# Set by the launcher and inherited by the workers; a bare `uvicorn app.main:app` counts from import.
+LAUNCHED_AT = float(os.getenv("SERVE_LAUNCHED_AT") or time.time())
+WARM_CONNECTIONS = int(os.getenv("SERVE_WARM_CONNECTIONS", str(DB_POOL_SIZE)))
+GRACEFUL_SEC = float(os.getenv("SERVE_GRACEFUL_SEC", "60"))
+
+logger = logging.getLogger("serve")
+
+cold_start: dict[str, float | None] = {"ready_sec": None, "first_request_sec": None}
+
+
+def cpu_count() -> int:
+    try:
+        n = len(os.sched_getaffinity(0))
+    except AttributeError:
+        n = os.cpu_count() or 1
+    try:
+        quota, period = Path("/sys/fs/cgroup/cpu.max").read_text().split()
+        if quota != "max":
+            n = min(n, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return n
+
+
+def _fill_pool(e, n: int) -> None:
+    # Check out n connections at once so the pool opens n, then hand them all back (they stay open).
+    conns = []
+    with ThreadPoolExecutor(max_workers=n) as ex:
+        for fut in [ex.submit(e.connect) for _ in range(n)]:
+            try:
+                conns.append(fut.result())
+            except Exception as exc:
+                logger.warning("could not pre-open a connection to %s: %s", e.url.host, exc)
+    for c in conns:
+        c.close()
+
+
+def warmup() -> None:
+    """Per-worker warmup, run before the worker accepts connections."""
+    t0 = time.perf_counter()
+    try:
+        providers.routes.reload()
+    except Exception:
+        logger.exception("could not preload model routes")
+    if WARM_CONNECTIONS > 0:
+        for e in (engine, *read_engines):
+            _fill_pool(e, WARM_CONNECTIONS)
+    cold_start["ready_sec"] = round(time.time() - LAUNCHED_AT, 3)
+    logger.info(
+        "worker %d ready %.2fs after launch (warmup %.2fs)", os.getpid(), cold_start["ready_sec"], time.perf_counter() - t0
+    )
+
+
+class ColdStartLogger:
+    """ASGI middleware: logs when the worker finished its first HTTP request, then only passes through."""
+
+    def __init__(self, app):
+        self.app = app
+        self.done = False
+
+    async def __call__(self, scope, receive, send):
+        if self.done or scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        await self.app(scope, receive, send)
+        if not self.done:
+            self.done = True
+            cold_start["first_request_sec"] = round(time.time() - LAUNCHED_AT, 3)
+            logger.info("worker %d served its first request %.2fs after launch", os.getpid(), cold_start["first_request_sec"])
+
+
+def _log_config() -> dict:
+    import uvicorn.config
+
+    cfg = copy.deepcopy(uvicorn.config.LOGGING_CONFIG)
+    cfg["formatters"]["app"] = {"format": "%(asctime)s [%(name)s] %(levelname)s %(message)s"}
+    cfg["handlers"]["app"] = {"formatter": "app", "class": "logging.StreamHandler", "stream": "ext://sys.stderr"}
+    # Application loggers (serve, db, providers, ...) propagate to the root logger.
+    cfg["root"] = {"handlers": ["app"], "level": os.getenv("LOG_LEVEL", "INFO").upper()}
+    return cfg
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY") or cpu_count()))
+    parser.add_argument("--reload", action="store_true", default=os.getenv("SERVE_RELOAD") == "1", help="development: one worker, restart on code changes")
+    args = parser.parse_args()
+
+    import uvicorn
+
+    os.environ["SERVE_LAUNCHED_AT"] = str(LAUNCHED_AT)
+    uvicorn.run(
+        "app.main:app",
+        host=args.host,
+        port=args.port,
+        workers=1 if args.reload else max(1, args.workers),
+        reload=args.reload,
+        timeout_graceful_shutdown=GRACEFUL_SEC,
+        log_config=_log_config(),
+    )
+
+
+if __name__ == "__main__":
+    main()
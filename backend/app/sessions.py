@@ -0,0 +1,222 @@
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from uuid import UUID
+
+from sqlalchemy import bindparam, select, text
+from sqlalchemy.orm import Session
+
+from .coalesce import WriteCoalescer
+from .db import SessionLocal
+from .models import AuthSession, User
+from .timeutil import utcnow
+
+# Opt-in: JWTs carry a session id (sid) backed by auth_sessions and can be revoked.
+AUTH_SESSIONS = os.getenv("AUTH_SESSIONS", "0") == "1"
+SYNC_SEC = float(os.getenv("SESSION_SYNC_SEC", "2"))
+SWEEP_SEC = float(os.getenv("SESSION_SWEEP_SEC", "300"))
+SWEEP_BATCH = int(os.getenv("SESSION_SWEEP_BATCH", "5000"))
+LAST_SEEN_FLUSH_SEC = float(os.getenv("SESSION_LAST_SEEN_FLUSH_SEC", "30"))
+USER_CACHE_TTL_SEC = float(os.getenv("SESSION_USER_CACHE_TTL_SEC", "30"))
+USER_CACHE_SIZE = int(os.getenv("SESSION_USER_CACHE_SIZE", "10000"))
+# Re-read revocations this far behind the last sync: a revoke committed late still carries an older revoked_at.
+SYNC_OVERLAP = timedelta(seconds=30)
+
+logger = logging.getLogger("sessions")
+
+
+class RevocationRegistry:
+    """
+    Revoked, not yet expired session ids, kept in memory and synced from auth_sessions.
+    The set is exact and bounded by token lifetime: entries are dropped once the token expires anyway.
+    """
+
+    def __init__(self):
+        self._revoked: dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._synced_at = None
+
+    def is_revoked(self, sid: str) -> bool:
+        return sid in self._revoked
+
+    def add(self, sid, expires_at) -> None:
+        with self._lock:
+            self._revoked[str(sid)] = expires_at.timestamp()
+
+    def sync(self, db: Session) -> int:
+        started = utcnow()
+        q = select(AuthSession.id, AuthSession.expires_at).where(
+            AuthSession.revoked_at.is_not(None), AuthSession.expires_at > started
+        )
+        if self._synced_at is not None:
+            q = q.where(AuthSession.revoked_at >= self._synced_at - SYNC_OVERLAP)
+        rows = db.execute(q).all()
+        now = time.time()
+        with self._lock:
+            for r in rows:
+                self._revoked[str(r.id)] = r.expires_at.timestamp()
+            for sid in [sid for sid, exp in self._revoked.items() if exp <= now]:
+                del self._revoked[sid]
+        self._synced_at = started
+        return len(rows)
+
+
+registry = RevocationRegistry()
+
+
+def _flush_last_seen(db: Session, items: dict) -> None:
+    db.execute(
+        text("UPDATE auth_sessions SET last_seen_at = :ts WHERE id = :id"),
+        [{"id": sid, "ts": ts} for sid, ts in items.items()],
+    )
+
+
+last_seen = WriteCoalescer("session-last-seen", _flush_last_seen, LAST_SEEN_FLUSH_SEC)
+
+
+def create_session(db: Session, user_id: UUID, expires_at, user_agent: str, client_ip: str | None) -> AuthSession:
+    now = utcnow()
+    s = AuthSession(
+        user_id=user_id,
+        # NOT NULL UNIQUE in the schema, but never read: JWTs name the session by id (sid)
+        session_token=secrets.token_urlsafe(32),
+        user_agent=user_agent[:512],
+        client_ip=client_ip,
+        created_at=now,
+        last_seen_at=now,
+        expires_at=expires_at,
+        revoked_at=None,
+        meta={},
+    )
+    db.add(s)
+    db.flush()
+    return s
+
+
+def revoke(db: Session, sid: str) -> None:
+    row = db.execute(
+        text(
+            """
+            UPDATE auth_sessions SET revoked_at = now()
+            WHERE id = :id AND revoked_at IS NULL
+            RETURNING expires_at
+            """
+        ),
+        {"id": sid},
+    ).one_or_none()
+    if row:
+        registry.add(sid, row.expires_at)
+
+
+def revoke_all(db: Session, user_id: UUID) -> int:
+    rows = db.execute(
+        text(
+            """
+            UPDATE auth_sessions SET revoked_at = now()
+            WHERE user_id = :u AND revoked_at IS NULL AND expires_at > now()
+            RETURNING id, expires_at
+            """
+        ),
+        {"u": str(user_id)},
+    ).all()
+    for r in rows:
+        registry.add(r.id, r.expires_at)
+    return len(rows)
+
+
+def sweep_expired(db: Session) -> int:
+    """Delete expired sessions in bounded batches so no single statement holds locks for long."""
+    total = 0
+    while True:
+        n = db.execute(
+            text(
+                """
+                DELETE FROM auth_sessions
+                WHERE id IN (SELECT id FROM auth_sessions WHERE expires_at < now() LIMIT :n)
+                """
+            ),
+            {"n": SWEEP_BATCH},
+        ).rowcount
+        db.commit()
+        total += n
+        if n < SWEEP_BATCH:
+            return total
+
+
+# LRU of user id -> (expires_at, snapshot)
+_user_cache: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+_user_cache_lock = threading.Lock()
+
+_USER_FIELDS = ("id", "username", "email", "role", "is_active")
+_USER_SNAPSHOT = select(*(getattr(User, f) for f in _USER_FIELDS)).where(User.id == bindparam("id"))
+
+
+def cached_user(db: Session, sub: str) -> User | None:
+    """
+    Snapshot of the session's user, refreshed every USER_CACHE_TTL_SEC. Returns a transient User
+    (not attached to `db`), which is all the request handlers read from the current user.
+    """
+    now = time.monotonic()
+    with _user_cache_lock:
+        hit = _user_cache.get(sub)
+        if hit and hit[0] > now:
+            _user_cache.move_to_end(sub)
+            return User(**hit[1])
+    row = db.execute(_USER_SNAPSHOT, {"id": sub}).one_or_none()
+    if not row:
+        return None
+    snap = dict(row._mapping)
+    with _user_cache_lock:
+        _user_cache[sub] = (now + USER_CACHE_TTL_SEC, snap)
+        _user_cache.move_to_end(sub)
+        while len(_user_cache) > USER_CACHE_SIZE:
+            _user_cache.popitem(last=False)
+    return User(**snap)
+
+
+def touch(sid: str) -> None:
+    last_seen.put(sid, utcnow())
+
+
+def _maintenance_loop(stop: threading.Event) -> None:
+    last_sweep = 0.0
+    while not stop.wait(SYNC_SEC):
+        db = SessionLocal()
+        try:
+            registry.sync(db)
+            db.rollback()
+            if time.monotonic() - last_sweep >= SWEEP_SEC:
+                last_sweep = time.monotonic()
+                removed = sweep_expired(db)
+                if removed:
+                    logger.info("swept %d expired sessions", removed)
+        except Exception:
+            db.rollback()
+            logger.exception("session maintenance failed")
+        finally:
+            db.close()
+
+
+_stop = threading.Event()
+
+
+def start() -> None:
+    if not AUTH_SESSIONS:
+        return
+    db = SessionLocal()
+    try:
+        registry.sync(db)
+    finally:
+        db.close()
+    threading.Thread(target=_maintenance_loop, args=(_stop,), name="session-maintenance", daemon=True).start()
+    last_seen.start()
+
+
+def stop() -> None:
+    _stop.set()
+    if AUTH_SESSIONS:
+        last_seen.stop()
@@ -0,0 +1,402 @@
+"""
+Cold storage for chats nobody has written to in a while.
+
+Usage (from backend/):
+    DATABASE_URL=postgresql+psycopg://... python -m app.tiering [--once] [--days 60] [--batch 100]
+
+A chat whose last message is older than TIER_INACTIVE_DAYS has all its messages written to one
+compressed NDJSON segment (zstd when the optional `zstandard` package is installed, gzip otherwise)
+under COLD_STORAGE_DIR, and the rows are deleted from `messages`. A chat_cold_segments row points
+at the file; chats, members and chat_stats stay in place, so listings are unaffected.
+
+Reads (list_messages) go through load_messages() / load_branch(), which decode the segment and keep
+the most recently used chats in an LRU, checked against the chat_cold_segments row on every read.
+Any write to a cold chat calls ensure_hot() first, which puts the messages back into Postgres, so a
+chat is always either entirely hot or entirely cold.
+"""
+import argparse
+import gzip
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+from typing import BinaryIO, Iterator
+
+import orjson
+from sqlalchemy import insert, select, text
+from sqlalchemy.orm import Session
+
+from .db import SessionLocal
+from .models import Message
+from .timeutil import utcnow
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+COLD_STORAGE_DIR = os.getenv("COLD_STORAGE_DIR", "./cold")
+INACTIVE_AFTER = timedelta(days=float(os.getenv("TIER_INACTIVE_DAYS", "60")))
+TIER_BATCH = int(os.getenv("TIER_BATCH", "100"))
+CACHE_CHATS = int(os.getenv("COLD_CACHE_CHATS", "64"))
+CODEC = "zstd" if zstandard is not None else "gzip"
+
+logger = logging.getLogger("tiering")
+
+_DATETIME_COLUMNS = ("created_at", "edited_at", "deleted_at")
+
+
+class LocalColdStore:
+    """Segments as files under a root directory; an object store client would implement the same calls."""
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+
+    def put(self, key: str, data: bytes) -> None:
+        path = self.root / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def get(self, key: str) -> bytes:
+        return (self.root / key).read_bytes()
+
+    def open(self, key: str) -> BinaryIO:
+        return open(self.root / key, "rb")
+
+    def delete(self, key: str) -> None:
+        try:
+            (self.root / key).unlink()
+        except FileNotFoundError:
+            pass
+
+
+store = LocalColdStore(COLD_STORAGE_DIR)
+
+
+def _default(obj):
+    if isinstance(obj, Decimal):
+        return str(obj)
+    raise TypeError
+
+
+def _compress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def _decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd segment found but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def encode_segment(rows) -> bytes:
+    return b"".join(orjson.dumps(dict(r), default=_default) + b"\n" for r in rows)
+
+
+def decode_segment(data: bytes, codec: str) -> list[dict]:
+    rows = []
+    for line in _decompress(data, codec).splitlines():
+        if line:
+            rows.append(orjson.loads(line))
+    return rows
+
+
+def _iter_lines(stream, chunk: int = 1 << 16) -> Iterator[bytes]:
+    tail = b""
+    while data := stream.read(chunk):
+        lines = (tail + data).split(b"\n")
+        tail = lines.pop()
+        yield from lines
+    if tail:
+        yield tail
+
+
+def iter_segment_file(f: BinaryIO, codec: str) -> Iterator[dict]:
+    """Rows of an open segment file, decompressed and decoded as they are read."""
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd segment found but the zstandard package is not installed")
+        stream = zstandard.ZstdDecompressor().stream_reader(f)
+    else:
+        stream = gzip.GzipFile(fileobj=f)
+    with stream:
+        for line in _iter_lines(stream):
+            if line:
+                yield orjson.loads(line)
+
+
+def _segment_key(chat_id) -> str:
+    # Unique per freeze: discard() after a rehydrate can then only remove the file it replaced, never one
+    # a later freeze of the same chat wrote.
+    s = str(chat_id)
+    return f"{s[:2]}/{s}.{uuid.uuid4().hex}.ndjson.{'zst' if CODEC == 'zstd' else 'gz'}"
+
+
+# ---------------- read-through ----------------
+
+_cache: OrderedDict = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _segment_row(db: Session, chat_id):
+    return db.execute(
+        text("SELECT storage_key, codec, exported_at FROM chat_cold_segments WHERE chat_id = :c"),
+        {"c": str(chat_id)},
+    ).one_or_none()
+
+
+def segment_for(db: Session, chat_id) -> tuple[str, str] | None:
+    row = _segment_row(db, chat_id)
+    return (row.storage_key, row.codec) if row else None
+
+
+def read_segment(db: Session, chat_id) -> list[dict] | None:
+    """Every archived message row of a cold chat (deleted ones included), or None if the chat is hot."""
+    seg = segment_for(db, chat_id)
+    if seg is None:
+        return None
+    return decode_segment(store.get(seg[0]), seg[1])
+
+
+def iter_segment(db: Session, chat_id) -> Iterator[dict]:
+    """Like read_segment(), but streamed: memory stays flat however large the chat is. Nothing if hot."""
+    seg = segment_for(db, chat_id)
+    if seg is None:
+        return
+    with store.open(seg[0]) as f:
+        yield from iter_segment_file(f, seg[1])
+
+
+def _load(db: Session, chat_id) -> tuple[list[dict], dict[int, int | None]] | None:
+    """Visible messages as MessageRead dicts and the parent of every message (deleted ones too)."""
+    # Another worker may have rehydrated or refrozen the chat, so a cached snapshot is only trusted
+    # while its segment row (a primary key lookup) is still the one it was decoded from.
+    seg = _segment_row(db, chat_id)
+    key = str(chat_id)
+    if seg is None:
+        _forget(chat_id)
+        return None
+    version = (seg.storage_key, seg.exported_at)
+    with _cache_lock:
+        hit = _cache.get(key)
+        if hit is not None and hit[0] == version:
+            _cache.move_to_end(key)
+            return hit[1]
+    rows = decode_segment(store.get(seg.storage_key), seg.codec)
+    visible = [
+        {
+            "id": r["id"],
+            "chat_id": r["chat_id"],
+            "parent_id": r.get("parent_id"),
+            "sender_type": r["sender_type"],
+            "sender_user_id": r["sender_user_id"],
+            "content": r["content"],
+            "created_at": r["created_at"],
+        }
+        for r in rows
+        if r["deleted_at"] is None
+    ]
+    loaded = (visible, {r["id"]: r.get("parent_id") for r in rows})
+    with _cache_lock:
+        _cache[key] = (version, loaded)
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_CHATS:
+            _cache.popitem(last=False)
+    return loaded
+
+
+def load_messages(db: Session, chat_id) -> list[dict] | None:
+    """Visible messages of a cold chat in id order, as MessageRead dicts; None if the chat is hot."""
+    loaded = _load(db, chat_id)
+    return None if loaded is None else loaded[0]
+
+
+def load_branch(db: Session, chat_id, leaf_id: int) -> list[dict] | None:
+    """Visible messages on the path from the root to leaf_id of a cold chat; None if the chat is hot."""
+    loaded = _load(db, chat_id)
+    if loaded is None:
+        return None
+    visible, parents = loaded
+    path = set()
+    node = leaf_id if leaf_id in parents else None
+    while node is not None:
+        path.add(node)
+        node = parents.get(node)
+    return [m for m in visible if m["id"] in path]
+
+
+def _forget(chat_id) -> None:
+    with _cache_lock:
+        _cache.pop(str(chat_id), None)
+
+
+# ---------------- rehydrate ----------------
+
+def rehydrate(db: Session, chat_id) -> str | None:
+    """
+    Put a cold chat's messages back into `messages` and drop its stub, inside the caller's transaction.
+    Returns the storage key to delete once the caller has committed (None if the chat was hot).
+    chat_stats already counts these messages, so the per-row aggregate triggers are bypassed.
+    """
+    seg = db.execute(
+        text("SELECT storage_key, codec FROM chat_cold_segments WHERE chat_id = :c FOR UPDATE"), {"c": str(chat_id)}
+    ).one_or_none()
+    if seg is None:
+        return None
+    rows = decode_segment(store.get(seg.storage_key), seg.codec)
+    for r in rows:
+        # Segments written before messages had parent_id
+        r.setdefault("parent_id", None)
+        for col in _DATETIME_COLUMNS:
+            if r[col] is not None:
+                r[col] = datetime.fromisoformat(r[col])
+    prev = db.execute(text("SELECT coalesce(current_setting('clown_gpt.bulk_move', true), '')")).scalar_one()
+    db.execute(text("SELECT set_config('clown_gpt.bulk_move', 'on', true)"))
+    if rows:
+        db.execute(insert(Message.__table__), rows)
+    db.execute(text("DELETE FROM chat_cold_segments WHERE chat_id = :c"), {"c": str(chat_id)})
+    db.execute(text("SELECT set_config('clown_gpt.bulk_move', :v, true)"), {"v": prev})
+    _forget(chat_id)
+    return seg.storage_key
+
+
+def ensure_hot(db: Session, chat_id) -> str | None:
+    """
+    Call before writing to a chat; returns a storage key to pass to discard() after commit.
+    The KEY SHARE lock is held to the end of the caller's transaction, so the exporter
+    (FOR UPDATE SKIP LOCKED) cannot freeze the chat under an in-flight write.
+    """
+    db.execute(text("SELECT 1 FROM chats WHERE id = :c FOR KEY SHARE"), {"c": str(chat_id)})
+    return rehydrate(db, chat_id)
+
+
+def discard(key: str | None) -> None:
+    """Remove a segment file whose rows are back in Postgres (only after that transaction committed)."""
+    if key:
+        store.delete(key)
+
+
+# ---------------- export ----------------
+
+_CANDIDATES_SQL = text(
+    """
+    SELECT cs.chat_id
+    FROM chat_stats cs
+    JOIN chats c ON c.id = cs.chat_id
+    WHERE cs.last_message_at < :cut
+      AND c.deleted_at IS NULL
+      AND NOT EXISTS (SELECT 1 FROM chat_cold_segments s WHERE s.chat_id = cs.chat_id)
+    ORDER BY cs.last_message_at
+    LIMIT :n
+    """
+)
+
+
+def freeze_chat(db: Session, chat_id) -> int:
+    """Export one chat to cold storage and delete its messages. Returns the number of messages moved."""
+    p = {"c": str(chat_id)}
+    locked = db.execute(text("SELECT 1 FROM chats WHERE id = :c FOR UPDATE SKIP LOCKED"), p).first()
+    if not locked:
+        db.rollback()
+        return 0
+    rows = db.execute(select(Message.__table__).where(Message.chat_id == chat_id).order_by(Message.id)).mappings().all()
+    if not rows:
+        db.rollback()
+        return 0
+
+    key = _segment_key(chat_id)
+    raw = encode_segment(rows)
+    data = _compress(raw, CODEC)
+    store.put(key, data)
+    visible = [r for r in rows if r["deleted_at"] is None]
+    try:
+        db.execute(
+            text(
+                """
+                INSERT INTO chat_cold_segments
+                  (chat_id, storage_key, codec, message_count, visible_count, first_message_id, last_message_id,
+                   last_message_at, raw_bytes, stored_bytes, exported_at)
+                VALUES (:c, :key, :codec, :n, :visible, :first, :last, :last_at, :raw, :stored, now())
+                """
+            ),
+            {
+                **p,
+                "key": key,
+                "codec": CODEC,
+                "n": len(rows),
+                "visible": len(visible),
+                "first": rows[0]["id"],
+                "last": rows[-1]["id"],
+                "last_at": max((r["created_at"] for r in visible), default=None),
+                "raw": len(raw),
+                "stored": len(data),
+            },
+        )
+        db.execute(text("SELECT set_config('clown_gpt.bulk_move', 'on', true)"))
+        db.execute(text("DELETE FROM messages WHERE chat_id = :c AND id <= :last"), {**p, "last": rows[-1]["id"]})
+        db.commit()
+    except Exception:
+        db.rollback()
+        store.delete(key)
+        raise
+    return len(rows)
+
+
+def run_once(db: Session, inactive_after: timedelta = INACTIVE_AFTER, batch: int = TIER_BATCH) -> dict:
+    moved = {"chats": 0, "messages": 0}
+    while True:
+        ids = db.execute(_CANDIDATES_SQL, {"cut": utcnow() - inactive_after, "n": batch}).scalars().all()
+        db.rollback()
+        if not ids:
+            return moved
+        progressed = False
+        for chat_id in ids:
+            n = freeze_chat(db, chat_id)
+            if n:
+                progressed = True
+                moved["chats"] += 1
+                moved["messages"] += n
+        if not progressed or len(ids) < batch:
+            return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--once", action="store_true", help="run a single pass and exit")
+    parser.add_argument("--days", type=float, default=INACTIVE_AFTER.total_seconds() / 86400)
+    parser.add_argument("--batch", type=int, default=TIER_BATCH)
+    parser.add_argument("--interval", type=float, default=float(os.getenv("TIER_INTERVAL_SEC", "3600")))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [tiering] %(levelname)s %(message)s")
+    logger.info("codec=%s dir=%s", CODEC, COLD_STORAGE_DIR)
+
+    while True:
+        db = SessionLocal()
+        try:
+            t0 = time.perf_counter()
+            moved = run_once(db, timedelta(days=args.days), args.batch)
+            if moved["chats"]:
+                logger.info("froze %d chats, %d messages in %.1fs", moved["chats"], moved["messages"], time.perf_counter() - t0)
+        finally:
+            db.close()
+        if args.once:
+            return
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
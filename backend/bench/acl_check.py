@@ -0,0 +1,62 @@
+"""
+Authorization overhead for a user who belongs to many chats.
+
+Usage (from backend/):
+    DATABASE_URL=postgresql+psycopg://... python -m bench.acl_check --user <uuid> [--rounds 2000]
+
+Measures the per-request chat access check (crud.get_chat_role) against random chats the user
+belongs to and the membership-joined list_chats query, and prints the EXPLAIN of the access check.
+"""
+import argparse
+import random
+import time
+from uuid import UUID
+
+from sqlalchemy import select
+
+from app import crud
+from app.db import SessionLocal
+from app.models import Chat, ChatMember
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user", type=UUID, required=True)
+    parser.add_argument("--rounds", type=int, default=2000)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        chat_ids = db.execute(select(ChatMember.chat_id).where(ChatMember.user_id == args.user)).scalars().all()
+        if not chat_ids:
+            raise SystemExit("user has no chat memberships")
+        print(f"user belongs to {len(chat_ids)} chats")
+
+        t0 = time.perf_counter()
+        for _ in range(args.rounds):
+            crud.get_chat_role(db, random.choice(chat_ids), args.user)
+        check_us = (time.perf_counter() - t0) / args.rounds * 1e6
+
+        list_rounds = max(1, args.rounds // 100)
+        t0 = time.perf_counter()
+        for _ in range(list_rounds):
+            db.execute(
+                crud.chat_read_select(args.user).where(ChatMember.user_id == args.user).order_by(Chat.updated_at.desc())
+            ).all()
+        list_ms = (time.perf_counter() - t0) / list_rounds * 1e3
+
+        stmt = crud.with_chat_access(select(crud.chat_role_expr()).select_from(Chat), args.user).where(
+            Chat.id == chat_ids[0]
+        )
+        compiled = stmt.compile(db.get_bind(), compile_kwargs={"literal_binds": True})
+        plan = db.exec_driver_sql(f"EXPLAIN (ANALYZE, BUFFERS) {compiled}").scalars().all()
+    finally:
+        db.close()
+
+    print(f"access check: {check_us:8.1f} us/request (round trip included)")
+    print(f"list_chats:   {list_ms:8.1f} ms/request")
+    print("\n".join(plan))
+
+
+if __name__ == "__main__":
+    main()
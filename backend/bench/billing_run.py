@@ -0,0 +1,98 @@
+"""
+Invoice generation throughput on synthetic usage.
+
+Usage (from backend/, against a scratch database; needs a superuser to skip the audit trigger while loading):
+    DATABASE_URL=postgresql+psycopg://... python -m bench.billing_run [--orgs 20000] [--events 100000000] [--month 2001-01]
+
+Creates bench organizations (slug bench-*), loads EVENTS usage_events spread over them in the given month
+plus the month before (so the range predicate has something to prune), then runs the billing job for the
+month and prints orgs/sec. --skip-load reuses data from a previous run; --cleanup drops it all.
+"""
+import argparse
+import time
+
+from sqlalchemy import text
+
+from app import billing
+from app.db import SessionLocal
+
+LOAD_CHUNK = 1_000_000
+
+
+def _load(db, orgs: int, events: int, month_start) -> None:
+    owner = db.execute(text("SELECT id FROM users ORDER BY created_at LIMIT 1")).scalar_one()
+    db.execute(
+        text(
+            """
+            INSERT INTO organizations (slug, name, owner_user_id, billing_email, plan)
+            SELECT 'bench-' || g, 'Bench org ' || g, :owner, 'bench' || g || '@example.com',
+                   (ARRAY['free','pro','enterprise'])[1 + g % 3]
+            FROM generate_series(1, :n) g
+            ON CONFLICT (slug) DO NOTHING
+            """
+        ),
+        {"owner": owner, "n": orgs},
+    )
+    db.commit()
+
+    db.execute(text("SET session_replication_role = replica"))
+    loaded = 0
+    t0 = time.perf_counter()
+    while loaded < events:
+        n = min(LOAD_CHUNK, events - loaded)
+        db.execute(
+            text(
+                """
+                WITH o AS (SELECT array_agg(id) AS ids FROM organizations WHERE slug LIKE 'bench-%')
+                INSERT INTO usage_events (organization_id, event_type, tokens_in, tokens_out, cost, happened_at)
+                SELECT o.ids[1 + (g % array_length(o.ids, 1))], 'chat_completion',
+                       (g % 800), (g % 400), (g % 400) * 0.00002,
+                       CAST(:start AS timestamptz) - interval '31 days' + (g % 5356800) * interval '1 second'
+                FROM o, generate_series(CAST(:from_g AS bigint), CAST(:to_g AS bigint)) g
+                """
+            ),
+            {"start": month_start, "from_g": loaded + 1, "to_g": loaded + n},
+        )
+        db.commit()
+        loaded += n
+        print(f"loaded {loaded}/{events} events ({loaded / (time.perf_counter() - t0):.0f} rows/s)")
+    db.execute(text("SET session_replication_role = origin"))
+    db.execute(text("ANALYZE usage_events"))
+    db.commit()
+
+
+def _cleanup(db) -> None:
+    db.execute(text("DELETE FROM organizations WHERE slug LIKE 'bench-%'"))
+    db.execute(text("DELETE FROM billing_runs WHERE period_from < '2002-01-01'"))
+    db.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orgs", type=int, default=20_000)
+    parser.add_argument("--events", type=int, default=100_000_000)
+    parser.add_argument("--month", default="2001-01")
+    parser.add_argument("--batch", type=int, default=billing.BATCH)
+    parser.add_argument("--skip-load", action="store_true")
+    parser.add_argument("--cleanup", action="store_true")
+    args = parser.parse_args()
+
+    period_from, period_to = billing.month_bounds(args.month)
+    db = SessionLocal()
+    try:
+        if args.cleanup:
+            _cleanup(db)
+            return
+        if not args.skip_load:
+            _load(db, args.orgs, args.events, period_from)
+        stats = billing.run_period(db, period_from, period_to, batch=args.batch, restart=True)
+    finally:
+        db.close()
+    print(
+        f"billing {args.month}: {stats['orgs']} orgs, {stats['invoices']} invoices, "
+        f"{stats['seconds']:.1f}s, {stats['orgs_per_sec']:.0f} orgs/s (batch={args.batch})"
+    )
+
+
+if __name__ == "__main__":
+    main()
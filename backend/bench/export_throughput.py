@@ -0,0 +1,104 @@
+"""
+Export throughput (MB/s) and memory for a user with a large history.
+
+Usage (from backend/):
+    DATABASE_URL=postgresql+psycopg://... python -m bench.export_throughput --user <uuid> [--load 3000000] [--zip]
+
+--load N first gives the user N synthetic messages spread over N/2000 chats (per-row triggers are
+bypassed with clown_gpt.bulk_move and the stats recounted afterwards). The export generator is then
+drained in-process, so the numbers exclude HTTP; peak traced allocation shows memory stays flat.
+"""
+import argparse
+import time
+import tracemalloc
+from uuid import UUID
+
+from sqlalchemy import text
+
+from app import export
+from app.db import SessionLocal
+
+MESSAGES_PER_CHAT = 2000
+
+
+def _load(user_id: UUID, messages: int) -> None:
+    chats = max(1, messages // MESSAGES_PER_CHAT)
+    db = SessionLocal()
+    try:
+        db.execute(text("SELECT set_config('clown_gpt.bulk_move', 'on', true)"))
+        chat_ids = db.execute(
+            text(
+                """
+                INSERT INTO chats (owner_user_id, title, model_id, created_at, updated_at)
+                SELECT :u, 'Export bench ' || g, (SELECT id FROM models ORDER BY id LIMIT 1), now(), now()
+                FROM generate_series(1, :n) g
+                RETURNING id
+                """
+            ),
+            {"u": str(user_id), "n": chats},
+        ).scalars().all()
+        db.execute(
+            text(
+                """
+                INSERT INTO chat_members (chat_id, user_id, member_role)
+                SELECT c, :u, 'owner' FROM unnest(CAST(:ids AS uuid[])) c
+                """
+            ),
+            {"u": str(user_id), "ids": [str(c) for c in chat_ids]},
+        )
+        db.commit()
+        for i, chat_id in enumerate(chat_ids, 1):
+            db.execute(text("SELECT set_config('clown_gpt.bulk_move', 'on', true)"))
+            db.execute(
+                text(
+                    """
+                    INSERT INTO messages (chat_id, sender_user_id, sender_type, content, created_at)
+                    SELECT :c, CASE WHEN g % 2 = 0 THEN CAST(:u AS uuid) END,
+                           CASE WHEN g % 2 = 0 THEN 'user' ELSE 'assistant' END::message_sender_type,
+                           repeat('lorem ipsum dolor sit amet ', 4 + g % 20),
+                           now() - (:n - g) * interval '1 minute'
+                    FROM generate_series(1, :n) g
+                    """
+                ),
+                {"c": str(chat_id), "u": str(user_id), "n": MESSAGES_PER_CHAT},
+            )
+            db.execute(text("SELECT chat_stats_recount(:c)"), {"c": str(chat_id)})
+            db.commit()
+            if i % 100 == 0:
+                print(f"loaded {i * MESSAGES_PER_CHAT} messages")
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user", type=UUID, required=True)
+    parser.add_argument("--load", type=int, default=0, help="insert this many synthetic messages first")
+    parser.add_argument("--zip", action="store_true")
+    parser.add_argument("--chunk", type=int, default=export.EXPORT_CHUNK_ROWS)
+    args = parser.parse_args()
+
+    if args.load:
+        _load(args.user, args.load)
+
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    body = export.iter_ndjson(args.user, chunk_rows=args.chunk)
+    total = lines = 0
+    for chunk in export.iter_zip(body) if args.zip else body:
+        total += len(chunk)
+        if not args.zip:
+            lines += chunk.count(b"\n")
+    elapsed = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    print(
+        f"{'zip' if args.zip else 'ndjson'}: {total / 1e6:.1f} MB in {elapsed:.1f}s = {total / 1e6 / elapsed:.1f} MB/s"
+        + (f", {lines / elapsed:.0f} lines/s" if lines else "")
+        + f", peak traced {peak / 2**20:.1f} MiB (chunk={args.chunk})"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+A fake OpenAI-compatible chat completions server for router and load tests.
+
+Usage (from backend/):
+    python -m bench.fake_llm [--port 9001] [--latency 0.2] [--tail 0.05] [--tail-latency 2] [--error-rate 0]
+
+Answers POST /v1/chat/completions after `--latency` seconds (±20%); a `--tail` fraction of requests
+takes `--tail-latency` instead and an `--error-rate` fraction fails with 500. The reply echoes the last
+user message, so answers are deterministic. Point a model at it with
+    {"backends": [{"name": "fake", "base_url": "http://localhost:9001/v1", "model": "fake"}]}
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeLLM:
+    def __init__(self, latency: float, tail: float = 0.0, tail_latency: float = 2.0, error_rate: float = 0.0):
+        self.latency = latency
+        self.tail = tail
+        self.tail_latency = tail_latency
+        self.error_rate = error_rate
+        self.requests = 0
+
+    def delay(self) -> float:
+        if random.random() < self.tail:
+            return self.tail_latency
+        return self.latency * random.uniform(0.8, 1.2)
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, body: dict) -> None:
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                req = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                fake.requests += 1
+                time.sleep(fake.delay())
+                if not self.path.endswith("/chat/completions"):
+                    return self._send(404, {"error": {"message": "not found"}})
+                if random.random() < fake.error_rate:
+                    return self._send(500, {"error": {"message": "injected failure", "type": "server_error"}})
+                last = next((m["content"] for m in reversed(req.get("messages", [])) if m["role"] == "user"), "")
+                self._send(
+                    200,
+                    {
+                        "id": f"fake-{fake.requests}",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": req.get("model", "fake"),
+                        "choices": [
+                            {"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": f"Fake: {last}"}}
+                        ],
+                        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+                    },
+                )
+
+        return Handler
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        server = ThreadingHTTPServer((host, port), self.handler())
+        server.daemon_threads = True
+        return server
+
+    def start(self, port: int) -> ThreadingHTTPServer:
+        """Serve from a daemon thread; call shutdown() on the result to stop."""
+        server = self.serve(port)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--tail", type=float, default=0.0, help="fraction of slow requests")
+    parser.add_argument("--tail-latency", type=float, default=2.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    fake = FakeLLM(args.latency, args.tail, args.tail_latency, args.error_rate)
+    print(f"fake LLM on http://{args.host}:{args.port}/v1")
+    fake.serve(args.port, args.host).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
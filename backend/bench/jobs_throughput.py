@@ -0,0 +1,74 @@
+"""
+Job queue throughput (jobs/s) with several worker processes.
+
+Usage (from backend/):
+    DATABASE_URL=postgresql+psycopg://... python -m bench.jobs_throughput [--jobs 100000] [--workers 4] [--threads 4] [--batch 50]
+
+Queues --jobs no-op jobs in one statement, then starts --workers `python -m app.jobs worker --drain`
+processes and times how long they take to empty the queue. No-op jobs measure the queue itself
+(claim, delete, commit); real handlers add their own cost on top.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+from sqlalchemy import text
+
+from app.db import SessionLocal
+
+
+def _fill(n: int) -> None:
+    db = SessionLocal()
+    try:
+        db.execute(
+            text(
+                """
+                INSERT INTO jobs (kind, payload, priority)
+                SELECT 'noop', jsonb_build_object('i', g), g % 3 * 100 FROM generate_series(1, :n) g
+                """
+            ),
+            {"n": n},
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def _left() -> int:
+    db = SessionLocal()
+    try:
+        return db.execute(text("SELECT count(*) FROM jobs WHERE kind = 'noop'")).scalar_one()
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=100_000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--batch", type=int, default=50)
+    args = parser.parse_args()
+
+    _fill(args.jobs)
+    cmd = [
+        sys.executable, "-m", "app.jobs", "worker", "--drain", "--kinds", "noop",
+        "--threads", str(args.threads), "--batch", str(args.batch),
+    ]
+    t0 = time.perf_counter()
+    procs = [subprocess.Popen(cmd, env=os.environ) for _ in range(args.workers)]
+    for p in procs:
+        p.wait()
+    elapsed = time.perf_counter() - t0
+    done = args.jobs - _left()
+
+    print(
+        f"{done} jobs in {elapsed:.1f}s = {done / elapsed:.0f} jobs/s "
+        f"({args.workers} workers x {args.threads} threads, batch={args.batch})"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Compare full ORM entity loading with the lean column projections used by the list endpoints.
+
+Usage (from backend/):
+    DATABASE_URL=postgresql+psycopg://... python -m bench.list_projections --user <uuid> [--chat <uuid>] [--rounds 50]
+
+For every list shape it reports rows/sec and the peak Python allocation per round (tracemalloc).
+"""
+import argparse
+import time
+import tracemalloc
+from uuid import UUID
+
+from sqlalchemy import select
+
+from app.db import SessionLocal
+from app.models import Chat, LLMModel, Message, Project
+from app.schemas import ChatRead, MessageRead, ProjectRead
+from app import crud
+
+
+def _orm_projects(db, user_id, chat_id):
+    rows = db.execute(select(Project).where(Project.owner_user_id == user_id).order_by(Project.updated_at.desc())).scalars().all()
+    return [ProjectRead.model_validate(p, from_attributes=True) for p in rows]
+
+
+def _lean_projects(db, user_id, chat_id):
+    rows = db.execute(
+        crud.project_read_select(user_id).where(Project.owner_user_id == user_id).order_by(Project.updated_at.desc())
+    ).mappings()
+    return [ProjectRead(**r) for r in rows]
+
+
+def _orm_chats(db, user_id, chat_id):
+    chats = db.execute(select(Chat).where(Chat.owner_user_id == user_id).order_by(Chat.updated_at.desc())).scalars().all()
+    models = {m.id: m.name for m in db.execute(select(LLMModel)).scalars().all()}
+    return [
+        ChatRead(
+            id=c.id,
+            title=c.title,
+            status=c.status,
+            pinned=c.pinned,
+            model_id=c.model_id,
+            model_name=models.get(c.model_id, "unknown"),
+            project_id=c.project_id,
+            created_at=c.created_at,
+            updated_at=c.updated_at,
+        )
+        for c in chats
+    ]
+
+
+def _lean_chats(db, user_id, chat_id):
+    rows = db.execute(
+        crud.chat_read_select(user_id).where(Chat.owner_user_id == user_id).order_by(Chat.updated_at.desc())
+    ).mappings()
+    return [ChatRead(**r) for r in rows]
+
+
+def _orm_messages(db, user_id, chat_id):
+    msgs = (
+        db.execute(select(Message).where(Message.chat_id == chat_id, Message.deleted_at.is_(None)).order_by(Message.id.asc()).limit(200))
+        .scalars()
+        .all()
+    )
+    return [
+        MessageRead(
+            id=m.id,
+            chat_id=m.chat_id,
+            sender_type=m.sender_type,
+            sender_user_id=m.sender_user_id,
+            content=m.content,
+            created_at=m.created_at,
+        )
+        for m in msgs
+    ]
+
+
+def _lean_messages(db, user_id, chat_id):
+    rows = db.execute(
+        crud.message_read_select()
+        .where(Message.chat_id == chat_id, Message.deleted_at.is_(None))
+        .order_by(Message.id.asc())
+        .limit(200)
+    ).mappings()
+    return [MessageRead(**r) for r in rows]
+
+
+CASES = [
+    ("projects", _orm_projects, _lean_projects),
+    ("chats", _orm_chats, _lean_chats),
+    ("messages", _orm_messages, _lean_messages),
+]
+
+
+def _measure(fn, user_id, chat_id, rounds: int) -> dict:
+    rows = 0
+    peak = 0
+    elapsed = 0.0
+    for _ in range(rounds):
+        db = SessionLocal()
+        try:
+            tracemalloc.start()
+            t0 = time.perf_counter()
+            rows += len(fn(db, user_id, chat_id))
+            elapsed += time.perf_counter() - t0
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        finally:
+            db.close()
+    return {"rows_per_sec": rows / elapsed if elapsed else 0.0, "peak_kib": peak / 1024}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user", type=UUID, required=True)
+    parser.add_argument("--chat", type=UUID)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    for name, orm_fn, lean_fn in CASES:
+        if name == "messages" and not args.chat:
+            continue
+        before = _measure(orm_fn, args.user, args.chat, args.rounds)
+        after = _measure(lean_fn, args.user, args.chat, args.rounds)
+        print(
+            f"{name:<9} orm: {before['rows_per_sec']:>10.0f} rows/s {before['peak_kib']:>9.1f} KiB peak | "
+            f"lean: {after['rows_per_sec']:>10.0f} rows/s {after['peak_kib']:>9.1f} KiB peak"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+CPU per request of the hot lookups: rebuilt per call vs. prebuilt vs. prebuilt + server-side prepared.
+
+Usage (from backend/):
+    DATABASE_URL=postgresql+psycopg://... python -m bench.prepared [--iterations 5000]
+
+One "request" is what a message post runs before the LLM call: set_actor, the user lookup, the chat
+access check (twice, as in create_message / update_chat), the owner-membership upsert and the branch
+history, in a transaction that is rolled back. Modes:
+
+    rebuilt   statements built per call, as before (SQLAlchemy's compiled cache still on), no PREPARE
+    prebuilt  the module-level statements from crud/security, no PREPARE
+    prepared  prebuilt, with psycopg prepare_threshold=0
+
+app_us is client CPU (process_time) per request, wall_us the elapsed time. server_us is plan + execution
+time from pg_stat_statements when the extension is installed (plan time needs
+pg_stat_statements.track_planning = on); run it on a quiet database. Needs a database with at least one
+chat that has messages, e.g. the one left by `python -m bench.run --keep`.
+"""
+import argparse
+import os
+import time
+
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.orm import Session
+
+from app import crud
+from app.db import DB_SCHEMA
+from app.models import Chat, Message, User
+from app.security import _USER_BY_ID
+
+_PICK_SQL = text(
+    """
+    SELECT c.id AS chat_id, c.owner_user_id AS user_id,
+           coalesce(c.active_leaf_id, (SELECT max(m.id) FROM messages m WHERE m.chat_id = c.id)) AS leaf_id
+    FROM chats c
+    WHERE c.deleted_at IS NULL AND EXISTS (SELECT 1 FROM messages m WHERE m.chat_id = c.id)
+    LIMIT 1
+    """
+)
+
+_SERVER_TIME_SQL = text(
+    "SELECT coalesce(sum(total_plan_time + total_exec_time), 0) FROM pg_stat_statements WHERE dbid = "
+    "(SELECT oid FROM pg_database WHERE datname = current_database())"
+)
+
+
+def _rebuilt(db: Session, p: dict) -> None:
+    db.execute(text("SELECT set_config('clown_gpt.current_user_id', :v, true)"), {"v": str(p["user_id"])})
+    db.execute(select(User).where(User.id == p["user_id"])).scalar_one()
+    for _ in range(2):
+        db.execute(
+            crud.with_chat_access(select(Chat, crud.chat_role_expr()), p["user_id"]).where(Chat.id == p["chat_id"])
+        ).one()
+    db.execute(
+        text(
+            """
+            INSERT INTO chat_members(chat_id, user_id, member_role, muted, joined_at)
+            VALUES (:c, :u, 'owner', false, now())
+            ON CONFLICT (chat_id, user_id) DO NOTHING
+            """
+        ),
+        {"c": str(p["chat_id"]), "u": str(p["user_id"])},
+    )
+    branch = crud.branch_cte(p["chat_id"], p["leaf_id"], crud.HISTORY_MESSAGES)
+    db.execute(
+        select(Message).join(branch, branch.c.id == Message.id).where(Message.deleted_at.is_(None)).order_by(Message.id)
+    ).scalars().all()
+
+
+def _prebuilt(db: Session, p: dict) -> None:
+    crud.set_actor(db, p["user_id"])
+    db.execute(_USER_BY_ID, {"id": p["user_id"]}).scalar_one()
+    for _ in range(2):
+        crud.get_chat_with_role(db, p["chat_id"], p["user_id"])
+    crud.ensure_chat_member_owner(db, p["chat_id"], p["user_id"])
+    crud.branch_messages(db, p["chat_id"], p["leaf_id"])
+
+
+def _server_ms(db: Session, available: bool) -> float | None:
+    return float(db.execute(_SERVER_TIME_SQL).scalar_one()) if available else None
+
+
+def run(url: str, mode: str, iterations: int, p: dict) -> dict:
+    engine = create_engine(
+        url,
+        connect_args={
+            "options": f"-csearch_path={DB_SCHEMA},public",
+            "prepare_threshold": 0 if mode == "prepared" else None,
+        },
+    )
+    fn = _rebuilt if mode == "rebuilt" else _prebuilt
+    try:
+        with Session(engine) as db:
+            pgss = db.execute(text("SELECT to_regclass('pg_stat_statements') IS NOT NULL")).scalar_one()
+            db.rollback()
+            for _ in range(50):  # warm-up: compiled cache, prepared statements, catalog caches
+                fn(db, p)
+                db.rollback()
+            server0 = _server_ms(db, pgss)
+            db.rollback()
+            cpu0, t0 = time.process_time(), time.perf_counter()
+            for _ in range(iterations):
+                fn(db, p)
+                db.rollback()
+            cpu, wall = time.process_time() - cpu0, time.perf_counter() - t0
+            server1 = _server_ms(db, pgss)
+            db.rollback()
+    finally:
+        engine.dispose()
+    return {
+        "app_us": cpu * 1e6 / iterations,
+        "wall_us": wall * 1e6 / iterations,
+        "server_us": (server1 - server0) * 1000 / iterations if pgss else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=5000)
+    parser.add_argument("--modes", default="rebuilt,prebuilt,prepared")
+    args = parser.parse_args()
+    url = os.environ["DATABASE_URL"]
+
+    engine = create_engine(url, connect_args={"options": f"-csearch_path={DB_SCHEMA},public"})
+    with engine.connect() as conn:
+        row = conn.execute(_PICK_SQL).mappings().one_or_none()
+    engine.dispose()
+    if row is None:
+        raise SystemExit("no chat with messages in this database")
+
+    print(f"{'mode':10} {'app_us':>9} {'wall_us':>9} {'server_us':>10}")
+    base = None
+    for mode in args.modes.split(","):
+        r = run(url, mode, args.iterations, dict(row))
+        base = base or r
+        server = f"{r['server_us']:10.1f}" if r["server_us"] is not None else f"{'n/a':>10}"
+        print(
+            f"{mode:10} {r['app_us']:9.1f} {r['wall_us']:9.1f} {server}"
+            f"   app {r['app_us'] / base['app_us'] - 1:+6.1%}  wall {r['wall_us'] / base['wall_us'] - 1:+6.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Per-call overhead of the plan rate limiter (token bucket + daily quota check).
+
+Runs offline against the in-memory store; with RATE_LIMIT_BACKEND=redis it measures the shared store:
+    python -m bench.ratelimit_overhead [--calls 200000] [--users 1000]
+"""
+import argparse
+import time
+import uuid
+
+from app import ratelimit
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200_000)
+    parser.add_argument("--users", type=int, default=1000)
+    args = parser.parse_args()
+
+    # Generous limits so every call takes the "allowed" path, which is the common one.
+    ratelimit.PLAN_LIMITS["bench"] = ratelimit.PlanLimits(messages_per_minute=10**9, burst=10**9, daily_tokens=10**12)
+    ctxs = [ratelimit.PlanContext(user_id=uuid.uuid4(), org_id=uuid.uuid4(), plan="bench") for _ in range(args.users)]
+    store = ratelimit.store
+
+    t0 = time.perf_counter()
+    for i in range(args.calls):
+        store.take(f"rl:user:{ctxs[i % args.users].user_id}", 1000.0, 10**9)
+    take_us = (time.perf_counter() - t0) / args.calls * 1e6
+
+    t0 = time.perf_counter()
+    for i in range(args.calls):
+        ratelimit.check_message_limits(ctxs[i % args.users])
+    check_us = (time.perf_counter() - t0) / args.calls * 1e6
+
+    t0 = time.perf_counter()
+    for i in range(args.calls):
+        ratelimit.record_tokens(ctxs[i % args.users], 100)
+    record_us = (time.perf_counter() - t0) / args.calls * 1e6
+
+    print(f"backend={ratelimit.RATE_LIMIT_BACKEND} users={args.users} calls={args.calls}")
+    print(f"bucket take          {take_us:8.2f} us/call")
+    print(f"check_message_limits {check_us:8.2f} us/call (user + org bucket + quota read)")
+    print(f"record_tokens        {record_us:8.2f} us/call")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Throughput of the default response_model path versus the FAST_JSON orjson path per list endpoint.
+
+Runs offline on synthetic rows shaped like each endpoint's projection:
+    python -m bench.serialization [--rounds 50]
+
+The default path is emulated the way FastAPI does it: build the Pydantic models, validate them
+again against the response_model, dump them in JSON mode and encode with json.dumps.
+"""
+import argparse
+import json
+import random
+import time
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+from pydantic import TypeAdapter
+
+from app.responses import dumps
+from app.schemas import ChatRead, DailyModelUsage, MessageRead, ProjectSummaryReport, UserActivityReport
+from app.timeutil import utcnow
+
+
+def _messages(n: int) -> list[dict]:
+    chat_id = uuid.uuid4()
+    now = utcnow()
+    return [
+        {
+            "id": i,
+            "chat_id": chat_id,
+            "sender_type": "user" if i % 2 else "assistant",
+            "sender_user_id": uuid.uuid4() if i % 2 else None,
+            "content": "x" * random.randint(200, 8000),
+            "created_at": now + timedelta(seconds=i),
+        }
+        for i in range(n)
+    ]
+
+
+def _chats(n: int) -> list[dict]:
+    now = utcnow()
+    return [
+        {
+            "id": uuid.uuid4(),
+            "title": f"Chat {i}",
+            "status": "active",
+            "pinned": False,
+            "model_id": 2,
+            "model_name": "clown 1.3",
+            "project_id": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        for i in range(n)
+    ]
+
+
+def _user_activity(n: int) -> list[dict]:
+    return [
+        {
+            "user_id": uuid.uuid4(),
+            "username": f"user{i}",
+            "role": "member",
+            "owned_chats": i,
+            "user_messages": i * 10,
+            "assistant_messages": i * 10,
+        }
+        for i in range(n)
+    ]
+
+
+def _project_summary(n: int) -> list[dict]:
+    now = utcnow()
+    return [
+        {
+            "project_id": uuid.uuid4(),
+            "name": f"Project {i}",
+            "visibility": "private",
+            "chat_count": i,
+            "message_count": i * 20,
+            "last_activity_at": now,
+        }
+        for i in range(n)
+    ]
+
+
+def _model_usage(n: int) -> list[dict]:
+    now = utcnow()
+    return [
+        {
+            "day": now - timedelta(days=i),
+            "model_name": "clown 1.4",
+            "calls": i,
+            "tokens_in": i * 100,
+            "tokens_out": i * 300,
+            "cost": Decimal("1.234567"),
+        }
+        for i in range(n)
+    ]
+
+
+CASES = [
+    ("list_messages", MessageRead, _messages, 200),
+    ("list_chats", ChatRead, _chats, 1000),
+    ("report_user_activity", UserActivityReport, _user_activity, 10000),
+    ("report_project_summary", ProjectSummaryReport, _project_summary, 10000),
+    ("report_model_usage", DailyModelUsage, _model_usage, 5000),
+]
+
+
+def _default_path(adapter: TypeAdapter, model, rows):
+    objs = [model(**r) for r in rows]
+    value = adapter.validate_python(objs)
+    return json.dumps(adapter.dump_python(value, mode="json")).encode("utf-8")
+
+
+def _fast_path(adapter: TypeAdapter, model, rows):
+    return dumps([dict(r) for r in rows])
+
+
+def _run(fn, adapter, model, rows, rounds: int) -> tuple[float, float]:
+    size = 0
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        size += len(fn(adapter, model, rows))
+    elapsed = time.perf_counter() - t0
+    return rounds * len(rows) / elapsed, size / elapsed / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+    random.seed(1234)
+
+    for name, model, make_rows, n in CASES:
+        rows = make_rows(n)
+        adapter = TypeAdapter(list[model])
+        d_rows, d_mb = _run(_default_path, adapter, model, rows, args.rounds)
+        f_rows, f_mb = _run(_fast_path, adapter, model, rows, args.rounds)
+        print(
+            f"{name:<24} default: {d_rows:>10.0f} rows/s {d_mb:>7.1f} MB/s | "
+            f"fast: {f_rows:>10.0f} rows/s {f_mb:>7.1f} MB/s | x{f_rows / d_rows:.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Open many idle SSE connections against one worker and hold them.
+
+Usage (from backend/, raise `ulimit -n` on both sides first):
+    python -m bench.sse_idle --url http://localhost:8000 --token <jwt> --connections 10000 [--pid <worker pid>]
+
+Reports how many streams were established, how long it took, and — with --pid on the same host —
+the worker's resident memory before and after, i.e. the per-connection cost.
+"""
+import argparse
+import asyncio
+import time
+from urllib.parse import urlsplit
+
+
+def _rss_kib(pid: int | None) -> int | None:
+    if not pid:
+        return None
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return None
+
+
+async def _open(host: str, port: int, token: str, held: list):
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(
+        f"GET /api/events?token={token} HTTP/1.1\r\nHost: {host}\r\nAccept: text/event-stream\r\n\r\n".encode()
+    )
+    await writer.drain()
+    status = await reader.readline()
+    if b" 200 " not in status:
+        writer.close()
+        raise RuntimeError(status.decode(errors="replace").strip())
+    held.append((reader, writer))
+
+
+async def _main(args):
+    url = urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+    held: list = []
+    rss_before = _rss_kib(args.pid)
+
+    t0 = time.perf_counter()
+    sem = asyncio.Semaphore(args.concurrency)
+
+    async def _one():
+        async with sem:
+            await _open(host, port, args.token, held)
+
+    results = await asyncio.gather(*(_one() for _ in range(args.connections)), return_exceptions=True)
+    elapsed = time.perf_counter() - t0
+    errors = [r for r in results if isinstance(r, Exception)]
+
+    print(f"established {len(held)}/{args.connections} streams in {elapsed:.1f}s ({len(errors)} errors)")
+    if errors:
+        print(f"first error: {errors[0]!r}")
+
+    await asyncio.sleep(args.hold)
+    rss_after = _rss_kib(args.pid)
+    if rss_before is not None and rss_after is not None and held:
+        print(f"worker RSS {rss_before} KiB -> {rss_after} KiB ({(rss_after - rss_before) / len(held):.1f} KiB/conn)")
+
+    for _, writer in held:
+        writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--token", required=True)
+    parser.add_argument("--connections", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=200, help="connections opened in parallel")
+    parser.add_argument("--hold", type=float, default=30.0, help="seconds to keep the streams idle")
+    parser.add_argument("--pid", type=int, help="worker pid for RSS sampling")
+    asyncio.run(_main(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@ SET search_path = clown_gpt, public;
 
 CREATE EXTENSION pgcrypto;
 CREATE EXTENSION citext;
+CREATE EXTENSION pg_trgm;
 
 CREATE TYPE user_role AS ENUM ('admin','member','moderator');
 CREATE TYPE membership_role AS ENUM ('owner','editor','viewer');
@@ -133,8 +134,12 @@ CREATE TABLE models (
   price_input_1k numeric(10,4) NOT NULL DEFAULT 0,
   price_output_1k numeric(10,4) NOT NULL DEFAULT 0,
   capabilities jsonb NOT NULL DEFAULT '{}'::jsonb,
+  -- Маршрутизация запросов (app/providers.py): {"strategy", "hedge", "backends": [{name, base_url, model, api_key_env, timeout}]}
+  routing jsonb NOT NULL DEFAULT '{}'::jsonb,
   created_at timestamptz NOT NULL DEFAULT now(),
   CONSTRAINT models_name_len_chk CHECK (char_length(name) BETWEEN 3 AND 64),
+  CONSTRAINT models_routing_chk CHECK (jsonb_typeof(routing) = 'object'
+    AND jsonb_typeof(COALESCE(routing->'backends', '[]'::jsonb)) = 'array'),
   CONSTRAINT models_ctx_chk CHECK (context_window >= 256),
   CONSTRAINT models_price_chk CHECK (price_input_1k >= 0 AND price_output_1k >= 0)
 );
@@ -181,6 +186,8 @@ CREATE TABLE chats (
   max_output_tokens integer NOT NULL DEFAULT 1024,
   system_prompt text NOT NULL DEFAULT '',
   metadata jsonb NOT NULL DEFAULT '{}'::jsonb,
+  -- последнее сообщение активной ветки; NULL у чатов без ветвления (история линейна по id)
+  active_leaf_id bigint,
   created_at timestamptz NOT NULL DEFAULT now(),
   updated_at timestamptz NOT NULL DEFAULT now(),
   deleted_at timestamptz,
@@ -208,6 +215,9 @@ CREATE TABLE chat_members (
 CREATE TABLE messages (
   id bigserial PRIMARY KEY,
   chat_id uuid NOT NULL,
+  -- предыдущее сообщение ветки; правка и перегенерация создают соседа, старая ветка не меняется.
+  -- Без FK: сегменты и архив переносят сообщения чата целиком
+  parent_id bigint,
   sender_user_id uuid,
   sender_type message_sender_type NOT NULL,
   content text NOT NULL,
@@ -222,7 +232,9 @@ CREATE TABLE messages (
   CONSTRAINT messages_sender_fk FOREIGN KEY (sender_user_id) REFERENCES users(id) ON UPDATE CASCADE ON DELETE SET NULL,
   CONSTRAINT messages_content_len_chk CHECK (char_length(content) BETWEEN 1 AND 8000),
   CONSTRAINT messages_tokens_chk CHECK (token_input >= 0 AND token_output >= 0),
-  CONSTRAINT messages_cost_chk CHECK (cost_estimated >= 0)
+  CONSTRAINT messages_cost_chk CHECK (cost_estimated >= 0),
+  -- родитель всегда старше: обход ветки вверх конечен
+  CONSTRAINT messages_parent_chk CHECK (parent_id IS NULL OR parent_id < id)
 );
 
 CREATE TABLE tags (
@@ -290,6 +302,20 @@ CREATE TABLE invoices (
   CONSTRAINT inv_currency_chk CHECK (char_length(currency) = 3)
 );
 
+-- Контрольные точки биллинга: задание по периоду можно прервать и продолжить с last_org_id
+CREATE TABLE billing_runs (
+  period_from date NOT NULL,
+  period_to date NOT NULL,
+  last_org_id uuid,
+  orgs_done integer NOT NULL DEFAULT 0,
+  invoices_written integer NOT NULL DEFAULT 0,
+  started_at timestamptz NOT NULL DEFAULT now(),
+  updated_at timestamptz NOT NULL DEFAULT now(),
+  finished_at timestamptz,
+  PRIMARY KEY (period_from, period_to),
+  CONSTRAINT billing_runs_period_chk CHECK (period_to >= period_from)
+);
+
 CREATE TABLE chat_stats (
   chat_id uuid PRIMARY KEY,
   message_count integer NOT NULL DEFAULT 0,
@@ -297,6 +323,7 @@ CREATE TABLE chat_stats (
   assistant_message_count integer NOT NULL DEFAULT 0,
   system_message_count integer NOT NULL DEFAULT 0,
   last_message_at timestamptz,
+  last_message_preview text,
   updated_at timestamptz NOT NULL DEFAULT now(),
   CONSTRAINT chat_stats_chat_fk FOREIGN KEY (chat_id) REFERENCES chats(id) ON UPDATE CASCADE ON DELETE CASCADE,
   CONSTRAINT chat_stats_nonneg_chk CHECK (message_count >= 0 AND user_message_count >= 0 AND assistant_message_count >= 0 AND system_message_count >= 0)
@@ -313,6 +340,40 @@ CREATE TABLE project_stats (
   CONSTRAINT project_stats_nonneg_chk CHECK (chat_count >= 0 AND message_count >= 0 AND active_member_count >= 0)
 );
 
+-- Предагрегаты usage_events для аналитики организаций (app/analytics.py): часовые и суточные корзины (UTC)
+-- по (модель, пользователь, проект). Ведутся statement-триггером на вставку в usage_events;
+-- usage_rollup_rebuild() пересчитывает диапазон после загрузки с отключёнными триггерами.
+-- Уникальный ключ (NULL = NULL) с INCLUDE отвечает на запрос организации за диапазон index-only сканом.
+CREATE TABLE usage_rollup_hourly (
+  organization_id uuid NOT NULL,
+  bucket timestamptz NOT NULL,
+  model_id integer,
+  user_id uuid,
+  project_id uuid,
+  calls bigint NOT NULL DEFAULT 0,
+  tokens_in bigint NOT NULL DEFAULT 0,
+  tokens_out bigint NOT NULL DEFAULT 0,
+  cost numeric(18,6) NOT NULL DEFAULT 0,
+  CONSTRAINT usage_rollup_hourly_org_fk FOREIGN KEY (organization_id) REFERENCES organizations(id) ON UPDATE CASCADE ON DELETE CASCADE,
+  CONSTRAINT usage_rollup_hourly_key UNIQUE NULLS NOT DISTINCT (organization_id, bucket, model_id, user_id, project_id)
+    INCLUDE (calls, tokens_in, tokens_out, cost)
+);
+
+CREATE TABLE usage_rollup_daily (
+  organization_id uuid NOT NULL,
+  day date NOT NULL,
+  model_id integer,
+  user_id uuid,
+  project_id uuid,
+  calls bigint NOT NULL DEFAULT 0,
+  tokens_in bigint NOT NULL DEFAULT 0,
+  tokens_out bigint NOT NULL DEFAULT 0,
+  cost numeric(18,6) NOT NULL DEFAULT 0,
+  CONSTRAINT usage_rollup_daily_org_fk FOREIGN KEY (organization_id) REFERENCES organizations(id) ON UPDATE CASCADE ON DELETE CASCADE,
+  CONSTRAINT usage_rollup_daily_key UNIQUE NULLS NOT DISTINCT (organization_id, day, model_id, user_id, project_id)
+    INCLUDE (calls, tokens_in, tokens_out, cost)
+);
+
 CREATE TABLE audit_log (
   id bigserial PRIMARY KEY,
   table_name text NOT NULL,
@@ -329,4 +390,80 @@ CREATE TABLE audit_log (
   CONSTRAINT audit_changed_by_fk FOREIGN KEY (changed_by) REFERENCES users(id) ON UPDATE CASCADE ON DELETE SET NULL
 );
 
+-- Очередь фоновых задач (app/jobs.py): воркеры забирают задачи через FOR UPDATE SKIP LOCKED,
+-- успешные удаляются, исчерпавшие попытки остаются со статусом 'dead'
+CREATE TABLE jobs (
+  id bigserial PRIMARY KEY,
+  kind text NOT NULL,
+  payload jsonb NOT NULL DEFAULT '{}'::jsonb,
+  status text NOT NULL DEFAULT 'queued',
+  priority integer NOT NULL DEFAULT 100,
+  run_at timestamptz NOT NULL DEFAULT now(),
+  attempts integer NOT NULL DEFAULT 0,
+  max_attempts integer NOT NULL DEFAULT 5,
+  dedupe_key text,
+  locked_by text,
+  locked_at timestamptz,
+  last_error text,
+  created_at timestamptz NOT NULL DEFAULT now(),
+  CONSTRAINT jobs_status_chk CHECK (status IN ('queued','running','dead')),
+  CONSTRAINT jobs_attempts_chk CHECK (attempts >= 0 AND max_attempts >= 1)
+);
+
+-- Ключи идемпотентности (заголовок Idempotency-Key): сохранённый ответ возвращается при повторе запроса
+CREATE TABLE idempotency_keys (
+  user_id uuid NOT NULL,
+  idem_key text NOT NULL,
+  request_hash text NOT NULL,
+  response jsonb,
+  created_at timestamptz NOT NULL DEFAULT now(),
+  expires_at timestamptz NOT NULL,
+  PRIMARY KEY (user_id, idem_key),
+  CONSTRAINT idem_user_fk FOREIGN KEY (user_id) REFERENCES users(id) ON UPDATE CASCADE ON DELETE CASCADE
+);
+
+-- Холодное хранение: сообщения неактивного чата выгружены в сжатый NDJSON-сегмент (app/tiering.py),
+-- в messages их нет; строка-заглушка указывает на файл. chat_stats продолжает учитывать эти сообщения.
+CREATE TABLE chat_cold_segments (
+  chat_id uuid PRIMARY KEY,
+  storage_key text NOT NULL,
+  codec text NOT NULL,
+  message_count integer NOT NULL,
+  visible_count integer NOT NULL,
+  first_message_id bigint NOT NULL,
+  last_message_id bigint NOT NULL,
+  last_message_at timestamptz,
+  raw_bytes bigint NOT NULL,
+  stored_bytes bigint NOT NULL,
+  exported_at timestamptz NOT NULL DEFAULT now(),
+  CONSTRAINT cold_segments_chat_fk FOREIGN KEY (chat_id) REFERENCES chats(id) ON UPDATE CASCADE ON DELETE CASCADE,
+  CONSTRAINT cold_segments_codec_chk CHECK (codec IN ('zstd','gzip'))
+);
+
+-- Холодный архив: удалённые и давно архивированные чаты переносятся сюда фоновой компакцией
+-- (app/compaction.py) и возвращаются в горячие таблицы при восстановлении. Внешних ключей нет намеренно.
+CREATE TABLE chats_archive (
+  LIKE chats,
+  archived_at timestamptz NOT NULL DEFAULT now(),
+  PRIMARY KEY (id)
+);
+
+CREATE TABLE messages_archive (
+  LIKE messages,
+  archived_at timestamptz NOT NULL DEFAULT now(),
+  PRIMARY KEY (id)
+);
+
+CREATE TABLE chat_members_archive (
+  LIKE chat_members,
+  archived_at timestamptz NOT NULL DEFAULT now(),
+  PRIMARY KEY (chat_id, user_id)
+);
+
+CREATE TABLE chat_tags_archive (
+  LIKE chat_tags,
+  archived_at timestamptz NOT NULL DEFAULT now(),
+  PRIMARY KEY (chat_id, tag_id)
+);
+
 COMMIT;
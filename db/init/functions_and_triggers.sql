@@ -1,11 +1,21 @@
 BEGIN;
 SET search_path = clown_gpt, public;
 
+-- Массовый перенос строк (компакция/архив): построчные аудит, агрегаты и уведомления отключаются,
+-- статистика пересчитывается одним запросом после пакета. Включается через set_config(..., true).
+CREATE OR REPLACE FUNCTION bulk_move_active() RETURNS boolean AS $$
+  SELECT coalesce(current_setting('clown_gpt.bulk_move', true), '') = 'on';
+$$ LANGUAGE sql STABLE;
+
 -- Универсальный аудит
 CREATE OR REPLACE FUNCTION audit_log_change() RETURNS trigger AS $$
 DECLARE
   v_user uuid := null;
 BEGIN
+  IF bulk_move_active() THEN
+    RETURN NULL;
+  END IF;
+
   BEGIN
     v_user := current_setting('clown_gpt.current_user_id', true)::uuid;
   EXCEPTION WHEN others THEN
@@ -42,6 +52,11 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
+-- Короткое превью последнего сообщения для сайдбара
+CREATE OR REPLACE FUNCTION chat_preview(p_content text) RETURNS text AS $$
+  SELECT left(regexp_replace(btrim(p_content), '\s+', ' ', 'g'), 160);
+$$ LANGUAGE sql IMMUTABLE;
+
 CREATE OR REPLACE FUNCTION trg_chat_stats_init() RETURNS trigger AS $$
 BEGIN
   PERFORM chat_stats_ensure(NEW.id);
@@ -56,7 +71,12 @@ DECLARE
   v_sign int := 1;
   v_sender message_sender_type;
   v_created timestamptz;
+  v_content text;
 BEGIN
+  IF bulk_move_active() THEN
+    RETURN NULL;
+  END IF;
+
   IF TG_OP = 'DELETE' THEN
     v_chat_id := OLD.chat_id;
     v_sign := -1;
@@ -66,6 +86,7 @@ BEGIN
     v_chat_id := NEW.chat_id;
     v_sender := NEW.sender_type;
     v_created := NEW.created_at;
+    v_content := NEW.content;
   END IF;
 
   SELECT project_id INTO v_project_id FROM chats WHERE id = v_chat_id;
@@ -78,6 +99,13 @@ BEGIN
       assistant_message_count = assistant_message_count + CASE WHEN v_sender = 'assistant' THEN v_sign ELSE 0 END,
       system_message_count = system_message_count + CASE WHEN v_sender = 'system' THEN v_sign ELSE 0 END,
       last_message_at = CASE WHEN v_sign > 0 AND (last_message_at IS NULL OR v_created > last_message_at) THEN v_created ELSE last_message_at END,
+      last_message_preview = CASE
+        WHEN v_sign > 0 AND (last_message_at IS NULL OR v_created >= last_message_at) THEN chat_preview(v_content)
+        WHEN v_sign < 0 AND v_created >= last_message_at THEN (
+          SELECT chat_preview(m.content) FROM messages m
+          WHERE m.chat_id = v_chat_id AND m.deleted_at IS NULL
+          ORDER BY m.created_at DESC, m.id DESC LIMIT 1)
+        ELSE last_message_preview END,
       updated_at = now()
   WHERE chat_id = v_chat_id;
 
@@ -95,21 +123,20 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
-CREATE OR REPLACE FUNCTION trg_messages_recount() RETURNS trigger AS $$
-DECLARE
-  v_chat_id uuid;
-  v_project_id uuid;
+-- Полный пересчёт статистики чата/проекта (после переноса строк или изменения deleted_at)
+CREATE OR REPLACE FUNCTION chat_stats_recount(p_chat_id uuid) RETURNS void AS $$
 BEGIN
-  v_chat_id := COALESCE(NEW.chat_id, OLD.chat_id);
-  SELECT project_id INTO v_project_id FROM chats WHERE id = v_chat_id;
-
-  PERFORM chat_stats_ensure(v_chat_id);
+  PERFORM chat_stats_ensure(p_chat_id);
   UPDATE chat_stats cs
   SET message_count = s.message_count,
       user_message_count = s.user_message_count,
       assistant_message_count = s.assistant_message_count,
       system_message_count = s.system_message_count,
       last_message_at = s.last_message_at,
+      last_message_preview = (
+        SELECT chat_preview(m.content) FROM messages m
+        WHERE m.chat_id = p_chat_id AND m.deleted_at IS NULL
+        ORDER BY m.created_at DESC, m.id DESC LIMIT 1),
       updated_at = now()
   FROM (
     SELECT
@@ -118,25 +145,52 @@ BEGIN
       COUNT(*) FILTER (WHERE sender_type = 'assistant' AND deleted_at IS NULL) AS assistant_message_count,
       COUNT(*) FILTER (WHERE sender_type = 'system' AND deleted_at IS NULL) AS system_message_count,
       MAX(created_at) FILTER (WHERE deleted_at IS NULL) AS last_message_at
-    FROM messages WHERE chat_id = v_chat_id
+    FROM messages WHERE chat_id = p_chat_id
   ) s
-  WHERE cs.chat_id = v_chat_id;
+  WHERE cs.chat_id = p_chat_id;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION project_stats_recount(p_project_id uuid) RETURNS void AS $$
+BEGIN
+  PERFORM project_stats_ensure(p_project_id);
+  -- Сообщения чатов в холодном хранении берутся из их сегментов
+  UPDATE project_stats ps
+  SET chat_count = s.chat_count,
+      active_member_count = s.member_count,
+      message_count = s.message_count + cold.message_count,
+      last_activity_at = GREATEST(s.last_message_at, cold.last_message_at),
+      updated_at = now()
+  FROM (
+    SELECT
+      (SELECT COUNT(*) FROM chats WHERE project_id = p_project_id) AS chat_count,
+      (SELECT COUNT(*) FROM project_members WHERE project_id = p_project_id) AS member_count,
+      COUNT(*) FILTER (WHERE m.deleted_at IS NULL) AS message_count,
+      MAX(m.created_at) FILTER (WHERE m.deleted_at IS NULL) AS last_message_at
+    FROM messages m
+    JOIN chats c ON c.id = m.chat_id
+    WHERE c.project_id = p_project_id
+  ) s, (
+    SELECT COALESCE(SUM(seg.visible_count), 0) AS message_count, MAX(seg.last_message_at) AS last_message_at
+    FROM chat_cold_segments seg
+    JOIN chats c ON c.id = seg.chat_id
+    WHERE c.project_id = p_project_id
+  ) cold
+  WHERE ps.project_id = p_project_id;
+END;
+$$ LANGUAGE plpgsql;
 
+CREATE OR REPLACE FUNCTION trg_messages_recount() RETURNS trigger AS $$
+DECLARE
+  v_chat_id uuid;
+  v_project_id uuid;
+BEGIN
+  v_chat_id := COALESCE(NEW.chat_id, OLD.chat_id);
+  SELECT project_id INTO v_project_id FROM chats WHERE id = v_chat_id;
+
+  PERFORM chat_stats_recount(v_chat_id);
   IF v_project_id IS NOT NULL THEN
-    PERFORM project_stats_ensure(v_project_id);
-    UPDATE project_stats ps
-    SET message_count = s.message_count,
-        last_activity_at = s.last_message_at,
-        updated_at = now()
-    FROM (
-      SELECT
-        COUNT(*) FILTER (WHERE m.deleted_at IS NULL) AS message_count,
-        MAX(m.created_at) FILTER (WHERE m.deleted_at IS NULL) AS last_message_at
-      FROM messages m
-      JOIN chats c ON c.id = m.chat_id
-      WHERE c.project_id = v_project_id
-    ) s
-    WHERE ps.project_id = v_project_id;
+    PERFORM project_stats_recount(v_project_id);
   END IF;
   RETURN NULL;
 END;
@@ -166,6 +220,115 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
+-- Участники проекта (project_members) в project_stats.active_member_count. При удалении проекта строки
+-- участников удаляются каскадом, поэтому строка статистики на DELETE не создаётся.
+CREATE OR REPLACE FUNCTION trg_project_members_aggregate() RETURNS trigger AS $$
+BEGIN
+  IF bulk_move_active() THEN
+    RETURN NULL;
+  END IF;
+
+  IF TG_OP = 'INSERT' THEN
+    PERFORM project_stats_ensure(NEW.project_id);
+    UPDATE project_stats
+    SET active_member_count = active_member_count + 1, updated_at = now()
+    WHERE project_id = NEW.project_id;
+  ELSE
+    UPDATE project_stats
+    SET active_member_count = GREATEST(active_member_count - 1, 0), updated_at = now()
+    WHERE project_id = OLD.project_id;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Уведомления для realtime-канала (LISTEN clown_gpt_events)
+CREATE OR REPLACE FUNCTION notify_chat_event() RETURNS trigger AS $$
+DECLARE
+  v_payload jsonb;
+BEGIN
+  IF bulk_move_active() THEN
+    RETURN NULL;
+  END IF;
+
+  IF TG_TABLE_NAME = 'messages' THEN
+    v_payload := jsonb_build_object('type', 'message', 'op', lower(TG_OP),
+                                    'chat_id', NEW.chat_id, 'message_id', NEW.id, 'sender_type', NEW.sender_type);
+  ELSE
+    v_payload := jsonb_build_object('type', 'chat', 'op', lower(TG_OP), 'chat_id', NEW.id);
+  END IF;
+  PERFORM pg_notify('clown_gpt_events', v_payload::text);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Предагрегаты usage_events: один проход по transition table на оператор вставки, затем одно
+-- уведомление 'usage' на организацию с диапазоном happened_at (кэш аналитики сбрасывает только
+-- пересекающиеся с ним записи). bulk_move не проверяется: usage_events компакцией не переносятся.
+CREATE OR REPLACE FUNCTION trg_usage_rollup() RETURNS trigger AS $$
+BEGIN
+  INSERT INTO usage_rollup_hourly AS r (organization_id, bucket, model_id, user_id, project_id, calls, tokens_in, tokens_out, cost)
+  SELECT n.organization_id, date_trunc('hour', n.happened_at, 'UTC'), n.model_id, n.user_id, c.project_id,
+         COUNT(*), SUM(n.tokens_in), SUM(n.tokens_out), SUM(n.cost)
+  FROM new_usage n
+  LEFT JOIN chats c ON c.id = n.chat_id
+  GROUP BY 1, 2, 3, 4, 5
+  ON CONFLICT ON CONSTRAINT usage_rollup_hourly_key DO UPDATE
+  SET calls = r.calls + EXCLUDED.calls,
+      tokens_in = r.tokens_in + EXCLUDED.tokens_in,
+      tokens_out = r.tokens_out + EXCLUDED.tokens_out,
+      cost = r.cost + EXCLUDED.cost;
+
+  INSERT INTO usage_rollup_daily AS r (organization_id, day, model_id, user_id, project_id, calls, tokens_in, tokens_out, cost)
+  SELECT n.organization_id, (n.happened_at AT TIME ZONE 'UTC')::date, n.model_id, n.user_id, c.project_id,
+         COUNT(*), SUM(n.tokens_in), SUM(n.tokens_out), SUM(n.cost)
+  FROM new_usage n
+  LEFT JOIN chats c ON c.id = n.chat_id
+  GROUP BY 1, 2, 3, 4, 5
+  ON CONFLICT ON CONSTRAINT usage_rollup_daily_key DO UPDATE
+  SET calls = r.calls + EXCLUDED.calls,
+      tokens_in = r.tokens_in + EXCLUDED.tokens_in,
+      tokens_out = r.tokens_out + EXCLUDED.tokens_out,
+      cost = r.cost + EXCLUDED.cost;
+
+  PERFORM pg_notify('clown_gpt_events', jsonb_build_object(
+            'type', 'usage', 'org_id', n.organization_id, 'from', MIN(n.happened_at), 'to', MAX(n.happened_at))::text)
+  FROM new_usage n
+  GROUP BY n.organization_id;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Полный пересчёт предагрегатов за диапазон, расширенный до целых суток UTC (NULL = без границы).
+-- Уведомление без org_id сбрасывает кэш аналитики всех организаций за этот диапазон.
+CREATE OR REPLACE FUNCTION usage_rollup_rebuild(p_from timestamptz DEFAULT NULL, p_to timestamptz DEFAULT NULL) RETURNS void AS $$
+DECLARE
+  v_from timestamptz := COALESCE(date_trunc('day', p_from, 'UTC'), '-infinity');
+  v_to timestamptz := COALESCE(date_trunc('day', p_to, 'UTC') + interval '1 day', 'infinity');
+BEGIN
+  DELETE FROM usage_rollup_hourly WHERE bucket >= v_from AND bucket < v_to;
+  DELETE FROM usage_rollup_daily
+  WHERE day >= (v_from AT TIME ZONE 'UTC')::date AND day < (v_to AT TIME ZONE 'UTC')::date;
+
+  INSERT INTO usage_rollup_hourly (organization_id, bucket, model_id, user_id, project_id, calls, tokens_in, tokens_out, cost)
+  SELECT ue.organization_id, date_trunc('hour', ue.happened_at, 'UTC'), ue.model_id, ue.user_id, c.project_id,
+         COUNT(*), SUM(ue.tokens_in), SUM(ue.tokens_out), SUM(ue.cost)
+  FROM usage_events ue
+  LEFT JOIN chats c ON c.id = ue.chat_id
+  WHERE ue.happened_at >= v_from AND ue.happened_at < v_to
+  GROUP BY 1, 2, 3, 4, 5;
+
+  INSERT INTO usage_rollup_daily (organization_id, day, model_id, user_id, project_id, calls, tokens_in, tokens_out, cost)
+  SELECT organization_id, (bucket AT TIME ZONE 'UTC')::date, model_id, user_id, project_id,
+         SUM(calls), SUM(tokens_in), SUM(tokens_out), SUM(cost)
+  FROM usage_rollup_hourly
+  WHERE bucket >= v_from AND bucket < v_to
+  GROUP BY 1, 2, 3, 4, 5;
+
+  PERFORM pg_notify('clown_gpt_events', jsonb_build_object('type', 'usage', 'from', v_from, 'to', v_to)::text);
+END;
+$$ LANGUAGE plpgsql;
+
 -- Скалярные функции
 CREATE OR REPLACE FUNCTION fn_chat_message_count(p_chat_id uuid) RETURNS integer AS $$
   SELECT COALESCE(message_count, 0) FROM chat_stats WHERE chat_id = p_chat_id;
@@ -184,30 +347,38 @@ CREATE OR REPLACE FUNCTION fn_project_report(p_org uuid DEFAULT NULL) RETURNS TA
   project_name text,
   chat_count integer,
   message_count integer,
+  active_member_count integer,
   last_activity timestamptz
 ) AS $$
-  SELECT p.id, p.name, COALESCE(ps.chat_count, 0), COALESCE(ps.message_count, 0), ps.last_activity_at
+  SELECT p.id, p.name, COALESCE(ps.chat_count, 0), COALESCE(ps.message_count, 0), COALESCE(ps.active_member_count, 0),
+         ps.last_activity_at
   FROM projects p
   LEFT JOIN project_stats ps ON ps.project_id = p.id
-  WHERE (p.organization_id = p_org OR p_org IS NULL);
+  WHERE (p.organization_id = p_org OR p_org IS NULL) AND p.deleted_at IS NULL;
 $$ LANGUAGE sql STABLE;
 
-CREATE OR REPLACE FUNCTION fn_model_usage_report(p_org uuid DEFAULT NULL) RETURNS TABLE (
+-- Использование моделей за [p_from, p_to) по суточным предагрегатам (NULL = без границы)
+CREATE OR REPLACE FUNCTION fn_model_usage_report(p_org uuid DEFAULT NULL, p_from date DEFAULT NULL, p_to date DEFAULT NULL)
+RETURNS TABLE (
   model_id integer,
   model_name text,
   total_tokens_in bigint,
   total_tokens_out bigint,
-  calls bigint
+  calls bigint,
+  total_cost numeric
 ) AS $$
-  SELECT ue.model_id,
+  SELECT r.model_id,
          m.name,
-         SUM(ue.tokens_in)::bigint,
-         SUM(ue.tokens_out)::bigint,
-         COUNT(*)::bigint AS calls
-  FROM usage_events ue
-  LEFT JOIN models m ON m.id = ue.model_id
-  WHERE (ue.organization_id = p_org OR p_org IS NULL)
-  GROUP BY ue.model_id, m.name
+         SUM(r.tokens_in)::bigint,
+         SUM(r.tokens_out)::bigint,
+         SUM(r.calls)::bigint AS calls,
+         SUM(r.cost)
+  FROM usage_rollup_daily r
+  LEFT JOIN models m ON m.id = r.model_id
+  WHERE (r.organization_id = p_org OR p_org IS NULL)
+    AND (r.day >= p_from OR p_from IS NULL)
+    AND (r.day < p_to OR p_to IS NULL)
+  GROUP BY r.model_id, m.name
   ORDER BY calls DESC NULLS LAST;
 $$ LANGUAGE sql STABLE;
 
@@ -231,8 +402,25 @@ CREATE TRIGGER trg_messages_recount
 AFTER UPDATE OF sender_type, deleted_at ON messages
 FOR EACH ROW EXECUTE FUNCTION trg_messages_recount();
 
+CREATE TRIGGER trg_messages_notify
+AFTER INSERT OR UPDATE ON messages
+FOR EACH ROW EXECUTE FUNCTION notify_chat_event();
+
+CREATE TRIGGER trg_chats_notify
+AFTER INSERT OR UPDATE ON chats
+FOR EACH ROW EXECUTE FUNCTION notify_chat_event();
+
 CREATE TRIGGER trg_chat_stats_init
 AFTER INSERT ON chats
 FOR EACH ROW EXECUTE FUNCTION trg_chat_stats_init();
 
+CREATE TRIGGER trg_project_members_stats
+AFTER INSERT OR DELETE ON project_members
+FOR EACH ROW EXECUTE FUNCTION trg_project_members_aggregate();
+
+CREATE TRIGGER trg_usage_rollup
+AFTER INSERT ON usage_events
+REFERENCING NEW TABLE AS new_usage
+FOR EACH STATEMENT EXECUTE FUNCTION trg_usage_rollup();
+
 COMMIT;
@@ -4,14 +4,47 @@ SET search_path = clown_gpt, public;
 -- B-Tree индексы 
 CREATE INDEX IF NOT EXISTS idx_users_username ON users (username);
 CREATE INDEX IF NOT EXISTS idx_users_email ON users (email);
+-- Каталог пользователей для админов: сортировки с keyset-пагинацией и поиск по префиксу
+CREATE INDEX IF NOT EXISTS idx_users_created_id ON users (created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_users_last_login_id ON users (last_login_at DESC, id DESC) WHERE last_login_at IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_users_role_created ON users (role, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_users_username_prefix ON users (lower(username::text) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_users_email_prefix ON users (lower(email::text) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_api_keys_prefix ON api_keys (key_prefix) WHERE is_active;
+CREATE INDEX IF NOT EXISTS idx_auth_sessions_user ON auth_sessions (user_id);
+CREATE INDEX IF NOT EXISTS idx_auth_sessions_expires ON auth_sessions (expires_at);
+CREATE INDEX IF NOT EXISTS idx_auth_sessions_revoked ON auth_sessions (revoked_at) WHERE revoked_at IS NOT NULL;
 CREATE INDEX IF NOT EXISTS idx_projects_owner ON projects (owner_user_id);
+-- Контекст организаций пользователя (app/orgs.py) и список проектов организации
+CREATE INDEX IF NOT EXISTS idx_organizations_owner ON organizations (owner_user_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_organization_members_user ON organization_members (user_id, organization_id) WHERE is_active;
+CREATE INDEX IF NOT EXISTS idx_projects_org_updated ON projects (organization_id, updated_at DESC) WHERE deleted_at IS NULL;
 CREATE INDEX IF NOT EXISTS idx_projects_updated_at ON projects (updated_at DESC);
-CREATE INDEX IF NOT EXISTS idx_chats_owner ON chats (owner_user_id);
+CREATE INDEX IF NOT EXISTS idx_chats_owner ON chats (owner_user_id, id);
 CREATE INDEX IF NOT EXISTS idx_chats_project ON chats (project_id);
+CREATE INDEX IF NOT EXISTS idx_chat_members_user ON chat_members (user_id, chat_id);
+CREATE INDEX IF NOT EXISTS idx_project_members_user ON project_members (user_id, project_id);
+CREATE INDEX IF NOT EXISTS idx_chat_tags_tag_chat ON chat_tags (tag_id, chat_id);
 CREATE INDEX IF NOT EXISTS idx_chats_updated_at ON chats (updated_at DESC);
-CREATE INDEX IF NOT EXISTS idx_messages_chat ON messages (chat_id);
+CREATE INDEX IF NOT EXISTS idx_chats_owner_updated ON chats (owner_user_id, updated_at DESC);
+CREATE INDEX IF NOT EXISTS idx_messages_chat_created ON messages (chat_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_messages_chat ON messages (chat_id, id);
+CREATE INDEX IF NOT EXISTS idx_messages_parent ON messages (parent_id, id) WHERE parent_id IS NOT NULL;
 CREATE INDEX IF NOT EXISTS idx_messages_created_at ON messages (created_at DESC);
-CREATE INDEX IF NOT EXISTS idx_usage_events_org ON usage_events (organization_id);
+-- Кандидаты на компакцию: частичные индексы покрывают только удалённые/архивные строки
+CREATE INDEX IF NOT EXISTS idx_chats_deleted_at ON chats (deleted_at) WHERE deleted_at IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_chats_archived_updated ON chats (updated_at) WHERE status = 'archived';
+CREATE INDEX IF NOT EXISTS idx_messages_deleted_at ON messages (deleted_at) WHERE deleted_at IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs (priority, run_at, id) WHERE status = 'queued';
+CREATE INDEX IF NOT EXISTS idx_jobs_running ON jobs (locked_at) WHERE status = 'running';
+CREATE UNIQUE INDEX IF NOT EXISTS uq_jobs_dedupe_queued ON jobs (dedupe_key) WHERE status = 'queued';
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires ON idempotency_keys (expires_at);
+CREATE INDEX IF NOT EXISTS idx_chat_stats_last_message ON chat_stats (last_message_at);
+CREATE INDEX IF NOT EXISTS idx_chats_archive_owner ON chats_archive (owner_user_id);
+CREATE INDEX IF NOT EXISTS idx_messages_archive_chat ON messages_archive (chat_id, id);
+CREATE INDEX IF NOT EXISTS idx_chat_members_archive_user ON chat_members_archive (user_id);
+CREATE INDEX IF NOT EXISTS idx_usage_events_org_happened ON usage_events (organization_id, happened_at);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_invoices_org_period ON invoices (organization_id, period_from, period_to);
 CREATE INDEX IF NOT EXISTS idx_usage_events_model ON usage_events (model_id);
 CREATE INDEX IF NOT EXISTS idx_usage_events_happened_at ON usage_events (happened_at DESC);
 
@@ -20,6 +53,10 @@ CREATE INDEX IF NOT EXISTS idx_users_settings_gin ON users USING gin (settings);
 CREATE INDEX IF NOT EXISTS idx_messages_meta_gin ON messages USING gin (meta);
 CREATE INDEX IF NOT EXISTS idx_usage_events_meta_gin ON usage_events USING gin (meta);
 
+-- Триграммные индексы: поиск пользователей по подстроке (LIKE '%...%')
+CREATE INDEX IF NOT EXISTS idx_users_username_trgm ON users USING gin (lower(username::text) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_users_email_trgm ON users USING gin (lower(email::text) gin_trgm_ops);
+
 -- BRIN индексы 
 CREATE INDEX IF NOT EXISTS idx_messages_created_at_brin ON messages USING brin (created_at);
 CREATE INDEX IF NOT EXISTS idx_usage_events_happened_at_brin ON usage_events USING brin (happened_at);
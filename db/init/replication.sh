@@ -0,0 +1,3 @@
+#!/bin/sh
+# Разрешаем потоковую репликацию: реплика из docker-compose (профиль replica) подключается по pg_basebackup
+echo "host replication all all scram-sha-256" >> "$PGDATA/pg_hba.conf"
@@ -39,4 +39,18 @@ LEFT JOIN models m ON m.id = ue.model_id
 GROUP BY date_trunc('day', ue.happened_at), m.name
 ORDER BY day DESC, model_name;
 
+-- То же из предагрегатов: суточные корзины строго по UTC, без полного прохода по usage_events
+CREATE OR REPLACE VIEW view_daily_model_usage_rollup AS
+SELECT
+  r.day::timestamp AT TIME ZONE 'UTC' AS day,
+  m.name AS model_name,
+  SUM(r.calls) AS calls,
+  SUM(r.tokens_in) AS tokens_in,
+  SUM(r.tokens_out) AS tokens_out,
+  SUM(r.cost) AS cost
+FROM usage_rollup_daily r
+LEFT JOIN models m ON m.id = r.model_id
+GROUP BY r.day, m.name
+ORDER BY day DESC, model_name;
+
 COMMIT;
@@ -39,7 +39,7 @@ export default function Plan() {
     <div className="pageScroll" style={{ maxWidth: 640, margin: "0 auto" }}>
       <h2 style={{ marginTop: 6 }}>Plan</h2>
       <p style={{ color: "var(--muted)" }}>
-        Switch between Free, Pro, and Enterprise. This only updates your stored plan name.
+        Switch between Free, Pro, and Enterprise. The plan sets your message rate limit and daily token quota.
       </p>
 
       {loading ? (
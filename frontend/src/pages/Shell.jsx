@@ -136,7 +136,11 @@ export default function Shell() {
               </div>
               {visibleChats.map((c) => (
                 <div className="listItem" key={c.id}>
-                  <NavLink to={`/app/chat/${c.id}`} className={({ isActive }) => `listLink ${isActive ? "activeRow" : ""}`}>
+                  <NavLink
+                    to={`/app/chat/${c.id}`}
+                    title={c.last_message_preview || ""}
+                    className={({ isActive }) => `listLink ${isActive ? "activeRow" : ""}`}
+                  >
                     <span className="listLinkTitle">{c.title}</span>
                   </NavLink>
                   <span className="badge">{c.model_name}</span>